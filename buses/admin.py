@@ -1,7 +1,19 @@
 from django.contrib import admin
 from .models import Bus
+from routes.network import invalidate_transit_network
+from routes.search import invalidate_search_index
+from routes.timetable import invalidate_timetable
 from tracking.admin import LiveLocationInline
 
+
+def _invalidate_planner(queryset):
+    # queryset.update() sends no post_save, so drop what routes.signals would have
+    invalidate_transit_network()
+    invalidate_timetable(list(queryset.values_list('id', flat=True)))
+    # Active buses rank higher in the typeahead
+    invalidate_search_index()
+
+
 @admin.register(Bus)
 class BusAdmin(admin.ModelAdmin):
     list_display = ('bus_number', 'route', 'is_active', 'get_current_location')
@@ -37,10 +49,12 @@ class BusAdmin(admin.ModelAdmin):
     
     def activate_buses(self, request, queryset):
         updated = queryset.update(is_active=True)
+        _invalidate_planner(queryset)
         self.message_user(request, f'{updated} bus(es) activated successfully.')
     activate_buses.short_description = 'Activate selected buses'
     
     def deactivate_buses(self, request, queryset):
         updated = queryset.update(is_active=False)
+        _invalidate_planner(queryset)
         self.message_user(request, f'{updated} bus(es) deactivated successfully.')
     deactivate_buses.short_description = 'Deactivate selected buses'
@@ -1,5 +1,20 @@
 from django.db import models
 
+# Bus numbers are allocated in blocks per city: 1xx Bhubaneswar, 2xx Puri, ...
+CITY_PREFIXES = {
+    '1': "Bhubaneswar",
+    '2': "Puri",
+    '3': "Berhampur",
+    '4': "Cuttack",
+}
+DEFAULT_CITY = "Odisha"
+
+
+def city_for_bus_number(bus_number):
+    """Derive city from bus number pattern"""
+    return CITY_PREFIXES.get(str(bus_number)[:1], DEFAULT_CITY)
+
+
 class Bus(models.Model):
     bus_number = models.CharField(max_length=10)
     is_active = models.BooleanField(default=True)
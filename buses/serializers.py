@@ -1,7 +1,24 @@
 from rest_framework import serializers
-from .models import Bus
-from tracking.models import LiveLocation
-from stops.models import Stop
+from .models import Bus, city_for_bus_number
+from routes.geometry import get_route_geometries, get_route_geometry
+from tracking.fleet_state import load_live_location, load_live_locations
+from tracking.utils import haversine
+
+# Same speed as BusETAView so list ETAs match the tracking API
+ETA_BUS_SPEED = 60
+
+
+class BusListSerializer(serializers.ListSerializer):
+    """
+    Loads live locations and route stops for the whole page up front,
+    so the list costs the same number of queries for 10 or 1,000 buses.
+    """
+    def to_representation(self, data):
+        buses = list(data.all() if hasattr(data, 'all') else data)
+        self.child.context['live_locations'] = load_live_locations([b.id for b in buses])
+        self.child.context['geometries'] = get_route_geometries(b.route_id for b in buses if b.route_id)
+        return super().to_representation(buses)
+
 
 class BusSerializer(serializers.ModelSerializer):
     next_stop = serializers.SerializerMethodField()
@@ -12,36 +29,47 @@ class BusSerializer(serializers.ModelSerializer):
     class Meta:
         model = Bus
         fields = ['id', 'bus_number', 'is_active', 'next_stop', 'eta', 'city']
+        list_serializer_class = BusListSerializer
+
+    def _live_and_geometry(self, obj):
+        if 'live_locations' in self.context:
+            live = self.context['live_locations'].get(obj.id)
+            geometry = self.context['geometries'].get(obj.route_id) if obj.route_id else None
+        else:
+            live = load_live_location(obj.id)
+            geometry = get_route_geometry(obj.route_id) if obj.route_id else None
+        return live, geometry
+
+    def _next_stop_index(self, obj):
+        live, geometry = self._live_and_geometry(obj)
+        if not live or not geometry or not len(geometry):
+            return None, None, None
+
+        # Simple next stop logic
+        idx = live.current_stop_index
+        if live.is_moving_forward:
+            next_idx = idx + 1 if idx < len(geometry) - 1 else idx - 1
+        else:
+            next_idx = idx - 1 if idx > 0 else idx + 1
+
+        # Safety check
+        if 0 <= next_idx < len(geometry):
+            return live, geometry, next_idx
+        return None, None, None
 
     def get_next_stop(self, obj):
-        live = LiveLocation.objects.filter(bus=obj).first()
-        if live and obj.route:
-            stops = list(Stop.objects.filter(route=obj.route).order_by('order'))
-            if stops:
-                try:
-                    # Simple next stop logic
-                    idx = live.current_stop_index
-                    if live.is_moving_forward:
-                        next_idx = idx + 1 if idx < len(stops) - 1 else idx - 1
-                    else:
-                        next_idx = idx - 1 if idx > 0 else idx + 1
-                    
-                    # Safety check
-                    if 0 <= next_idx < len(stops):
-                        return stops[next_idx].name
-                except:
-                    pass
-        return "Not Started"
+        _, geometry, next_idx = self._next_stop_index(obj)
+        if next_idx is None:
+            return "Not Started"
+        return geometry.names[next_idx]
 
     def get_city(self, obj):
-        num = str(obj.bus_number)
-        if num.startswith('1'): return "Bhubaneswar"
-        if num.startswith('2'): return "Puri"
-        if num.startswith('3'): return "Berhampur"
-        if num.startswith('4'): return "Cuttack"
-        return "Odisha"
+        return city_for_bus_number(obj.bus_number)
 
     def get_eta(self, obj):
-        # Dummy ETA logic for list view (detailed ETA is in tracking API)
-        return "5 min"
-
+        """Minutes from the live position to the next stop (detailed ETAs are in the tracking API)"""
+        live, geometry, next_idx = self._next_stop_index(obj)
+        if next_idx is None:
+            return "N/A"
+        dist = haversine(live.latitude, live.longitude, geometry.lats[next_idx], geometry.lngs[next_idx])
+        return f"{max(1, round(dist / ETA_BUS_SPEED * 60))} min"
@@ -1,3 +1,91 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from routes import versions
+from routes.geometry import invalidate_route_geometry
+from routes.models import Route
+from routes.search import get_search_index
+from stops.models import Stop
+from tracking.models import LiveLocation
+from .models import Bus
+
+
+@override_settings(FLEET_STATE_ENABLED=False)
+class BusListQueryCountTests(TestCase):
+    """GET /api/buses/ must cost the same number of queries however many buses exist."""
+
+    # buses page + live locations + stops of every route on the page
+    EXPECTED_QUERIES = 3
+
+    def setUp(self):
+        self.routes = [Route.objects.create(name=f"Route {r}") for r in range(3)]
+        Stop.objects.bulk_create([
+            Stop(route=route, name=f"R{route.id} Stop {i}", latitude=20.0 + i * 0.01, longitude=85.8, order=i)
+            for route in self.routes
+            for i in range(8)
+        ])
+
+    def _create_buses(self, count):
+        buses = Bus.objects.bulk_create([
+            Bus(bus_number=str(100 + i), route=self.routes[i % len(self.routes)])
+            for i in range(count)
+        ])
+        LiveLocation.objects.bulk_create([
+            LiveLocation(bus=bus, latitude=20.0, longitude=85.8, current_stop_index=i % 8)
+            for i, bus in enumerate(buses)
+        ])
+
+    def _assert_constant_queries(self, count):
+        self._create_buses(count)
+        invalidate_route_geometry()
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get('/api/buses/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), count)
+        return response.json()
+
+    def test_10_buses(self):
+        data = self._assert_constant_queries(10)
+        first = data[0]
+        self.assertEqual(first['next_stop'], f"R{self.routes[0].id} Stop 1")
+        self.assertTrue(first['eta'].endswith(' min'))
+
+    def test_1000_buses(self):
+        self._assert_constant_queries(1000)
+
+
+class BusAdminActionTests(TestCase):
+    """The bulk actions use queryset.update(), so they must drop the caches themselves."""
+
+    def setUp(self):
+        route = Route.objects.create(name="Route 1")
+        self.bus = Bus.objects.create(bus_number="501", route=route)
+        admin_user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin_user)
+
+    def _run_action(self, action):
+        return self.client.post('/admin/buses/bus/', {
+            'action': action,
+            '_selected_action': [self.bus.id],
+        })
+
+    def test_deactivate_action_reweights_the_search_index(self):
+        self.assertEqual(get_search_index().buses.weights["501"], 2)
+        before = versions.current(versions.SEARCH)
+
+        response = self._run_action('deactivate_buses')
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Bus.objects.get(pk=self.bus.pk).is_active)
+        self.assertGreater(versions.current(versions.SEARCH), before)
+        self.assertEqual(get_search_index().buses.weights["501"], 1)
+
+    def test_activate_action_reweights_the_search_index(self):
+        self.bus.is_active = False
+        self.bus.save()
+        self.assertEqual(get_search_index().buses.weights["501"], 1)
+
+        self._run_action('activate_buses')
+
+        self.assertTrue(Bus.objects.get(pk=self.bus.pk).is_active)
+        self.assertEqual(get_search_index().buses.weights["501"], 2)
@@ -2,8 +2,10 @@ from rest_framework import generics
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from django.views.decorators.http import condition
 from .models import Bus
 from .serializers import BusSerializer   # 🔥 ye import important hai
+from routes.conditional import bus_route_etag, bus_route_last_modified
 
 class BusListCreateView(generics.ListCreateAPIView):
     queryset = Bus.objects.all()
@@ -50,7 +52,14 @@ def update_bus(request, bus_id):
 # =========================
 # GET BUS SCHEDULE
 # =========================
+def schedule_etag(request, bus_no):
+    # The generated schedule only depends on the route's stops
+    etag = bus_route_etag(request, bus_no)
+    return f"schedule-{etag}" if etag else None
+
+
 @api_view(['GET'])
+@condition(etag_func=schedule_etag, last_modified_func=bus_route_last_modified)
 def get_bus_schedule(request, bus_no):
     """
     GET: Returns schedule for a bus
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Route
+from .models import FareRule, Route
 from stops.models import Stop
 from buses.models import Bus
 
@@ -33,3 +33,10 @@ class RouteAdmin(admin.ModelAdmin):
     def get_active_buses(self, obj):
         return obj.buses.filter(is_active=True).count()
     get_active_buses.short_description = 'Active Buses'
+
+
+@admin.register(FareRule)
+class FareRuleAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'minimum_fare', 'per_km_rate', 'transfer_minimum_fare', 'updated_at')
+    list_select_related = ('route',)
+    autocomplete_fields = ('route',)
@@ -0,0 +1,100 @@
+"""
+Batch origin-destination planning for analytics (plan_batch command and
+BatchPlanView).
+
+Every pair is planned against one loaded TransitNetwork and reported as one
+NDJSON line: the best trip's fare, stops and transfers, or an error. With
+workers > 1 the pairs are split into chunks and planned in forked processes,
+which inherit the already built network instead of loading their own. Where
+fork is not available (Windows) the pairs are planned in this process.
+"""
+import csv
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connections
+
+from .network import get_transit_network
+from .planner import plan_trip
+
+# Pairs per task handed to a worker process
+CHUNK_SIZE = 200
+HEADER_NAMES = {"from", "origin", "from_stop"}
+
+
+def read_pairs(rows):
+    """
+    (from, to) tuples from CSV rows or JSON items: ["A", "B"] lists or
+    {"from": "A", "to": "B"} objects. A CSV header row is skipped.
+    Raises ValueError naming the first bad row (1-based).
+    """
+    pairs = []
+    for i, row in enumerate(rows, start=1):
+        if isinstance(row, dict):
+            row = [row.get("from", ""), row.get("to", "")]
+        if not isinstance(row, (list, tuple)) or len(row) < 2:
+            raise ValueError(f"Row {i}: expected a 'from' and a 'to' stop")
+        origin, destination = str(row[0]).strip(), str(row[1]).strip()
+        if i == 1 and origin.lower() in HEADER_NAMES:
+            continue
+        if not origin or not destination:
+            raise ValueError(f"Row {i}: expected a 'from' and a 'to' stop")
+        pairs.append((origin, destination))
+    return pairs
+
+
+def read_csv(lines):
+    return read_pairs(row for row in csv.reader(lines) if row)
+
+
+def _summary(origin, destination, results, full):
+    line = {"from": origin, "to": destination}
+    if results is None:
+        line["error"] = "Stops not found"
+        return line
+    line["options"] = len(results)
+    if results:
+        best = results[0]
+        bus_legs = [leg for leg in best.get("legs", ()) if leg.get("mode") != "walk"]
+        line.update({
+            "type": best["type"],
+            "start_stop": best["start_stop"],
+            "end_stop": best["end_stop"],
+            "stops": best.get("stops_count", best.get("total_stops")),
+            "transfers": max(len(bus_legs) - 1, 0),
+            "fare_estimate": best["fare_estimate"],
+        })
+    if full:
+        line["results"] = results
+    return line
+
+
+def _plan_chunk(pairs, max_transfers, full):
+    net = get_transit_network()
+    return [
+        _summary(a, b, plan_trip(a, b, max_transfers, network=net), full)
+        for a, b in pairs
+    ]
+
+
+def plan_pairs(pairs, max_transfers=None, full=False, workers=1):
+    """Yield one summary dict per pair, in input order."""
+    net = get_transit_network()
+    if workers <= 1 or len(pairs) <= CHUNK_SIZE or "fork" not in multiprocessing.get_all_start_methods():
+        for a, b in pairs:
+            yield _summary(a, b, plan_trip(a, b, max_transfers, network=net), full)
+        return
+
+    # Forked children share the parent's network; they must not share its DB sockets
+    connections.close_all()
+    chunks = [pairs[i:i + CHUNK_SIZE] for i in range(0, len(pairs), CHUNK_SIZE)]
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for lines in pool.map(_plan_chunk, chunks, [max_transfers] * len(chunks), [full] * len(chunks)):
+            yield from lines
+
+
+def to_ndjson(lines):
+    for line in lines:
+        yield json.dumps(line, ensure_ascii=False) + "\n"
@@ -0,0 +1,49 @@
+"""
+Validators for conditional GET (ETag / Last-Modified) on route-shaped responses.
+
+Every function takes the view's (request, **kwargs) so it can be passed straight
+to django.views.decorators.http.condition. They only read Route.updated_at,
+never the stop list, so an unchanged resource answers 304 with one small query
+(memoised on the request, since condition() asks for both validators).
+"""
+from django.db.models import Count, Max
+
+from buses.models import Bus
+from .models import Route
+
+
+def _bus_route(request, bus_no):
+    if not hasattr(request, '_validator_route'):
+        bus = Bus.objects.filter(bus_number=str(bus_no)).select_related('route').first()
+        request._validator_route = bus.route if bus else None
+    return request._validator_route
+
+
+def bus_route_etag(request, bus_no):
+    route = _bus_route(request, bus_no)
+    if route is None:
+        return None
+    return f"route-{route.id}-{route.updated_at.timestamp()}"
+
+
+def bus_route_last_modified(request, bus_no):
+    route = _bus_route(request, bus_no)
+    return route.updated_at if route else None
+
+
+def _route_list_summary(request):
+    if not hasattr(request, '_validator_routes'):
+        # Count catches deletions, which leave no newer updated_at behind
+        request._validator_routes = Route.objects.aggregate(latest=Max('updated_at'), total=Count('id'))
+    return request._validator_routes
+
+
+def route_list_etag(request):
+    summary = _route_list_summary(request)
+    if summary['latest'] is None:
+        return None
+    return f"routes-{summary['total']}-{summary['latest'].timestamp()}"
+
+
+def route_list_last_modified(request):
+    return _route_list_summary(request)['latest']
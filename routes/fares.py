@@ -0,0 +1,68 @@
+"""
+Fare tables for the trip planner, built from FareRule rows.
+
+Every route gets a precomputed stop x stop fare matrix, derived in one numpy
+pass from its cumulative distance array (RouteGeometry.cum_km), so pricing a
+ride is an array lookup. Tables are part of the TransitNetwork and rebuilt
+for all routes at once when a rule changes (routes.network.reprice_transit_network).
+"""
+import numpy as np
+
+# Used when no default FareRule row exists yet
+DEFAULT_MINIMUM_FARE = 5
+DEFAULT_PER_KM_RATE = 5.0
+DEFAULT_TRANSFER_MINIMUM_FARE = 10
+
+
+def distance_fare(km, minimum_fare=DEFAULT_MINIMUM_FARE, per_km_rate=DEFAULT_PER_KM_RATE):
+    return max(minimum_fare, round(km * per_km_rate))
+
+
+class FareTable:
+    """
+    rules[route_id]     -> (minimum_fare, per_km_rate) for the route
+    matrices[route_id]  -> int32 fares between stop indexes of the route
+    """
+
+    def __init__(self, geometries, rules=()):
+        rules = sorted(rules, key=lambda r: r.id or 0)
+        defaults = [r for r in rules if r.route_id is None]
+        if defaults:
+            # The oldest default rule wins
+            self.default = (defaults[0].minimum_fare, defaults[0].per_km_rate)
+            self.transfer_minimum_fare = defaults[0].transfer_minimum_fare
+        else:
+            self.default = (DEFAULT_MINIMUM_FARE, DEFAULT_PER_KM_RATE)
+            self.transfer_minimum_fare = DEFAULT_TRANSFER_MINIMUM_FARE
+        overrides = {r.route_id: (r.minimum_fare, r.per_km_rate) for r in rules if r.route_id is not None}
+
+        self.rules = {route_id: overrides.get(route_id, self.default) for route_id in geometries}
+        self.matrices = {}
+        for route_id, geometry in geometries.items():
+            minimum_fare, per_km_rate = self.rules[route_id]
+            km = np.abs(geometry.cum_km[:, None] - geometry.cum_km[None, :])
+            self.matrices[route_id] = np.maximum(minimum_fare, np.rint(km * per_km_rate)).astype(np.int32)
+
+    def fare(self, route_id, i, j):
+        """Fare between stop indexes i and j of a route."""
+        return int(self.matrices[route_id][i, j])
+
+    def ride_fare(self, route_id, km):
+        return distance_fare(km, *self.rules.get(route_id, self.default))
+
+    def transfer_fare(self, rides):
+        """Fare for a trip with transfers; `rides` is [(route_id, km)], one per bus."""
+        rates = {self.rules.get(route_id, self.default)[1] for route_id, _ in rides}
+        if len(rates) == 1:
+            amount = sum(km for _, km in rides) * rates.pop()
+        else:
+            amount = sum(km * self.rules.get(route_id, self.default)[1] for route_id, km in rides)
+        return max(self.transfer_minimum_fare, round(amount))
+
+    def rule(self, route_id):
+        minimum_fare, per_km_rate = self.rules.get(route_id, self.default)
+        return {
+            "minimum_fare": minimum_fare,
+            "per_km_rate": per_km_rate,
+            "transfer_minimum_fare": self.transfer_minimum_fare,
+        }
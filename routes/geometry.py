@@ -0,0 +1,146 @@
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+from threading import Lock
+
+import numpy as np
+
+from stops.models import Stop
+from tracking.utils import segment_distances
+from . import versions
+
+
+class RouteGeometry:
+    """
+    Compiled, read-only view of one route: ordered stop coordinates plus a
+    cumulative distance array (KM from the first stop).
+    Any distance along the route is a subtraction instead of a haversine loop.
+    """
+
+    __slots__ = ('route_id', 'stop_ids', 'names', 'orders', 'lats', 'lngs', 'cum_km')
+
+    def __init__(self, route_id, stops):
+        self.route_id = route_id
+        self.stop_ids = [s.id for s in stops]
+        self.names = [s.name for s in stops]
+        self.orders = [s.order for s in stops]
+        self.lats = np.array([s.latitude for s in stops], dtype=np.float64)
+        self.lngs = np.array([s.longitude for s in stops], dtype=np.float64)
+        self.cum_km = np.concatenate(([0.0], np.cumsum(segment_distances(self.lats, self.lngs))))
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    @property
+    def total_km(self):
+        return float(self.cum_km[-1])
+
+    def distance_between_indexes(self, i, j):
+        """Along-route distance (KM) between two stop indexes."""
+        return float(abs(self.cum_km[j] - self.cum_km[i]))
+
+    def index_range_for_orders(self, start_order, end_order):
+        """
+        First/last stop index whose `order` falls inside [start_order, end_order].
+        Same stops as Stop.objects.filter(order__gte=..., order__lte=...).
+        """
+        s_ord = min(start_order, end_order)
+        e_ord = max(start_order, end_order)
+        lo = bisect_left(self.orders, s_ord)
+        hi = bisect_right(self.orders, e_ord) - 1
+        return lo, hi
+
+    def distance_between_orders(self, start_order, end_order):
+        """Along-route distance (KM) between the stops with the given `order` values."""
+        if start_order == end_order:
+            return 0
+        lo, hi = self.index_range_for_orders(start_order, end_order)
+        if hi <= lo:
+            return 0
+        return float(self.cum_km[hi] - self.cum_km[lo])
+
+
+# =========================
+# PER-PROCESS CACHE
+# =========================
+# route_id -> RouteGeometry. The Stop/Route signals in routes.signals clear it in
+# the writing worker and bump the shared geometry version; every other worker
+# clears its cache when it sees the new version, and rebuilds routes lazily.
+_cache = {}
+_cache_version = None
+_lock = Lock()
+
+
+def _cached_version():
+    """Shared geometry version, after dropping a cache built at an older one."""
+    global _cache_version
+    version = versions.current(versions.GEOMETRY)
+    if version != _cache_version:
+        with _lock:
+            _cache.clear()
+            _cache_version = version
+    return version
+
+
+def _store(version, geometries):
+    # A build that raced with an invalidation may hold old stops: don't keep it
+    with _lock:
+        if version == _cache_version:
+            _cache.update(geometries)
+
+
+def get_route_geometry(route_id):
+    """Return the compiled geometry for a route, building it on first use."""
+    version = _cached_version()
+    geometry = _cache.get(route_id)
+    if geometry is not None:
+        return geometry
+
+    stops = list(Stop.objects.filter(route_id=route_id).order_by('order'))
+    geometry = RouteGeometry(route_id, stops)
+    _store(version, {route_id: geometry})
+    return geometry
+
+
+def get_route_geometries(route_ids):
+    """
+    Bulk version of get_route_geometry: {route_id: RouteGeometry}.
+    Every route missing from the cache is built from a single Stop query.
+    """
+    version = _cached_version()
+    found = {}
+    missing = []
+    for route_id in set(route_ids):
+        geometry = _cache.get(route_id)
+        if geometry is None:
+            missing.append(route_id)
+        else:
+            found[route_id] = geometry
+
+    if missing:
+        stops = Stop.objects.filter(route_id__in=missing).order_by('route_id', 'order')
+        by_route = {
+            route_id: list(group)
+            for route_id, group in groupby(stops, key=lambda s: s.route_id)
+        }
+        built = {route_id: RouteGeometry(route_id, by_route.get(route_id, [])) for route_id in missing}
+        _store(version, built)
+        found.update(built)
+
+    return found
+
+
+def invalidate_route_geometry(route_id=None):
+    """
+    Drop one compiled route, or all of them when route_id is None, here and
+    (all of them) in every other worker.
+    """
+    global _cache_version
+    with _lock:
+        if route_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(route_id, None)
+    version = versions.bump(versions.GEOMETRY)
+    with _lock:
+        if _cache_version == version - 1:
+            _cache_version = version
@@ -0,0 +1,123 @@
+"""
+Reachability (isochrones) over the in-memory TransitNetwork.
+
+Round-based like planner.search_journeys, but every label is minutes from
+the origin: riding costs the along-route distance at AVG_BUS_SPEED_KMPH,
+changing buses within a stop place TRANSFER_MINUTES, and a footpath its
+walking time. Labels past the minute budget are never set, so a search only
+touches the part of the network it can reach.
+"""
+from django.conf import settings
+
+from .timetable import TRANSFER_MINUTES
+
+INF = float('inf')
+COORDINATE_DECIMALS = 5  # ~1 m
+
+
+def reachable(net, sources, max_minutes=INF, max_transfers=3, speed_kmph=None):
+    """
+    {node: (minutes, transfers)} for every node reachable from `sources`
+    within `max_minutes` using at most `max_transfers` transfers. The
+    sources, and the other stops of their places, are included at 0.
+    """
+    speed = speed_kmph or getattr(settings, 'AVG_BUS_SPEED_KMPH', 30)
+    minutes_per_km = 60 / speed
+    best = [INF] * len(net)
+    found = {}
+
+    def settle(v, t, k):
+        if t < best[v] and t <= max_minutes:
+            best[v] = t
+            found[v] = (t, k)
+            return True
+        return False
+
+    marked = set()
+    for s in sources:
+        for v in [s] + net.transfers[s]:
+            if settle(v, 0.0, 0):
+                marked.add(v)
+    for s in list(marked):
+        for w, minutes in net.footpaths(s):
+            if settle(w, minutes, 0):
+                marked.add(w)
+
+    position = net.position
+    cum_km = {}  # route_id -> cumulative KM as a list (faster scalar reads)
+    for k in range(max_transfers + 1):
+        prev = list(best)
+        queue = {}
+        for node in marked:
+            for p in net.patterns_of[node]:
+                pos = net.pattern_position(p, node)
+                if pos < queue.get(p, INF):
+                    queue[p] = pos
+
+        improved = set()
+        for p, start in queue.items():
+            route_id, _, nodes = net.patterns[p]
+            km = cum_km.get(route_id)
+            if km is None:
+                km = cum_km[route_id] = net.geometries[route_id].cum_km.tolist()
+            board_time, board_km = INF, 0.0
+            for v in nodes[start:]:
+                t = board_time + abs(km[position[v]] - board_km) * minutes_per_km
+                if settle(v, t, k):
+                    improved.add(v)
+                if prev[v] < t:
+                    board_time, board_km = prev[v], km[position[v]]
+
+        for v in list(improved):
+            for w in net.transfers[v]:
+                if settle(w, best[v] + TRANSFER_MINUTES, k):
+                    improved.add(w)
+            for w, minutes in net.footpaths(v):
+                if settle(w, best[v] + minutes, k):
+                    improved.add(w)
+        if not improved:
+            break
+        marked = improved
+    return found
+
+
+def reachable_stops(net, found):
+    """Rows for the reachability response, nearest first."""
+    return [
+        {
+            "stop_id": net.stop_ids[v],
+            "name": net.names[v],
+            "route_name": net.route_names.get(net.route_of[v]),
+            "minutes": round(minutes, 1),
+            "transfers": transfers,
+            "latitude": net.lats[v],
+            "longitude": net.lngs[v],
+        }
+        for v, (minutes, transfers) in sorted(found.items(), key=lambda item: (item[1][0], item[0]))
+    ]
+
+
+def to_geojson(stops):
+    """Compact FeatureCollection of Points (coordinates rounded to ~1 m)."""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Point",
+                    "coordinates": [
+                        round(s["longitude"], COORDINATE_DECIMALS),
+                        round(s["latitude"], COORDINATE_DECIMALS),
+                    ],
+                },
+                "properties": {
+                    "stop_id": s["stop_id"],
+                    "name": s["name"],
+                    "minutes": s["minutes"],
+                    "transfers": s["transfers"],
+                },
+            }
+            for s in stops
+        ],
+    }
@@ -0,0 +1,86 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from routes.search import PrefixIndex, TrigramIndex, normalize, trigrams
+
+# Syllables and suffixes that read like Odisha place names
+SYLLABLES = ["bhu", "ba", "ne", "swar", "pu", "ri", "ka", "tak", "ber", "ham", "sam", "bal",
+             "pur", "ja", "ga", "nna", "tha", "ko", "nar", "ra", "pa", "tia", "li", "ngo",
+             "dha", "ma", "khan", "da", "gi", "ro", "kel", "sa", "ta", "chha"]
+SUFFIXES = ["Station", "Square", "Chhak", "Bus Stand", "Temple", "Market", "Colony", "Road", ""]
+
+
+def place_name(rng):
+    words = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).title()
+             for _ in range(rng.randint(1, 2))]
+    return " ".join(words + [rng.choice(SUFFIXES)]).strip()
+
+
+def misspell(rng, name):
+    """Drop, double or swap one letter per word, like riders typing on the move."""
+    words = []
+    for word in name.split():
+        i = rng.randrange(len(word))
+        edit = rng.choice(("drop", "double", "swap"))
+        if edit == "drop" and len(word) > 3:
+            word = word[:i] + word[i + 1:]
+        elif edit == "double":
+            word = word[:i] + word[i] + word[i:]
+        elif i < len(word) - 1:
+            word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+        words.append(word)
+    return " ".join(words)
+
+
+class Command(BaseCommand):
+    help = "Benchmark the stop-name search indexes on synthetic Odisha place names"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--names", type=int, default=50000)
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        names = list({place_name(rng) for _ in range(options["names"])})
+        targets = [rng.choice(names) for _ in range(options["queries"])]
+        queries = [misspell(rng, name) for name in targets]
+
+        started = time.perf_counter()
+        fuzzy = TrigramIndex(names)
+        trigram_build = time.perf_counter() - started
+
+        started = time.perf_counter()
+        prefix = PrefixIndex((name, 1) for name in names)
+        prefix_build = time.perf_counter() - started
+
+        self.stdout.write(f"{len(names)} distinct names")
+        self.stdout.write(f"build: trigram {trigram_build:.2f} s, prefix {prefix_build:.2f} s")
+
+        started = time.perf_counter()
+        found = [fuzzy.match(q, limit=5) for q in queries]
+        fuzzy_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        top1 = sum(1 for t, f in zip(targets, found) if f and f[0][0] == normalize(t))
+        top5 = sum(1 for t, f in zip(targets, found) if normalize(t) in [k for k, _ in f])
+
+        # Scoring every name, what the index avoids
+        sample = queries[:max(1, len(queries) // 10)]
+        grams = {name: trigrams(normalize(name)) for name in names}
+        started = time.perf_counter()
+        for q in sample:
+            qg = trigrams(normalize(q))
+            max(names, key=lambda n: len(qg & grams[n]))
+        scan_ms = (time.perf_counter() - started) * 1000 / len(sample)
+
+        prefix_us = []
+        for _ in ("cold", "memoized"):
+            started = time.perf_counter()
+            for q in queries:
+                prefix.search(q[:4])
+            prefix_us.append((time.perf_counter() - started) * 1e6 / len(queries))
+
+        self.stdout.write(f"fuzzy lookup: {fuzzy_ms:.3f} ms/query (full scan {scan_ms:.1f} ms/query)")
+        self.stdout.write(f"fuzzy recall: top-1 {top1 / len(queries):.1%}, top-5 {top5 / len(queries):.1%}")
+        self.stdout.write(f"prefix lookup: {prefix_us[0]:.1f} us/query cold, {prefix_us[1]:.1f} us/query memoized")
@@ -0,0 +1,41 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from routes.batch import plan_pairs, read_csv, to_ndjson
+from routes.planner import MAX_TRANSFERS
+
+
+class Command(BaseCommand):
+    help = "Plan every origin-destination pair of a CSV (from,to) and write NDJSON results"
+
+    def add_arguments(self, parser):
+        parser.add_argument("pairs", help="CSV file of from,to rows ('-' for stdin)")
+        parser.add_argument("--output", "-o", help="NDJSON file to write (default: stdout)")
+        parser.add_argument("--max-transfers", type=int, choices=range(MAX_TRANSFERS + 1))
+        parser.add_argument("--workers", type=int, default=1, help="Processes to plan with (where fork is available)")
+        parser.add_argument("--full", action="store_true", help="Include every trip option")
+
+    def handle(self, *args, **options):
+        try:
+            if options["pairs"] == "-":
+                pairs = read_csv(sys.stdin)
+            else:
+                with open(options["pairs"], newline="", encoding="utf-8-sig") as f:
+                    pairs = read_csv(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(e)
+
+        lines = to_ndjson(plan_pairs(
+            pairs, options["max_transfers"], options["full"], max(1, options["workers"]),
+        ))
+        started = time.perf_counter()
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as out:
+                out.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
+        elapsed = time.perf_counter() - started
+        self.stderr.write(f"Planned {len(pairs)} pairs in {elapsed:.2f} s")
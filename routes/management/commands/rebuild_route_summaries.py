@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from routes.summary import rebuild_route_summaries
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized RouteSummary row for every route"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_route_summaries()
+        self.stdout.write(f"Rebuilt {count} route summaries")
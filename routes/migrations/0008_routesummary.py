@@ -0,0 +1,40 @@
+# Generated by Django 4.2.25 on 2026-10-18 14:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_route_summaries(apps, schema_editor):
+    # compute_route_summary only reads columns that exist as of the dependencies below
+    from routes.summary import rebuild_route_summaries
+    rebuild_route_summaries()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0007_route_updated_at'),
+        ('buses', '0006_alter_bus_id_alter_schedule_id'),
+        ('stops', '0004_alter_stop_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteSummary',
+            fields=[
+                ('route', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='routes.route')),
+                ('first_stop_name', models.CharField(blank=True, max_length=100)),
+                ('last_stop_name', models.CharField(blank=True, max_length=100)),
+                ('stop_count', models.PositiveIntegerField(default=0)),
+                ('total_distance_km', models.FloatField(default=0)),
+                ('primary_bus_number', models.CharField(blank=True, max_length=10, null=True)),
+                ('city', models.CharField(max_length=50)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Route Summary',
+                'verbose_name_plural': 'Route Summaries',
+            },
+        ),
+        migrations.RunPython(backfill_route_summaries, migrations.RunPython.noop),
+    ]
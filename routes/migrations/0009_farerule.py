@@ -0,0 +1,29 @@
+# Generated by Django 4.2.25 on 2026-10-18 14:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0008_routesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FareRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minimum_fare', models.PositiveIntegerField(default=5)),
+                ('per_km_rate', models.FloatField(default=5)),
+                ('transfer_minimum_fare', models.PositiveIntegerField(default=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('route', models.OneToOneField(blank=True, help_text='Leave empty for the default rule', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='fare_rule', to='routes.route')),
+            ],
+            options={
+                'verbose_name': 'Fare Rule',
+                'verbose_name_plural': 'Fare Rules',
+            },
+        ),
+    ]
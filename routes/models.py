@@ -3,6 +3,8 @@ from buses.models import Bus
 
 class Route(models.Model):
     name = models.CharField(max_length=100)
+    # Bumped whenever the route, its stops or its buses change (see routes.signals)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = "Route"
@@ -10,3 +12,71 @@ class Route(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class RouteSummary(models.Model):
+    """
+    Denormalized per-route figures shown in route lists.
+    Kept current by routes.signals; rebuild with `manage.py rebuild_route_summaries`.
+    """
+    route = models.OneToOneField(
+        Route,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="summary"
+    )
+    first_stop_name = models.CharField(max_length=100, blank=True)
+    last_stop_name = models.CharField(max_length=100, blank=True)
+    stop_count = models.PositiveIntegerField(default=0)
+    total_distance_km = models.FloatField(default=0)
+    primary_bus_number = models.CharField(max_length=10, null=True, blank=True)
+    city = models.CharField(max_length=50)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Route Summary"
+        verbose_name_plural = "Route Summaries"
+
+    def __str__(self):
+        return f"{self.route.name}: {self.first_stop_name} → {self.last_stop_name}"
+
+
+class FareRule(models.Model):
+    """
+    Fare for a ride of `km` on one bus: max(minimum_fare, round(km * per_km_rate)).
+    The rule without a route applies to every route without its own rule, and
+    its transfer_minimum_fare is the least a trip with transfers costs.
+    Saving a rule reprices the planner's fare tables (see routes.fares).
+    """
+    route = models.OneToOneField(
+        Route,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="fare_rule",
+        help_text="Leave empty for the default rule"
+    )
+    minimum_fare = models.PositiveIntegerField(default=5)
+    per_km_rate = models.FloatField(default=5)
+    transfer_minimum_fare = models.PositiveIntegerField(default=10)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Fare Rule"
+        verbose_name_plural = "Fare Rules"
+
+    def __str__(self):
+        scope = self.route.name if self.route else "Default"
+        return f"{scope}: min {self.minimum_fare}, {self.per_km_rate}/km"
+
+
+class CacheVersion(models.Model):
+    """
+    Shared version counter of one kind of per-process planner data
+    (see routes.versions). Bumped on every write that invalidates it.
+    """
+    name = models.CharField(max_length=32, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
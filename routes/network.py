@@ -0,0 +1,257 @@
+"""
+In-memory transit graph used by the trip planner.
+
+Built once from every Stop, Route and active Bus (three queries) and then
+shared by all planning requests in the process until a Stop, Route or Bus
+changes (see routes.signals), in this worker or any other (routes.versions).
+Stops are graph nodes, numbered 0..n-1.
+"""
+from collections import defaultdict
+from itertools import groupby
+from threading import Lock
+
+import numpy as np
+from django.conf import settings
+
+from buses.models import Bus
+from stops.models import Stop
+from tracking.utils import GridIndex
+from . import versions
+from .fares import FareTable
+from .geometry import RouteGeometry
+from .models import FareRule, Route
+from .search import TrigramIndex, normalize
+
+# Stops closer than this many degrees (~1 m) are treated as the same spot
+COLOCATED_PRECISION = 5
+
+
+class TransitNetwork:
+    """
+    Nodes (stops) with their route position, plus:
+      route_nodes[route_id]  -> node indexes in route order
+      patterns[p]            -> (route_id, reverse, nodes in travel order)
+      patterns_of[node]      -> patterns serving the node
+      geometries[route_id]   -> RouteGeometry (cumulative distances)
+      name_index[key]        -> node indexes sharing a normalized name
+      place_of[node]         -> StopPlace id (None until clustered)
+      transfers[node]        -> nodes of the same place on other routes
+      footpaths(node)        -> (node, walk minutes) for other routes' stops
+                                within walking distance, stored as CSR arrays
+      fares                  -> FareTable (per-route stop x stop fares)
+      grid                   -> GridIndex of node positions (nearby stops)
+    """
+
+    def __init__(self, stops, routes, buses, walk_radius_m=None, fare_rules=()):
+        stops = sorted(stops, key=lambda s: (s.route_id, s.order, s.id))
+        self.stop_ids = [s.id for s in stops]
+        self.names = [s.name for s in stops]
+        self.keys = [normalize(s.name) for s in stops]
+        self.route_of = [s.route_id for s in stops]
+        self.orders = [s.order for s in stops]
+        self.lats = [s.latitude for s in stops]
+        self.lngs = [s.longitude for s in stops]
+        self.node_of_stop = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        self._trigrams = None  # built on the first misspelled lookup
+
+        self.route_names = {r.id: r.name for r in routes}
+        self.route_buses = defaultdict(list)
+        self.bus_numbers = {}
+        for bus in sorted(buses, key=lambda b: b.id):
+            self.route_buses[bus.route_id].append(bus.bus_number)
+            self.bus_numbers[bus.id] = bus.bus_number
+
+        # Route position index
+        self.route_nodes = {}
+        self.geometries = {}
+        self.position = [0] * len(stops)
+        node = 0
+        for route_id, group in groupby(stops, key=lambda s: s.route_id):
+            group = list(group)
+            nodes = list(range(node, node + len(group)))
+            self.route_nodes[route_id] = nodes
+            self.geometries[route_id] = RouteGeometry(route_id, group)
+            for pos, n in enumerate(nodes):
+                self.position[n] = pos
+            node += len(group)
+        self.fares = FareTable(self.geometries, fare_rules)
+
+        # Buses run both ways, so every route is two patterns: (route_id, reverse, nodes)
+        self.patterns = []
+        self.patterns_of = [[] for _ in range(len(stops))]
+        for route_id, nodes in self.route_nodes.items():
+            for reverse in (False, True):
+                p = len(self.patterns)
+                self.patterns.append((route_id, reverse, nodes[::-1] if reverse else nodes))
+                for n in nodes:
+                    self.patterns_of[n].append(p)
+
+        # Stop-name index
+        self.name_index = defaultdict(list)
+        for i, key in enumerate(self.keys):
+            self.name_index[key].append(i)
+
+        # Transfer edges between stops of one place (stops.places) on different
+        # routes. Stops not clustered yet fall back to same name or same spot.
+        self.place_of = [getattr(s, 'place_id', None) for s in stops]
+        groups = defaultdict(list)
+        for i in range(len(stops)):
+            if self.place_of[i]:
+                groups['place', self.place_of[i]].append(i)
+            else:
+                groups['name', self.keys[i]].append(i)
+                spot = (round(self.lats[i], COLOCATED_PRECISION), round(self.lngs[i], COLOCATED_PRECISION))
+                groups['spot', spot].append(i)
+
+        transfers = [set() for _ in range(len(stops))]
+        for group in groups.values():
+            if len(group) < 2:
+                continue
+            for a in group:
+                transfers[a].update(b for b in group if self.route_of[b] != self.route_of[a])
+        # Sorted node order is route/order order, so the first hit per route is its earliest stop
+        self.transfers = [sorted(t) for t in transfers]
+
+        if walk_radius_m is None:
+            walk_radius_m = getattr(settings, 'PLANNER_WALK_RADIUS_M', 400)
+        self._build_footpaths(walk_radius_m / 1000, getattr(settings, 'PLANNER_WALK_SPEED_KMPH', 4.5))
+
+    def _build_footpaths(self, radius_km, walk_kmph):
+        """
+        Footpaths to stops of other routes (not already a transfer) within
+        radius_km, found through a spatial grid rather than all pairs (the grid
+        is kept for nearby-stop queries).
+        Row `node` is foot_to/foot_minutes[foot_start[node]:foot_start[node + 1]].
+        """
+        self.grid = grid = GridIndex(max(radius_km, 0.25))
+        for i in range(len(self.stop_ids)):
+            grid.insert(i, self.lats[i], self.lngs[i])
+
+        starts, to, minutes = [0], [], []
+        for i in range(len(self.stop_ids)):
+            if radius_km > 0:
+                linked = set(self.transfers[i])
+                for j, dist in grid.nearby(self.lats[i], self.lngs[i], radius_km):
+                    if self.route_of[j] != self.route_of[i] and j not in linked:
+                        to.append(j)
+                        minutes.append(dist / walk_kmph * 60)
+            starts.append(len(to))
+        self.foot_start = np.asarray(starts, dtype=np.int64)
+        self.foot_to = np.asarray(to, dtype=np.int32)
+        self.foot_minutes = np.asarray(minutes, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    @classmethod
+    def load(cls):
+        return cls(
+            list(Stop.objects.all()),
+            list(Route.objects.all()),
+            list(Bus.objects.filter(is_active=True, route__isnull=False)),
+            fare_rules=list(FareRule.objects.all()),
+        )
+
+    # -------------------------
+    # Lookups
+    # -------------------------
+    def find_stops(self, text):
+        """Nodes whose name contains `text` (case-insensitive), in route/order order."""
+        needle = text.lower()
+        return [i for i, name in enumerate(self.names) if needle in name.lower()]
+
+    def resolve_stops(self, text):
+        """
+        find_stops(), or when nothing contains `text`, the stops named like
+        the closest fuzzy match (misspelled names such as "Bhubneswar Staton").
+        """
+        nodes = self.find_stops(text)
+        if nodes:
+            return nodes
+        if self._trigrams is None:
+            self._trigrams = TrigramIndex(self.names)
+        for key, _ in self._trigrams.match(text, limit=1):
+            return list(self.name_index[key])
+        return []
+
+    def pattern_position(self, pattern, node):
+        """Index of `node` in patterns[pattern][2]."""
+        route_id, reverse, nodes = self.patterns[pattern]
+        pos = self.position[node]
+        return len(nodes) - 1 - pos if reverse else pos
+
+    def footpaths(self, node):
+        """[(node, walk minutes)] nearest first."""
+        lo, hi = self.foot_start[node], self.foot_start[node + 1]
+        return list(zip(self.foot_to[lo:hi].tolist(), self.foot_minutes[lo:hi].tolist()))
+
+    def nearby_stops(self, lat, lng, radius_km):
+        """[(node, distance_km)] nearest first."""
+        return self.grid.nearby(lat, lng, radius_km)
+
+    def walk_minutes(self, a, b):
+        for node, minutes in self.footpaths(a):
+            if node == b:
+                return minutes
+        return 0.0
+
+    def fare(self, a, b):
+        """Single-bus fare between two nodes on the same route."""
+        return self.fares.fare(self.route_of[a], self.position[a], self.position[b])
+
+    def distance_between(self, a, b):
+        """Along-route distance (KM) between two nodes on the same route."""
+        geometry = self.geometries[self.route_of[a]]
+        return geometry.distance_between_orders(self.orders[a], self.orders[b])
+
+
+# =========================
+# PER-PROCESS CACHE
+# =========================
+_network = None
+_built = (None, None)  # (network, fares) versions _network was built at
+_lock = Lock()
+
+
+def network_version():
+    """
+    Shared version of everything a planned trip depends on (graph, fares,
+    timetable); results derived from the network (see routes.plan_cache)
+    are only valid for the version they were computed at.
+    """
+    return versions.current(versions.NETWORK), versions.current(versions.FARES), versions.current(versions.TIMETABLE)
+
+
+def get_transit_network():
+    """The process-wide network, rebuilt on first use after an invalidation anywhere."""
+    global _network, _built
+    version, fares_version = versions.current(versions.NETWORK), versions.current(versions.FARES)
+    network = _network
+    if network is None or _built != (version, fares_version):
+        with _lock:
+            if _network is None or _built[0] != version:
+                _network = TransitNetwork.load()
+            elif _built[1] != fares_version:
+                # Only the fare rules changed (in another worker): keep the graph
+                _network.fares = FareTable(_network.geometries, list(FareRule.objects.all()))
+            _built = (version, fares_version)
+            network = _network
+    return network
+
+
+def reprice_transit_network():
+    """Rebuild every route's fare table from FareRule, keeping the graph."""
+    global _built
+    network = _network
+    if network is not None:
+        network.fares = FareTable(network.geometries, list(FareRule.objects.all()))
+    fares_version = versions.bump(versions.FARES)
+    with _lock:
+        _built = (_built[0], fares_version)
+
+
+def invalidate_transit_network():
+    global _network
+    with _lock:
+        _network = None
+    versions.bump(versions.NETWORK)
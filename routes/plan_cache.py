@@ -0,0 +1,84 @@
+"""
+LRU cache of TripPlannerView results.
+
+Keys are the case-folded from/to names plus the planning mode (max_transfers
+or departure minute). Every entry remembers the network version it was
+planned at (routes.network.network_version: shared counters bumped whenever
+a Stop, Route, Bus, FareRule or Schedule change invalidates the planner's
+data), so a write through any worker retires every cached trip in every
+worker without scanning the cache. Entries also expire after
+PLANNER_CACHE_TTL seconds.
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+
+from .network import network_version
+
+
+def plan_key(from_name, to_name, max_transfers=None, depart=None):
+    # The planner matches names case-insensitively, so case never changes a result
+    return (from_name.strip().lower(), to_name.strip().lower(), max_transfers, depart)
+
+
+class PlanCache:
+    def __init__(self, maxsize=4096, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (version, expires, results)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """(True, results) on a hit, (False, None) on a miss."""
+        version = network_version()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[2]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, results, version):
+        """Store results computed at `version` (read before planning, so a write mid-plan loses)."""
+        if version != network_version():
+            return
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + self.ttl, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._entries),
+            "max_size": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "network_version": network_version(),
+        }
+
+
+plan_cache = PlanCache(
+    getattr(settings, 'PLANNER_CACHE_SIZE', 4096),
+    getattr(settings, 'PLANNER_CACHE_TTL', 300),
+)
@@ -0,0 +1,256 @@
+"""
+Trip planning over the in-memory TransitNetwork (no queries per request).
+
+Journeys are lists of legs: ('bus', board_node, alight_node) or
+('walk', from_node, to_node) along a footpath.
+"""
+from tracking.utils import haversine
+from .network import get_transit_network
+
+# Upper bound for ?max_transfers= (3 transfers = 4 buses)
+MAX_TRANSFERS = 3
+INF = float('inf')
+
+
+def _direct_trip(net, start, end):
+    route_id = net.route_of[start]
+    forward = net.orders[start] < net.orders[end]
+    route_name = net.route_names[route_id]
+    return {
+        "type": "Direct",
+        "route_name": route_name if forward else f"{route_name} (Return)",
+        "bus_numbers": list(net.route_buses[route_id]),
+        "start_stop": net.names[start],
+        "end_stop": net.names[end],
+        "stops_count": abs(net.orders[end] - net.orders[start]),
+        "fare_estimate": net.fare(start, end),
+    }
+
+
+def _leg(net, board, alight):
+    route_id = net.route_of[board]
+    route_name = net.route_names[route_id]
+    return {
+        "route_name": route_name if net.orders[board] < net.orders[alight] else f"{route_name} (Return)",
+        "bus_numbers": list(net.route_buses[route_id]),
+        "from": net.names[board],
+        "to": net.names[alight],
+        "stops": abs(net.orders[alight] - net.orders[board])
+    }
+
+
+def walk_leg(net, a, b):
+    return {
+        "mode": "walk",
+        "from": net.names[a],
+        "to": net.names[b],
+        "stops": 0,
+        "minutes": max(1, round(net.walk_minutes(a, b))),
+        "distance_m": round(haversine(net.lats[a], net.lngs[a], net.lats[b], net.lngs[b]) * 1000),
+    }
+
+
+def _transfer_trip(net, legs):
+    """`legs` is a journey with at least two bus legs."""
+    leg_dicts = [_leg(net, a, b) if mode == 'bus' else walk_leg(net, a, b) for mode, a, b in legs]
+    rides = [(a, b) for mode, a, b in legs if mode == 'bus']
+    fare = net.fares.transfer_fare([(net.route_of[a], net.distance_between(a, b)) for a, b in rides])
+    return {
+        "type": "Transfer",
+        "start_stop": net.names[legs[0][1]],
+        "end_stop": net.names[legs[-1][2]],
+        "total_stops": sum(leg["stops"] for leg in leg_dicts),
+        "fare_estimate": fare,
+        "legs": leg_dicts,
+        "transfer_at": net.names[rides[0][1]]
+    }
+
+
+def journey_result(net, legs):
+    """Planner response entry for a journey (Direct when it takes one bus)."""
+    rides = [(a, b) for mode, a, b in legs if mode == 'bus']
+    if len(rides) > 1:
+        return _transfer_trip(net, legs)
+    result = _direct_trip(net, *rides[0])
+    if len(legs) > 1:
+        # Walks before/after the bus
+        result["start_stop"] = net.names[legs[0][1]]
+        result["end_stop"] = net.names[legs[-1][2]]
+        result["legs"] = [_leg(net, a, b) if mode == 'bus' else walk_leg(net, a, b) for mode, a, b in legs]
+    return result
+
+
+def _trip_key(res):
+    if res['type'] == 'Direct':
+        return f"D-{res['route_name']}"
+    return f"T-{res['legs'][0]['route_name']}-{res['legs'][1]['route_name']}"
+
+
+def _direct_and_one_hop(net, start_nodes, end_nodes):
+    """Every direct and one-transfer trip, one per route (pair)."""
+    trips = {}
+
+    def add(res):
+        # Deduplicate roughly (by route names), first one wins
+        trips.setdefault(_trip_key(res), res)
+
+    # --- Strategy 1: Direct Routes (forward, or reverse as "Return") ---
+    for start in start_nodes:
+        for end in end_nodes:
+            if net.route_of[start] == net.route_of[end] and net.orders[start] != net.orders[end]:
+                add(_direct_trip(net, start, end))
+
+    # --- Strategy 2: One-Hop Transfer ---
+    # Last matching stop per route, like the dict the ORM version built
+    start_routes = {net.route_of[n]: n for n in start_nodes}
+    end_routes = {net.route_of[n]: n for n in end_nodes}
+
+    for r1, s1 in start_routes.items():
+        route_nodes = net.route_nodes[r1]
+        for t1 in route_nodes[net.position[s1] + 1:]:
+            if net.orders[t1] <= net.orders[s1]:
+                continue
+            # Earliest stop per route reachable from t1 on foot (same place)
+            first_on_route = {}
+            for t2 in net.transfers[t1]:
+                first_on_route.setdefault(net.route_of[t2], []).append(t2)
+
+            for r2, s2 in end_routes.items():
+                if r1 == r2:
+                    continue
+                for t2 in first_on_route.get(r2, ()):
+                    if net.orders[t2] < net.orders[s2]:
+                        add(_transfer_trip(net, [('bus', s1, t1), ('bus', t2, s2)]))
+                        break
+
+    results = list(trips.values())
+    # Sort: Direct first, then by total stops
+    results.sort(key=lambda x: (0 if x['type'] == 'Direct' else 1, x.get('stops_count', x.get('total_stops', 999))))
+    return results
+
+
+# =========================
+# K-TRANSFER SEARCH
+# =========================
+def search_journeys(net, sources, targets, max_transfers=1):
+    """
+    Round-based search (RAPTOR without timetables): round k rides k+1 buses
+    and keeps, per node, the fewest stops ridden so far. Changing buses
+    within a stop place, or walking a footpath to a nearby stop, is free. A
+    round only records a journey if it beats every journey with fewer
+    transfers, so the result is the Pareto set over (transfers, stops),
+    fewest transfers first.
+
+    Returns a list of journeys (see module docstring).
+    """
+    n = len(net)
+    best = [INF] * n
+    for s in sources:
+        best[s] = 0
+    targets = set(targets)
+    # Stops a short walk from the origin count as origins too (not the destination)
+    start_walk = {}
+    for s in sources:
+        for w, _ in net.footpaths(s):
+            if best[w] == INF and w not in targets:
+                best[w] = 0
+                start_walk[w] = s
+    marked = set(sources) | set(start_walk)
+    rounds = []  # per round: ({node: (board_node, pattern)}, {node: (from_node, on_foot)})
+    journeys = []
+    target_best = INF
+
+    for k in range(max_transfers + 1):
+        prev = list(best)
+
+        # Scan each pattern from its earliest marked stop
+        queue = {}
+        for node in marked:
+            for p in net.patterns_of[node]:
+                pos = net.pattern_position(p, node)
+                if pos < queue.get(p, INF):
+                    queue[p] = pos
+
+        ride, walk = {}, {}
+        improved = set()
+        for p, start in queue.items():
+            nodes = net.patterns[p][2]
+            cost, board = INF, None
+            for v in nodes[start:]:
+                if board is not None:
+                    cost += 1
+                    if cost < best[v] and cost < target_best:
+                        best[v] = cost
+                        ride[v] = (board, p)
+                        improved.add(v)
+                if prev[v] < cost:
+                    cost, board = prev[v], v
+
+        for v in list(improved):
+            # Same-place transfers first, so a footpath never replaces one
+            steps = [(w, False) for w in net.transfers[v]] + [(w, True) for w, _ in net.footpaths(v)]
+            for w, on_foot in steps:
+                if best[v] < best[w]:
+                    best[w] = best[v]
+                    ride.pop(w, None)
+                    walk[w] = (v, on_foot)
+                    improved.add(w)
+
+        rounds.append((ride, walk))
+        reached = [t for t in targets if t in ride or t in walk]
+        if reached:
+            t = min(reached, key=lambda t: (best[t], t))
+            if best[t] < target_best:
+                target_best = best[t]
+                journeys.append(_trace(rounds, start_walk, t))
+        if not improved:
+            break
+        marked = improved
+
+    return journeys
+
+
+def _trace(rounds, start_walk, node):
+    """Walk the per-round parents back from `node` to a source."""
+    legs = []
+    r = len(rounds) - 1
+    while True:
+        while r >= 0 and node not in rounds[r][0] and node not in rounds[r][1]:
+            r -= 1
+        if r < 0:
+            break
+        ride, walk = rounds[r]
+        if node in walk:
+            prev, on_foot = walk[node]
+            if on_foot:
+                legs.append(('walk', prev, node))
+            node = prev
+            continue
+        board = ride[node][0]
+        legs.append(('bus', board, node))
+        node = board
+        r -= 1
+    if node in start_walk:
+        legs.append(('walk', start_walk[node], node))
+    legs.reverse()
+    return legs
+
+
+def plan_trip(from_name, to_name, max_transfers=None, network=None):
+    """
+    Trips between stops matching `from_name` and `to_name`, or None when
+    either side matches no stop.
+
+    Without `max_transfers`: every direct and one-transfer trip. With it: the
+    Pareto-optimal journeys using up to that many transfers.
+    """
+    net = network or get_transit_network()
+    start_nodes = net.resolve_stops(from_name)
+    end_nodes = net.resolve_stops(to_name)
+    if not start_nodes or not end_nodes:
+        return None
+
+    if max_transfers is None:
+        return _direct_and_one_hop(net, start_nodes, end_nodes)
+
+    return [journey_result(net, legs) for legs in search_journeys(net, start_nodes, end_nodes, max_transfers)]
@@ -0,0 +1,341 @@
+"""
+In-memory search indexes for SearchSuggestionsView and the trip planner.
+
+Every name is indexed under each of its word starts ("berhampur first gate",
+"first gate", "gate") in a sorted array, so a prefix lookup is a bisect plus
+a scan of the matching range. Rankings for short prefixes (typed on every
+keystroke, matching the most names) are memoized until a name under them
+changes. Stop names also get a trigram
+index for misspelled queries. Model signals add and remove single names, so
+the indexes are never rebuilt after the first load in the writing worker.
+
+Requests read a published SearchIndex without locking: a change is applied
+to a copy of the touched index, and the copy is published by swapping one
+reference. Other workers see the shared search version move and reload.
+"""
+import copy
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+from heapq import nsmallest
+from math import ceil
+from threading import Lock
+
+from buses.models import Bus
+from stops.models import Stop
+from . import versions
+from .models import Route
+
+# Prefixes up to this length keep their ranked matches (the wide ranges)
+MEMO_PREFIX_LENGTH = 6
+# Results kept per memoized prefix (the view never asks for more)
+MAX_RESULTS = 10
+# Share of the query's trigrams a fuzzy match must contain
+MIN_TRIGRAM_COVERAGE = 0.5
+# Queries shorter than this are left to the prefix index
+MIN_FUZZY_LENGTH = 3
+# Upper bound on names scored per fuzzy lookup
+MAX_CANDIDATES = 2000
+
+_WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def word_starts(key):
+    """The key from each word start onwards."""
+    return [key[m.start():] for m in _WORD.finditer(key)]
+
+
+class PrefixIndex:
+    """
+    Names with a popularity weight. Matches are ranked: names starting with
+    the prefix before names with a later word starting with it, then by
+    weight, then alphabetically.
+    """
+
+    def __init__(self, entries=()):
+        self.weights = {}   # key -> popularity
+        self.display = {}   # key -> name as first seen
+        self.keys = []      # sorted (word start, key)
+        self._memo = {}
+        for value, weight in entries:
+            key = normalize(value)
+            if key:
+                self.display.setdefault(key, value)
+                self.weights[key] = self.weights.get(key, 0) + weight
+        self.keys = sorted((start, key) for key in self.weights for start in word_starts(key))
+
+    def __len__(self):
+        return len(self.weights)
+
+    def copy(self):
+        clone = copy.copy(self)
+        clone.weights, clone.display = dict(self.weights), dict(self.display)
+        clone.keys, clone._memo = list(self.keys), dict(self._memo)
+        return clone
+
+    def add(self, value, weight=1):
+        key = normalize(value)
+        if not key:
+            return
+        if key in self.weights:
+            self.weights[key] += weight
+        else:
+            self.weights[key] = weight
+            self.display[key] = value
+            for start in word_starts(key):
+                insort(self.keys, (start, key))
+        self._forget(key)
+
+    def discard(self, value, weight=1):
+        key = normalize(value)
+        if key not in self.weights:
+            return
+        self.weights[key] -= weight
+        if self.weights[key] <= 0:
+            del self.weights[key]
+            del self.display[key]
+            for start in word_starts(key):
+                i = bisect_left(self.keys, (start, key))
+                if i < len(self.keys) and self.keys[i] == (start, key):
+                    del self.keys[i]
+        self._forget(key)
+
+    def _forget(self, key):
+        for start in word_starts(key):
+            for n in range(1, min(len(start), MEMO_PREFIX_LENGTH) + 1):
+                self._memo.pop(start[:n], None)
+
+    def _rank(self, prefix):
+        lo = bisect_left(self.keys, (prefix,))
+        hi = bisect_left(self.keys, (prefix + "\uffff",), lo)
+        # A key matches in full when its own (longest) word start is in range
+        full = {key: False for _, key in self.keys[lo:hi]}
+        for start, key in self.keys[lo:hi]:
+            if start == key:
+                full[key] = True
+        weights = self.weights
+        return nsmallest(MAX_RESULTS, full, key=lambda k: (not full[k], -weights[k], k))
+
+    def search(self, text, limit=5):
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        if len(prefix) <= MEMO_PREFIX_LENGTH:
+            ranked = self._memo.get(prefix)
+            if ranked is None:
+                ranked = self._memo[prefix] = self._rank(prefix)
+        else:
+            ranked = self._rank(prefix)
+        return [self.display[k] for k in ranked[:limit]]
+
+
+def trigrams(key):
+    """pg_trgm-style trigrams: each word padded with two spaces in front, one behind."""
+    grams = set()
+    for word in _WORD.findall(key):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Inverted index trigram -> names, for typo-tolerant lookups.
+
+    A match must contain at least MIN_TRIGRAM_COVERAGE of the query's
+    trigrams, so it has to appear in one of the rarest
+    len(query) - needed + 1 posting lists. Only those lists are read to
+    find candidates, which keeps common trigrams ("  b", "ar ") from
+    making every name a candidate. Candidates are ranked by coverage, then
+    by Jaccard similarity (pg_trgm's similarity()).
+    """
+
+    def __init__(self, names=()):
+        self.counts = {}
+        self.display = {}
+        self.grams = {}
+        self.postings = defaultdict(set)
+        for name in names:
+            key = self._count(name)
+            if key:
+                for gram in self.grams[key]:
+                    self.postings[gram].add(key)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def copy(self):
+        # Posting sets are shared with the original until add/discard replaces them
+        clone = copy.copy(self)
+        clone.counts, clone.display, clone.grams = dict(self.counts), dict(self.display), dict(self.grams)
+        clone.postings = defaultdict(set, self.postings)
+        return clone
+
+    def _count(self, value):
+        """Count one more `value`; its key when the name is new."""
+        key = normalize(value)
+        if not key:
+            return None
+        if key in self.counts:
+            self.counts[key] += 1
+            return None
+        self.counts[key] = 1
+        self.display[key] = value
+        self.grams[key] = frozenset(trigrams(key))
+        return key
+
+    def add(self, value):
+        key = self._count(value)
+        if key:
+            for gram in self.grams[key]:
+                self.postings[gram] = self.postings.get(gram, set()) | {key}
+
+    def discard(self, value):
+        key = normalize(value)
+        if key not in self.counts:
+            return
+        self.counts[key] -= 1
+        if self.counts[key] > 0:
+            return
+        for gram in self.grams.pop(key):
+            remaining = self.postings[gram] - {key}
+            if remaining:
+                self.postings[gram] = remaining
+            else:
+                del self.postings[gram]
+        del self.counts[key]
+        del self.display[key]
+
+    def match(self, text, limit=5):
+        """[(key, score)] best first; score is the share of the query's trigrams found."""
+        text = normalize(text)
+        query = trigrams(text)
+        if len(text) < MIN_FUZZY_LENGTH or not query:
+            return []
+        needed = ceil(MIN_TRIGRAM_COVERAGE * len(query))
+        rarest = sorted(query, key=lambda g: len(self.postings.get(g, ())))
+
+        candidates = set()
+        for gram in rarest[:len(query) - needed + 1]:
+            candidates.update(self.postings.get(gram, ()))
+            if len(candidates) >= MAX_CANDIDATES:
+                break
+
+        scored = []
+        for key in candidates:
+            grams = self.grams[key]
+            shared = len(query & grams)
+            if shared >= needed:
+                scored.append((shared / len(query), shared / len(query | grams), key))
+        best = nsmallest(limit, scored, key=lambda s: (-s[0], -s[1], s[2]))
+        return [(key, round(coverage, 3)) for coverage, _, key in best]
+
+    def search(self, text, limit=5):
+        return [self.display[key] for key, _ in self.match(text, limit)]
+
+
+def bus_weight(is_active):
+    # Active buses are what riders look for; retired numbers still resolve
+    return 2 if is_active else 1
+
+
+class SearchIndex:
+    """
+    stops:  stop names, weighted by how many route stops share the name
+            (plus stop_trigrams for fuzzy matches)
+    buses:  bus numbers, active ones first
+    routes: route names
+    """
+
+    def __init__(self, stop_names, buses, route_names):
+        stop_names = list(stop_names)
+        self.stops = PrefixIndex((name, 1) for name in stop_names)
+        self.stop_trigrams = TrigramIndex(stop_names)
+        self.buses = PrefixIndex((number, bus_weight(active)) for number, active in buses)
+        self.routes = PrefixIndex((name, 1) for name in route_names)
+
+    @classmethod
+    def load(cls):
+        return cls(
+            Stop.objects.values_list('name', flat=True),
+            Bus.objects.values_list('bus_number', 'is_active'),
+            Route.objects.values_list('name', flat=True),
+        )
+
+    def copy(self, kind):
+        """A copy whose `kind` index (and stop trigrams for 'stops') can be changed."""
+        clone = copy.copy(self)
+        setattr(clone, kind, getattr(self, kind).copy())
+        if kind == 'stops':
+            clone.stop_trigrams = self.stop_trigrams.copy()
+        return clone
+
+
+# =========================
+# PER-PROCESS INDEX
+# =========================
+# (search version, SearchIndex): published as one reference, never changed in place
+_index = None
+_lock = Lock()
+
+
+def get_search_index():
+    global _index
+    version = versions.current(versions.SEARCH)
+    built = _index
+    if built is None or built[0] != version:
+        with _lock:
+            if _index is None or _index[0] != version:
+                _index = (version, SearchIndex.load())
+            built = _index
+    return built[1]
+
+
+def invalidate_search_index():
+    """Reload every index on the next query, here and in other workers."""
+    global _index
+    versions.bump(versions.SEARCH)
+    with _lock:
+        _index = None
+
+
+def update_search_index(kind, old=None, new=None, old_weight=1, new_weight=1):
+    """
+    Move one name in the `kind` index ('stops', 'buses', 'routes') and bump
+    the shared search version so other workers reload.
+    """
+    global _index
+    if old == new and old_weight == new_weight:
+        return
+    version = versions.bump(versions.SEARCH)
+    with _lock:
+        if _index is None or _index[0] != version - 1:
+            # Not loaded yet, or another worker changed it too: reload on next use
+            return
+        index = _index[1].copy(kind)
+        prefix_index = getattr(index, kind)
+        if old is not None:
+            prefix_index.discard(old, old_weight)
+            if kind == 'stops':
+                index.stop_trigrams.discard(old)
+        if new is not None:
+            prefix_index.add(new, new_weight)
+            if kind == 'stops':
+                index.stop_trigrams.add(new)
+        _index = (version, index)
+
+
+def suggest_stops(text, limit=5):
+    """Stop names by prefix, topped up with fuzzy matches for misspellings."""
+    index = get_search_index()
+    names = index.stops.search(text, limit)
+    if len(names) < limit:
+        seen = {normalize(n) for n in names}
+        for name in index.stop_trigrams.search(text, limit):
+            if normalize(name) not in seen and len(names) < limit:
+                names.append(name)
+    return names
@@ -1,7 +1,11 @@
+import logging
+
 from rest_framework import serializers
-from .models import Route
-from stops.models import Stop
-from tracking.utils import haversine
+from .models import Route, RouteSummary
+from .summary import compute_route_summary
+
+logger = logging.getLogger(__name__)
+
 
 class RouteSerializer(serializers.ModelSerializer):
     bus_no = serializers.SerializerMethodField()
@@ -34,95 +38,62 @@ class RouteSerializer(serializers.ModelSerializer):
             'city',
         ]
     
+    def _summary(self, obj):
+        """Materialized RouteSummary (select_related('summary') keeps it query-free)."""
+        try:
+            return obj.summary
+        except RouteSummary.DoesNotExist:
+            # The migration and routes.signals keep every route covered; a gap is a bug
+            logger.warning("Route %s has no summary; run `manage.py rebuild_route_summaries`", obj.id)
+            obj.summary = compute_route_summary(obj.id)
+            return obj.summary
+
     def get_bus_no(self, obj):
-        # Reverse relation: Route -> Buses (related_name='buses')
-        bus = obj.buses.first()
-        if bus:
-            return bus.bus_number
-        return None
-    
+        return self._summary(obj).primary_bus_number
     
     def get_from_stop(self, obj):
         """Get first stop name (lowest order)"""
-        first_stop = Stop.objects.filter(route=obj).order_by('order').first()
-        return first_stop.name if first_stop else "N/A"
+        return self._summary(obj).first_stop_name or "N/A"
     
     def get_to_stop(self, obj):
         """Get last stop name (highest order)"""
-        last_stop = Stop.objects.filter(route=obj).order_by('-order').first()
-        return last_stop.name if last_stop else "N/A"
+        return self._summary(obj).last_stop_name or "N/A"
     
     def get_distance(self, obj):
-        """Calculate total route distance by summing distances between consecutive stops"""
-        stops = list(Stop.objects.filter(route=obj).order_by('order'))
-        if len(stops) < 2:
+        """Total route distance as a display string"""
+        summary = self._summary(obj)
+        if summary.stop_count < 2:
             return "N/A"
-        
-        total_distance = 0.0
-        for i in range(len(stops) - 1):
-            distance = haversine(
-                stops[i].latitude,
-                stops[i].longitude,
-                stops[i + 1].latitude,
-                stops[i + 1].longitude
-            )
-            total_distance += distance
-        
-        return f"{round(total_distance, 1)} km"
+
+        return f"{round(summary.total_distance_km, 1)} km"
 
     def get_distance_km(self, obj):
         """Return total route distance as a numeric value in kilometers."""
-        stops = list(Stop.objects.filter(route=obj).order_by('order'))
-        if len(stops) < 2:
+        summary = self._summary(obj)
+        if summary.stop_count < 2:
             return None
 
-        total_distance = 0.0
-        for i in range(len(stops) - 1):
-            distance = haversine(
-                stops[i].latitude,
-                stops[i].longitude,
-                stops[i + 1].latitude,
-                stops[i + 1].longitude
-            )
-            total_distance += distance
-
-        return round(total_distance, 1)
+        return round(summary.total_distance_km, 1)
     
     def get_stops_count(self, obj):
         """Get total number of stops in the route"""
-        count = Stop.objects.filter(route=obj).count()
-        return f"{count} Stops"
+        return f"{self._summary(obj).stop_count} Stops"
 
     def get_stops_count_value(self, obj):
         """Return total number of stops as an integer."""
-        return Stop.objects.filter(route=obj).count()
+        return self._summary(obj).stop_count
     
     def get_frequency(self, obj):
         """Get bus frequency based on route/city"""
-        bus = obj.buses.first()
-        if bus:
-            return "Every 10 mins"
-        
         return "Every 10 mins"
 
     def get_frequency_minutes(self, obj):
         """Return frequency in minutes as an integer for frontend use."""
-        bus = obj.buses.first()
-        if bus:
-            return 10
-
         return 10
 
     def get_city(self, obj):
         """Derive city from bus number pattern"""
-        bus = obj.buses.first()
-        if bus:
-            num = str(bus.bus_number)
-            if num.startswith('1'): return "Bhubaneswar"
-            if num.startswith('2'): return "Puri"
-            if num.startswith('3'): return "Berhampur"
-            if num.startswith('4'): return "Cuttack"
-        return "Odisha"
+        return self._summary(obj).city
     
     def to_representation(self, instance):
         """Rename fields to match frontend expectations"""
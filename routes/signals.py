@@ -0,0 +1,179 @@
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from buses.models import Bus, Schedule
+from stops.models import Stop
+from stops.places import assign_place, drop_place_if_empty
+from .geometry import invalidate_route_geometry
+from .models import FareRule, Route
+from .network import invalidate_transit_network, reprice_transit_network
+from .search import bus_weight, update_search_index
+from .summary import refresh_route_summary
+from .timetable import invalidate_timetable
+
+
+# =========================
+# PREVIOUS VALUES
+# =========================
+# Incremental updates need to know what a row looked like before the save
+PREVIOUS_FIELDS = {
+    Stop: ('route_id', 'name', 'latitude', 'longitude', 'place_id'),
+    Bus: ('route_id', 'bus_number', 'is_active'),
+    Route: ('name',),
+    Schedule: ('bus_id',),
+    FareRule: ('route_id',),
+}
+
+
+@receiver(pre_save, sender=Stop)
+@receiver(pre_save, sender=Bus)
+@receiver(pre_save, sender=Route)
+@receiver(pre_save, sender=Schedule)
+@receiver(pre_save, sender=FareRule)
+def remember_previous(sender, instance, **kwargs):
+    instance._previous = None
+    if instance.pk:
+        instance._previous = sender.objects.filter(pk=instance.pk).values(*PREVIOUS_FIELDS[sender]).first()
+
+
+def _previous(instance, field):
+    previous = getattr(instance, '_previous', None)
+    return previous[field] if previous else None
+
+
+# =========================
+# CACHE INVALIDATION
+# =========================
+# Stops can move between routes, so any Stop/Route write drops every compiled
+# route instead of guessing which ones were touched. Writes are rare (admin edits),
+# reads are on every tracking request.
+@receiver(post_save, sender=Stop)
+@receiver(post_delete, sender=Stop)
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+def invalidate_route_caches(sender, **kwargs):
+    invalidate_route_geometry()
+    invalidate_transit_network()
+
+
+# The planner network also lists each route's active bus numbers
+@receiver(post_save, sender=Bus)
+@receiver(post_delete, sender=Bus)
+def invalidate_planner_buses(sender, instance, **kwargs):
+    invalidate_transit_network()
+    invalidate_timetable([instance.id])
+
+
+# Only the buses whose rows changed are reloaded into the connection arrays
+@receiver(post_save, sender=Schedule)
+@receiver(post_delete, sender=Schedule)
+def invalidate_schedule_buses(sender, instance, **kwargs):
+    invalidate_timetable({instance.bus_id, _previous(instance, 'bus_id')} - {None})
+
+
+# A rule change reprices every route's fare table at once; the graph is kept
+@receiver(post_save, sender=FareRule)
+@receiver(post_delete, sender=FareRule)
+def reprice_fares(sender, **kwargs):
+    reprice_transit_network()
+
+
+# =========================
+# STOP PLACES
+# =========================
+# New or moved/renamed stops are clustered on the spot; cluster_stop_places
+# re-clusters everything when places drift (e.g. a stop that bridged two moves away)
+@receiver(post_save, sender=Stop)
+def cluster_stop(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous', None)
+    fields = ('name', 'latitude', 'longitude')
+    if created or not previous or not previous['place_id'] or any(
+        previous[f] != getattr(instance, f) for f in fields
+    ):
+        assign_place(instance)
+
+
+@receiver(post_delete, sender=Stop)
+def drop_empty_place(sender, instance, **kwargs):
+    drop_place_if_empty(instance.place_id)
+
+
+# =========================
+# SEARCH INDEX
+# =========================
+# One name in, one name out: the typeahead index is never rebuilt
+@receiver(post_save, sender=Stop)
+@receiver(post_save, sender=Route)
+def index_name(sender, instance, **kwargs):
+    kind = 'stops' if sender is Stop else 'routes'
+    update_search_index(kind, old=_previous(instance, 'name'), new=instance.name)
+
+
+@receiver(post_delete, sender=Stop)
+@receiver(post_delete, sender=Route)
+def unindex_name(sender, instance, **kwargs):
+    update_search_index('stops' if sender is Stop else 'routes', old=instance.name)
+
+
+@receiver(post_save, sender=Bus)
+def index_bus_number(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous', None)
+    update_search_index(
+        'buses',
+        old=previous['bus_number'] if previous else None,
+        old_weight=bus_weight(previous['is_active']) if previous else 1,
+        new=instance.bus_number,
+        new_weight=bus_weight(instance.is_active),
+    )
+
+
+@receiver(post_delete, sender=Bus)
+def unindex_bus_number(sender, instance, **kwargs):
+    update_search_index('buses', old=instance.bus_number, old_weight=bus_weight(instance.is_active))
+
+
+# =========================
+# ROUTE VERSION (Route.updated_at)
+# =========================
+# Route.updated_at is the validator for route/stop/schedule responses, so a
+# stop or bus change must bump the route it belongs to, and the one it left.
+@receiver(post_save, sender=Stop)
+@receiver(post_delete, sender=Stop)
+@receiver(post_save, sender=Bus)
+@receiver(post_delete, sender=Bus)
+def touch_route(sender, instance, origin=None, **kwargs):
+    # Cascade from deleting the route itself: nothing left to bump or summarise
+    if isinstance(origin, Route) or getattr(origin, 'model', None) is Route:
+        return
+    route_ids = {instance.route_id, _previous(instance, 'route_id')} - {None}
+    if route_ids:
+        Route.objects.filter(id__in=route_ids).update(updated_at=timezone.now())
+        for route_id in route_ids:
+            refresh_route_summary(route_id)
+
+
+# Fares are part of a route too: a route's own rule bumps that route, the
+# default rule every route that falls back to it
+@receiver(post_save, sender=FareRule)
+@receiver(post_delete, sender=FareRule)
+def touch_fare_routes(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Route) or getattr(origin, 'model', None) is Route:
+        return
+    previous = getattr(instance, '_previous', None)
+    route_ids = {instance.route_id} | ({previous['route_id']} if previous else set())
+    routes = Q(id__in=route_ids - {None})
+    if None in route_ids:
+        routes |= Q(fare_rule__isnull=True)
+    Route.objects.filter(routes).update(updated_at=timezone.now())
+
+
+# =========================
+# ROUTE SUMMARY
+# =========================
+@receiver(post_save, sender=Route)
+def refresh_summary_on_route_save(sender, instance, **kwargs):
+    refresh_route_summary(instance.id)
@@ -0,0 +1,48 @@
+from buses.models import Bus, DEFAULT_CITY, city_for_bus_number
+from stops.models import Stop
+from tracking.utils import segment_distances
+from .models import Route, RouteSummary
+
+
+def compute_route_summary(route_id):
+    """Unsaved RouteSummary for a route, built from its stops and buses (3 queries)."""
+    stops = list(
+        Stop.objects.filter(route_id=route_id).order_by('order')
+        .values_list('name', 'latitude', 'longitude')
+    )
+    primary_bus = (
+        Bus.objects.filter(route_id=route_id).order_by('id')
+        .values_list('bus_number', flat=True).first()
+    )
+
+    distance = 0.0
+    if len(stops) >= 2:
+        distance = float(segment_distances([s[1] for s in stops], [s[2] for s in stops]).sum())
+
+    return RouteSummary(
+        route_id=route_id,
+        first_stop_name=stops[0][0] if stops else "",
+        last_stop_name=stops[-1][0] if stops else "",
+        stop_count=len(stops),
+        total_distance_km=distance,
+        primary_bus_number=primary_bus,
+        city=city_for_bus_number(primary_bus) if primary_bus else DEFAULT_CITY,
+    )
+
+
+def refresh_route_summary(route_id):
+    """Recompute and store one route's summary. Returns it, or None if the route is gone."""
+    if not Route.objects.filter(id=route_id).exists():
+        return None
+    summary = compute_route_summary(route_id)
+    summary.save()
+    return summary
+
+
+def rebuild_route_summaries():
+    """Recompute every route's summary. Returns the number of routes."""
+    route_ids = list(Route.objects.values_list('id', flat=True))
+    summaries = [compute_route_summary(route_id) for route_id in route_ids]
+    RouteSummary.objects.all().delete()
+    RouteSummary.objects.bulk_create(summaries)
+    return len(summaries)
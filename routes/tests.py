@@ -1,3 +1,693 @@
-from django.test import TestCase
+import json
+import random
+import time
+from datetime import time as clock
+from importlib import import_module
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from buses.models import Bus, Schedule
+from stops.models import Stop
+from tracking.eta import compute_stops_eta
+from tracking.utils import haversine
+from . import batch, versions
+from .models import CacheVersion, FareRule, Route, RouteSummary
+from .isochrone import reachable
+from .network import TransitNetwork, get_transit_network, network_version
+from .plan_cache import PlanCache, plan_cache
+from .planner import plan_trip
+from .geometry import get_route_geometry
+from .search import PrefixIndex, TrigramIndex, get_search_index, suggest_stops
+from .timetable import get_timetable, invalidate_timetable, parse_clock, plan_timed_trip
+
+
+def build_network(lines, walk_radius_m=None):
+    """
+    TransitNetwork from a list of routes, each a list of stop names (no DB).
+    Route r runs east along latitude 20 + r * 0.01 (routes ~1.1 km apart).
+    """
+    route_objs = [Route(id=r + 1, name=f"Route {r:03d}") for r in range(len(lines))]
+    buses = [Bus(id=r + 1, bus_number=str(100 + r), route_id=r + 1) for r in range(len(lines))]
+    stops = []
+    for r, names in enumerate(lines):
+        for j, name in enumerate(names):
+            stops.append(Stop(
+                id=len(stops) + 1, route_id=r + 1, name=name, order=j,
+                latitude=20.0 + r * 0.01, longitude=85.0 + j * 0.001,
+            ))
+    return TransitNetwork(stops, route_objs, buses, walk_radius_m=walk_radius_m)
+
+
+def synthetic_network(routes=100, stops_per_route=50):
+    """
+    `routes` x `stops_per_route` stops. Route i ends where route i+1 starts
+    ("Hub"), and its middle stop is shared with an early stop of route i+10
+    ("Cross"), so long trips need several transfers.
+    """
+    lines = []
+    for r in range(routes):
+        names = []
+        for j in range(stops_per_route):
+            name = f"Stop {r:03d}-{j:02d}"
+            if j == 0:
+                name = f"Hub {r:03d}"
+            elif j == stops_per_route - 1:
+                name = f"Hub {r + 1:03d}"
+            elif j == stops_per_route // 2:
+                name = f"Cross {r:03d}"
+            elif j == 10 and r >= 10:
+                name = f"Cross {r - 10:03d}"
+            names.append(name)
+        lines.append(names)
+    return build_network(lines)
+
+
+def legacy_plan(from_name, to_name):
+    """The ORM planner TripPlannerView ran before routes.planner, as a reference."""
+    start_stops = Stop.objects.filter(name__icontains=from_name)
+    end_stops = Stop.objects.filter(name__icontains=to_name)
+    if not start_stops.exists() or not end_stops.exists():
+        return None
+
+    def distance(route_id, start_order, end_order):
+        return get_route_geometry(route_id).distance_between_orders(start_order, end_order)
+
+    trips = []
+    for start in start_stops:
+        for end in end_stops:
+            if start.route == end.route and start.order != end.order:
+                route = start.route
+                trips.append({
+                    "type": "Direct",
+                    "route_name": route.name if start.order < end.order else f"{route.name} (Return)",
+                    "bus_numbers": [b.bus_number for b in route.buses.filter(is_active=True)],
+                    "start_stop": start.name,
+                    "end_stop": end.name,
+                    "stops_count": abs(end.order - start.order),
+                    "fare_estimate": max(5, round(distance(route.id, start.order, end.order) * 5)),
+                })
+
+    start_routes = {s.route.id: s for s in start_stops}
+    end_routes = {s.route.id: s for s in end_stops}
+    for r1_id, s1 in start_routes.items():
+        for t_stop in Stop.objects.filter(route_id=r1_id, order__gt=s1.order):
+            for r2_id, s2 in end_routes.items():
+                if r1_id == r2_id:
+                    continue
+                match = Stop.objects.filter(route_id=r2_id, name__iexact=t_stop.name, order__lt=s2.order).first()
+                if match:
+                    dist1 = distance(r1_id, s1.order, t_stop.order)
+                    dist2 = distance(r2_id, match.order, s2.order)
+                    trips.append({
+                        "type": "Transfer",
+                        "start_stop": s1.name,
+                        "end_stop": s2.name,
+                        "total_stops": (t_stop.order - s1.order) + (s2.order - match.order),
+                        "fare_estimate": max(10, round((dist1 + dist2) * 5)),
+                        "legs": [
+                            {"route_name": s1.route.name,
+                             "bus_numbers": [b.bus_number for b in s1.route.buses.filter(is_active=True)],
+                             "from": s1.name, "to": t_stop.name, "stops": t_stop.order - s1.order},
+                            {"route_name": s2.route.name,
+                             "bus_numbers": [b.bus_number for b in s2.route.buses.filter(is_active=True)],
+                             "from": match.name, "to": s2.name, "stops": s2.order - match.order},
+                        ],
+                        "transfer_at": t_stop.name,
+                    })
+
+    unique = {}
+    for res in trips:
+        if res['type'] == 'Direct':
+            key = f"D-{res['route_name']}"
+        else:
+            key = f"T-{res['legs'][0]['route_name']}-{res['legs'][1]['route_name']}"
+        unique.setdefault(key, res)
+    results = list(unique.values())
+    results.sort(key=lambda x: (0 if x['type'] == 'Direct' else 1, x.get('stops_count', x.get('total_stops', 999))))
+    return results
+
+
+class RouteGeometryTests(TestCase):
+    COORDS = [(19.800, 85.820), (19.806, 85.823), (19.815, 85.821), (19.821, 85.830), (19.830, 85.828)]
+
+    def setUp(self):
+        self.route = Route.objects.create(name="Puri Line")
+        for order, (lat, lng) in enumerate(self.COORDS):
+            Stop.objects.create(route=self.route, name=f"Stop {order}", order=order * 10, latitude=lat, longitude=lng)
+        self.stops = list(Stop.objects.filter(route=self.route))
+
+    def test_distances_and_etas_match_the_haversine_loop(self):
+        geometry = get_route_geometry(self.route.id)
+        for i, a in enumerate(self.stops):
+            for b in self.stops[i:]:
+                loop = sum(haversine(s.latitude, s.longitude, t.latitude, t.longitude)
+                           for s, t in zip(self.stops[i:], self.stops[i + 1:]) if t.order <= b.order)
+                self.assertAlmostEqual(geometry.distance_between_orders(a.order, b.order), loop, places=9)
+                self.assertAlmostEqual(geometry.distance_between_orders(b.order, a.order), loop, places=9)
+
+        lat, lng, speed = 19.803, 85.8215, 60
+        for idx, forward in [(0, True), (2, True), (2, False), (4, False)]:
+            # The per-stop loop BusETAView ran before the cumulative distance array
+            path = self.stops[idx + 1:] if forward else self.stops[:idx][::-1]
+            expected, at, minutes = [], (lat, lng), 0
+            for stop in path:
+                if minutes > 0:
+                    minutes += 3 / 60
+                minutes += haversine(*at, stop.latitude, stop.longitude) / speed * 60
+                expected.append({"stop_name": stop.name, "eta_minutes": max(1, round(minutes)), "order": stop.order})
+                at = (stop.latitude, stop.longitude)
+            self.assertEqual(compute_stops_eta(geometry, idx, forward, lat, lng, speed), expected)
+
+    def test_change_through_another_worker_rebuilds(self):
+        before = get_route_geometry(self.route.id)
+        # Another process's write: no signal here, only the shared counter moves
+        Stop.objects.filter(route=self.route, order=40).update(latitude=19.9)
+        CacheVersion.objects.update_or_create(name=versions.GEOMETRY, defaults={"version": 99})
+        with mock.patch.object(versions, 'VERSION_CHECK_SECONDS', 0):
+            after = get_route_geometry(self.route.id)
+        self.assertGreater(after.total_km, before.total_km)
+
+
+class NetworkParityTests(TestCase):
+    LINES = {
+        "Coast Line": ["Puri Station", "Grand Road", "Market Square", "Temple Gate", "Beach"],
+        "City Line": ["Market Square", "College", "Temple Gate", "Airport"],
+        "Airport Express": ["Airport", "Temple Gate", "Puri Station"],
+    }
+    BUSES = {"Coast Line": [("201", True), ("202", True)], "City Line": [("301", False), ("302", True)],
+             "Airport Express": [("401", True)]}
+
+    def setUp(self):
+        # Stops sharing a name share a spot, so places match the old name-based transfers
+        spots = {}
+        for r, (route_name, names) in enumerate(self.LINES.items()):
+            route = Route.objects.create(name=route_name)
+            for order, name in enumerate(names):
+                lat, lng = spots.setdefault(name, (19.8 + len(spots) * 0.013, 85.8 + r * 0.004))
+                Stop.objects.create(route=route, name=name, order=order, latitude=lat, longitude=lng)
+            for number, active in self.BUSES[route_name]:
+                Bus.objects.create(bus_number=number, route=route, is_active=active)
+
+    def test_direct_and_one_hop_match_the_orm_planner(self):
+        net = TransitNetwork.load()
+        queries = ["Puri", "Market", "Temple", "Airport", "College", "Beach", "Road", "Station", "Nowhere"]
+        for origin in queries:
+            for destination in queries:
+                if origin != destination:
+                    with self.subTest(origin=origin, destination=destination):
+                        self.assertEqual(plan_trip(origin, destination, network=net), legacy_plan(origin, destination))
+
+    def test_write_through_another_worker_rebuilds_the_network(self):
+        Bus.objects.create(bus_number="203", route=Route.objects.get(name="Coast Line"))
+        stale = TransitNetwork.load()
+        with mock.patch('routes.network._network', stale):
+            CacheVersion.objects.update_or_create(name=versions.NETWORK, defaults={"version": 99})
+            with mock.patch.object(versions, 'VERSION_CHECK_SECONDS', 0):
+                self.assertIsNot(get_transit_network(), stale)
+
+
+class MultiTransferSearchTests(SimpleTestCase):
+    # Interactive budget for one max_transfers=3 query on 5,000 stops
+    LATENCY_BUDGET_SECONDS = 0.1
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.network = synthetic_network()
+
+    def test_network_size(self):
+        self.assertEqual(len(self.network), 5000)
+
+    def test_three_transfers_along_the_chain(self):
+        results = plan_trip("Stop 000-01", "Stop 003-40", max_transfers=3, network=self.network)
+        self.assertEqual(len(results), 1)
+        trip = results[0]
+        self.assertEqual(trip["type"], "Transfer")
+        self.assertEqual([leg["route_name"] for leg in trip["legs"]],
+                         ["Route 000", "Route 001", "Route 002", "Route 003"])
+        self.assertEqual(trip["total_stops"], 48 + 49 + 49 + 40)
+        self.assertEqual(trip["transfer_at"], "Hub 001")
+
+    def test_max_transfers_limits_rounds(self):
+        self.assertEqual(
+            plan_trip("Stop 000-01", "Stop 003-40", max_transfers=2, network=self.network), []
+        )
+
+    def test_results_are_pareto_optimal(self):
+        # A slow direct route, a shorter one-transfer trip, and a two-transfer
+        # trip that is longer than the one-transfer one (dominated)
+        network = build_network([
+            ["Airport"] + [f"Local {i}" for i in range(10)] + ["Temple"],
+            ["Airport", "Market", "Station"],
+            ["Station", "Temple"],
+            ["Market", "Square", "Junction"],
+            ["Junction", "Park", "Garden", "Temple"],
+        ])
+        results = plan_trip("Airport", "Temple", max_transfers=3, network=network)
+        self.assertEqual([r["type"] for r in results], ["Direct", "Transfer"])
+        self.assertEqual(results[0]["stops_count"], 11)
+        self.assertEqual(results[1]["total_stops"], 3)
+        self.assertEqual(results[1]["transfer_at"], "Station")
+
+    def test_latency_budget(self):
+        rng = random.Random(12)
+        queries = [
+            (f"Stop {rng.randrange(100):03d}-{rng.randrange(1, 10):02d}",
+             f"Stop {rng.randrange(100):03d}-{rng.randrange(26, 49):02d}")
+            for _ in range(50)
+        ]
+        worst = 0.0
+        for origin, destination in queries:
+            started = time.perf_counter()
+            plan_trip(origin, destination, max_transfers=3, network=self.network)
+            worst = max(worst, time.perf_counter() - started)
+        self.assertLess(worst, self.LATENCY_BUDGET_SECONDS)
+
+
+class ReachabilityTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.network = synthetic_network()
+
+    def test_transfer_budget_bounds_the_search(self):
+        origin = self.network.name_index["hub 000"]
+        direct = reachable(self.network, origin, max_transfers=0)
+        # Route 1 only, plus where its Hub 001 / Cross 000 stops let riders change
+        self.assertEqual({self.network.route_of[v] for v in direct}, {1, 2, 11})
+        self.assertEqual(sum(1 for v in direct if self.network.route_of[v] != 1), 2)
+        one_transfer = reachable(self.network, origin, max_transfers=1)
+        self.assertEqual(max(k for _, k in one_transfer.values()), 1)
+        self.assertGreater(len(one_transfer), len(direct))
+
+    def test_minutes_grow_with_distance_and_respect_budget(self):
+        origin = self.network.name_index["hub 000"]
+        found = reachable(self.network, origin, max_minutes=5, speed_kmph=30)
+        # Stops are ~105 m apart: 5 minutes at 30 km/h is 2.5 km, about 23 stops
+        self.assertTrue(all(minutes <= 5 for minutes, _ in found.values()))
+        route_nodes = self.network.route_nodes[1]
+        self.assertIn(route_nodes[20], found)
+        self.assertNotIn(route_nodes[30], found)
+        self.assertLess(found[route_nodes[5]][0], found[route_nodes[10]][0])
+
+    def test_latency_budget(self):
+        started = time.perf_counter()
+        for r in range(0, 100, 5):
+            reachable(self.network, self.network.route_nodes[r + 1][:1], max_minutes=60)
+        self.assertLess((time.perf_counter() - started) / 20, MultiTransferSearchTests.LATENCY_BUDGET_SECONDS)
+
+
+class FootpathTests(SimpleTestCase):
+    def test_routes_out_of_walking_distance_get_no_footpaths(self):
+        self.assertEqual(len(synthetic_network(10, 10).foot_to), 0)
+
+    def test_walk_to_a_nearby_route(self):
+        lines = [["Airport", "Market"], ["Stadium", "Temple"]]
+        self.assertEqual(plan_trip("Airport", "Temple", max_transfers=1, network=build_network(lines)), [])
+
+        network = build_network(lines, walk_radius_m=1200)
+        results = plan_trip("Airport", "Temple", max_transfers=1, network=network)
+        self.assertEqual(len(results), 1)
+        walk, ride = results[0]["legs"]
+        self.assertEqual((walk["mode"], walk["from"], walk["to"]), ("walk", "Airport", "Stadium"))
+        self.assertEqual(walk["minutes"], 15)
+        self.assertEqual((ride["from"], ride["to"]), ("Stadium", "Temple"))
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = PrefixIndex([
+            ("Puri Bus Stand", 1), ("Puri Railway Station", 3),
+            ("Shree Jagannath Temple Puri", 1), ("Pipili", 1),
+        ])
+
+    def test_full_prefix_before_word_start_then_popularity(self):
+        self.assertEqual(
+            self.index.search("pu", 5),
+            ["Puri Railway Station", "Puri Bus Stand", "Shree Jagannath Temple Puri"],
+        )
+        self.assertEqual(self.index.search("rail"), ["Puri Railway Station"])
+        self.assertEqual(self.index.search("  PURI   bus"), ["Puri Bus Stand"])
+
+    def test_incremental_updates_refresh_memoized_prefixes(self):
+        self.assertEqual(self.index.search("pi"), ["Pipili"])
+        self.index.add("Pipli Chhak", 5)
+        self.assertEqual(self.index.search("pi"), ["Pipli Chhak", "Pipili"])
+        self.index.discard("Pipili")
+        self.assertEqual(self.index.search("pi"), ["Pipli Chhak"])
+        self.index.discard("Puri Railway Station", 3)
+        self.assertEqual(self.index.search("pu", 1), ["Puri Bus Stand"])
+
+
+class FuzzyStopSearchTests(SimpleTestCase):
+    NAMES = ["Bhubaneswar Railway station", "Bhubaneswar Bus Stand", "Lingaraj station",
+             "Berhampur Railway Station", "Puri Bus Stand"]
+
+    def test_misspelled_query_finds_stop(self):
+        index = TrigramIndex(self.NAMES)
+        self.assertEqual(index.search("Bhubneswar Staton", 2),
+                         ["Bhubaneswar Railway station", "Bhubaneswar Bus Stand"])
+        self.assertEqual(index.search("xyz qqq"), [])
+        index.discard("Bhubaneswar Railway station")
+        self.assertEqual(index.search("Bhubneswar Staton", 1), ["Bhubaneswar Bus Stand"])
+
+    def test_planner_resolves_misspelled_stops(self):
+        network = build_network([["Bhubaneswar Railway station", "Master canteen square", "Lingaraj temple"]])
+        results = plan_trip("Bhubneswar Staton", "Lingraj Templ", network=network)
+        self.assertEqual(results[0]["start_stop"], "Bhubaneswar Railway station")
+        self.assertEqual(results[0]["end_stop"], "Lingaraj temple")
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.route = Route.objects.create(name="Puri Line")
+        Stop.objects.create(route=self.route, name="Puri Bus Stand", order=0, latitude=19.80, longitude=85.82)
+
+    def test_rename_publishes_a_new_index(self):
+        published = get_search_index()
+        stop = Stop.objects.create(route=self.route, name="Pipili", order=1, latitude=19.81, longitude=85.83)
+        self.assertEqual(published.stops.search("pi"), [])
+        self.assertEqual(get_search_index().stops.search("pi"), ["Pipili"])
+
+        stop.name = "Pipli Chhak"
+        stop.save()
+        self.assertEqual(suggest_stops("pipli chak"), ["Pipli Chhak"])
+        self.assertEqual(get_search_index().stops.search("pipili"), [])
+
+    def test_change_through_another_worker_reloads(self):
+        self.assertEqual(get_search_index().stops.search("pi"), [])
+        # Another process's write: no signal here, only the shared counter moves
+        Stop.objects.bulk_create([Stop(route=self.route, name="Pipili", order=1, latitude=19.81, longitude=85.83)])
+        CacheVersion.objects.update_or_create(name=versions.SEARCH, defaults={"version": 99})
+        with mock.patch.object(versions, 'VERSION_CHECK_SECONDS', 0):
+            self.assertEqual(get_search_index().stops.search("pi"), ["Pipili"])
+
+
+class TimetablePlanningTests(TestCase):
+    """Connection scan over Schedule rows: Airport -> Station on bus 100, then bus 200 to Temple."""
+
+    def setUp(self):
+        invalidate_timetable()
+        self.stops = {}
+        # Both lines stop at the same Station (one stop place)
+        positions = {"Airport": 20.00, "Market": 20.01, "Station": 20.02, "Square": 20.03, "Temple": 20.04}
+        for route_name, names in (("Airport Line", ["Airport", "Market", "Station"]),
+                                  ("Temple Line", ["Station", "Square", "Temple"])):
+            route = Route.objects.create(name=route_name)
+            for order, name in enumerate(names):
+                self.stops[route_name, name] = Stop.objects.create(
+                    route=route, name=name, order=order, latitude=positions[name], longitude=85.8,
+                )
+            setattr(self, route_name.split()[0].lower(), route)
+        self.bus100 = Bus.objects.create(bus_number="100", route=self.airport)
+        self.bus200 = Bus.objects.create(bus_number="200", route=self.temple)
+        self._run(self.bus100, "Airport Line", ["Airport", "Market", "Station"], "08:00", 10)
+        self._run(self.bus200, "Temple Line", ["Station", "Square", "Temple"], "08:30", 10)
+        self._run(self.bus200, "Temple Line", ["Station", "Square", "Temple"], "09:30", 10)
+
+    def _run(self, bus, route_name, names, start, minutes):
+        t = parse_clock(start)
+        for i, name in enumerate(names):
+            m = t // 60 + i * minutes
+            Schedule.objects.create(bus=bus, stop=self.stops[route_name, name], arrival_time=clock(m // 60, m % 60))
+
+    def test_earliest_arrival_with_wait(self):
+        results = plan_timed_trip("Airport", "Temple", parse_clock("07:45"))
+        self.assertEqual(len(results), 1)
+        trip = results[0]
+        self.assertEqual(trip["type"], "Transfer")
+        self.assertEqual(trip["departure"], "08:00 AM")
+        self.assertEqual(trip["arrival"], "08:50 AM")
+        self.assertEqual([leg["bus_numbers"] for leg in trip["legs"]], [["100"], ["200"]])
+        # 15 min for the first bus, then 08:20 + 2 min transfer -> 08:30
+        self.assertEqual([leg["wait_minutes"] for leg in trip["legs"]], [15, 8])
+
+    def test_missed_connection_takes_next_bus(self):
+        results = plan_timed_trip("Market", "Temple", parse_clock("08:25"))
+        self.assertEqual(results, [])
+        results = plan_timed_trip("Station", "Temple", parse_clock("08:31"))
+        self.assertEqual(results[0]["departure"], "09:30 AM")
+
+    def test_schedule_change_reloads_only_that_bus(self):
+        before = len(get_timetable())
+        express = Bus.objects.create(bus_number="201", route=self.temple)
+        self._run(express, "Temple Line", ["Station", "Square", "Temple"], "08:40", 5)
+        self.assertEqual(get_timetable().dirty, set())
+        self.assertGreater(len(get_timetable()), before)
+        results = plan_timed_trip("Station", "Temple", parse_clock("08:31"))
+        self.assertEqual(results[0]["arrival"], "08:50 AM")
+        self.assertEqual(results[0]["bus_numbers"], ["201"])
+
+
+    def test_change_at_one_stop_needs_the_transfer_time(self):
+        route = Route.objects.create(name="Zoo Line")
+        for order, name in enumerate(["Depot", "Hospital", "Zoo"]):
+            self.stops["Zoo Line", name] = Stop.objects.create(
+                route=route, name=name, order=order, latitude=20.10 + order * 0.01, longitude=85.9,
+            )
+        feeder, tight, later = (Bus.objects.create(bus_number=n, route=route) for n in ("300", "301", "302"))
+        self._run(feeder, "Zoo Line", ["Depot", "Hospital"], "08:00", 10)
+        self._run(tight, "Zoo Line", ["Hospital", "Zoo"], "08:10", 10)
+        self._run(later, "Zoo Line", ["Hospital", "Zoo"], "08:15", 10)
+
+        trip = plan_timed_trip("Depot", "Zoo", parse_clock("07:55"))[0]
+        self.assertEqual([leg["bus_numbers"] for leg in trip["legs"]], [["300"], ["302"]])
+        self.assertEqual(trip["arrival"], "08:25 AM")
+        self.assertEqual([leg["wait_minutes"] for leg in trip["legs"]], [5, 3])
+
+    def test_schedule_change_through_another_worker_reloads(self):
+        before = len(get_timetable())
+        # Another process's write: no signal here, only the shared counter moves
+        Schedule.objects.bulk_create([
+            Schedule(bus=self.bus200, stop=self.stops["Temple Line", name], arrival_time=clock(10, 30 + i * 10))
+            for i, name in enumerate(["Station", "Square", "Temple"])
+        ])
+        CacheVersion.objects.update_or_create(name=versions.TIMETABLE, defaults={"version": 99})
+        with mock.patch.object(versions, 'VERSION_CHECK_SECONDS', 0):
+            self.assertGreater(len(get_timetable()), before)
+
+
+class PlanCacheTests(TestCase):
+    def setUp(self):
+        plan_cache.clear()
+        route = Route.objects.create(name="Puri Line")
+        for order, name in enumerate(["Puri Station", "Grand Road", "Jagannath Temple"]):
+            Stop.objects.create(route=route, name=name, order=order, latitude=19.80 + order * 0.01, longitude=85.82)
+        Bus.objects.create(bus_number="201", route=route)
+
+    def _plan(self, origin, destination):
+        return self.client.get('/api/routes/plan/', {'from': origin, 'to': destination})
+
+    def test_repeat_query_is_served_from_cache(self):
+        first = self._plan("Puri Station", "Jagannath Temple")
+        second = self._plan("puri station ", "JAGANNATH TEMPLE")
+        self.assertEqual((first['X-Plan-Cache'], second['X-Plan-Cache']), ("miss", "hit"))
+        self.assertEqual(first.json(), second.json())
+        stats = self.client.get('/api/routes/plan/cache/').json()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_network_change_invalidates(self):
+        self._plan("Puri Station", "Jagannath Temple")
+        Bus.objects.filter(bus_number="201").get().save()
+        response = self._plan("Puri Station", "Jagannath Temple")
+        self.assertEqual(response['X-Plan-Cache'], "miss")
+
+    def test_write_through_another_worker_invalidates(self):
+        self._plan("Puri Station", "Jagannath Temple")
+        # Another process's write: no signal here, only the shared counter moves
+        CacheVersion.objects.update_or_create(name=versions.NETWORK, defaults={"version": 99})
+        with mock.patch.object(versions, 'VERSION_CHECK_SECONDS', 0):
+            response = self._plan("Puri Station", "Jagannath Temple")
+        self.assertEqual(response['X-Plan-Cache'], "miss")
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = PlanCache(maxsize=2)
+        for key in ("a", "b"):
+            cache.put(key, [key], version=network_version())
+        cache.get("a")
+        cache.put("c", ["c"], version=network_version())
+        self.assertEqual((cache.get("a")[0], cache.get("b")[0], cache.get("c")[0]), (True, False, True))
+
+
+class BatchPlanTests(TestCase):
+    def setUp(self):
+        route = Route.objects.create(name="Cuttack Line")
+        for order, name in enumerate(["Badambadi", "Buxi Bazaar", "Link Road"]):
+            Stop.objects.create(route=route, name=name, order=order, latitude=20.46 + order * 0.01, longitude=85.88)
+        Bus.objects.create(bus_number="401", route=route)
+
+    def test_csv_pairs_stream_ndjson_in_order(self):
+        body = "from,to\nBadambadi,Link Road\nNowhere,Link Road\n"
+        response = self.client.post('/api/routes/plan/batch/', body, content_type='text/csv')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([(line["from"], line["to"]) for line in lines],
+                         [("Badambadi", "Link Road"), ("Nowhere", "Link Road")])
+        self.assertEqual((lines[0]["type"], lines[0]["stops"], lines[0]["transfers"]), ("Direct", 2, 0))
+        self.assertEqual(lines[1]["error"], "Stops not found")
+
+    def test_bad_row_is_rejected(self):
+        response = self.client.post('/api/routes/plan/batch/', [{"from": "Badambadi"}], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_workers_run_in_process_without_fork(self):
+        pairs = [("Badambadi", "Link Road"), ("Link Road", "Buxi Bazaar")] * batch.CHUNK_SIZE
+        with mock.patch.object(batch.multiprocessing, 'get_all_start_methods', return_value=['spawn']), \
+                mock.patch.object(batch, 'ProcessPoolExecutor', side_effect=AssertionError("no pool")):
+            lines = list(batch.plan_pairs(pairs, workers=4))
+        self.assertEqual([(line["from"], line["to"]) for line in lines], pairs)
+        self.assertEqual({line["type"] for line in lines}, {"Direct"})
+
+
+class FareTableTests(TestCase):
+    def setUp(self):
+        self.route = Route.objects.create(name="Berhampur Line")
+        self.stops = [
+            Stop.objects.create(route=self.route, name=name, order=order, latitude=19.30 + order * 0.02, longitude=84.79)
+            for order, name in enumerate(["First Gate", "Gandhi Nagar", "Railway Station"])
+        ]
+
+    def _fare(self, a, b):
+        response = self.client.get(f'/api/routes/{self.route.id}/fares/', {'from': a.id, 'to': b.id})
+        return response.json()["fare"]
+
+    def test_matrix_matches_distance_rule(self):
+        table = self.client.get(f'/api/routes/{self.route.id}/fares/').json()
+        # ~2.2 km per stop at 5/km, never under the minimum of 5
+        self.assertEqual(table["fares"], [[5, 11, 22], [11, 5, 11], [22, 11, 5]])
+        self.assertEqual(self._fare(self.stops[2], self.stops[0]), 22)
+
+    def test_rule_change_reprices(self):
+        FareRule.objects.create(minimum_fare=15, per_km_rate=2)
+        self.assertEqual(self._fare(self.stops[0], self.stops[1]), 15)
+        FareRule.objects.create(route=self.route, minimum_fare=5, per_km_rate=10)
+        self.assertEqual(self._fare(self.stops[0], self.stops[2]), 44)
+
+
+class ConditionalRouteTests(TestCase):
+    def setUp(self):
+        self.route = Route.objects.create(name="Gopalpur Line")
+        self.other = Route.objects.create(name="Chhatrapur Line")
+        self.stop = Stop.objects.create(route=self.route, name="Gopalpur Beach", order=0, latitude=19.26, longitude=84.91)
+        self.bus = Bus.objects.create(bus_number="801", route=self.route)
+
+    def _get(self, **headers):
+        return self.client.get('/api/routes/801/', headers=headers)
+
+    def _updated_at(self, route):
+        return Route.objects.values_list('updated_at', flat=True).get(pk=route.pk)
+
+    def test_matching_validators_answer_304(self):
+        first = self._get()
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self._get(**{"If-None-Match": first["ETag"]}).status_code, 304)
+        self.assertEqual(self._get(**{"If-Modified-Since": first["Last-Modified"]}).status_code, 304)
+
+        self.stop.name = "Gopalpur Light House"
+        self.stop.save()
+        changed = self._get(**{"If-None-Match": first["ETag"]})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+
+    def test_stop_bus_and_fare_edits_move_updated_at(self):
+        edits = [
+            lambda: Stop.objects.create(route=self.route, name="Berhampur", order=1, latitude=19.31, longitude=84.79),
+            lambda: self.stop.save(),
+            lambda: Bus.objects.create(bus_number="802", route=self.route),
+            lambda: self.bus.save(),
+            lambda: FareRule.objects.create(route=self.route, minimum_fare=8),
+            lambda: FareRule.objects.filter(route=self.route).get().delete(),
+            lambda: FareRule.objects.create(minimum_fare=12),  # the default rule
+        ]
+        for edit in edits:
+            before = self._updated_at(self.route)
+            edit()
+            self.assertGreater(self._updated_at(self.route), before)
+
+        # Moving a bus bumps the route it left as well as the one it joined
+        before = self._updated_at(self.route), self._updated_at(self.other)
+        self.bus.route = self.other
+        self.bus.save()
+        self.assertGreater(self._updated_at(self.route), before[0])
+        self.assertGreater(self._updated_at(self.other), before[1])
+
+        # A route's own rule leaves the other routes alone
+        before = self._updated_at(self.other)
+        FareRule.objects.create(route=self.route, minimum_fare=8)
+        self.assertEqual(self._updated_at(self.other), before)
+
+
+class RouteSummaryTests(TestCase):
+    def setUp(self):
+        self.route = Route.objects.create(name="Ring Road")
+        self.other = Route.objects.create(name="Old Town")
+
+    def _summary(self, route=None):
+        return RouteSummary.objects.get(route=route or self.route)
+
+    def _add_stop(self, name, order):
+        return Stop.objects.create(route=self.route, name=name, order=order, latitude=20.0 + order * 0.01, longitude=85.8)
+
+    def test_summary_follows_stop_and_bus_writes(self):
+        self.assertEqual((self._summary().stop_count, self._summary().primary_bus_number), (0, None))
+
+        first = self._add_stop("Rasulgarh", 0)
+        last = self._add_stop("Vani Vihar", 2)
+        self._add_stop("Palasuni", 1)
+        summary = self._summary()
+        self.assertEqual((summary.first_stop_name, summary.last_stop_name, summary.stop_count),
+                         ("Rasulgarh", "Vani Vihar", 3))
+        self.assertAlmostEqual(summary.total_distance_km, 2.2239, places=3)
+
+        last.delete()
+        first.delete()
+        summary = self._summary()
+        self.assertEqual((summary.first_stop_name, summary.last_stop_name, summary.stop_count),
+                         ("Palasuni", "Palasuni", 1))
+        self.assertEqual(summary.total_distance_km, 0)
+
+        bus = Bus.objects.create(bus_number="CTC-12", route=self.route)
+        Bus.objects.create(bus_number="CTC-13", route=self.route)
+        self.assertEqual(self._summary().primary_bus_number, "CTC-12")
+        bus.route = self.other
+        bus.save()
+        self.assertEqual((self._summary().primary_bus_number, self._summary(self.other).primary_bus_number),
+                         ("CTC-13", "CTC-12"))
+        Bus.objects.filter(route=self.route).get().delete()
+        self.assertIsNone(self._summary().primary_bus_number)
+
+    def test_route_list_queries_do_not_grow_with_routes(self):
+        for order in range(3):
+            self._add_stop(f"Stop {order}", order)
+        for routes in (2, 22):
+            # validators + routes joined with their summaries
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/routes/')
+            self.assertEqual(len(response.json()), routes)
+            for i in range(routes, routes + 20):
+                route = Route.objects.create(name=f"Line {i}")
+                Stop.objects.create(route=route, name=f"Line {i} Depot", order=0, latitude=20.1, longitude=85.9)
+                Bus.objects.create(bus_number=f"{900 + i}", route=route)
+
+    def test_migration_backfills_routes_without_a_summary(self):
+        self._add_stop("Rasulgarh", 0)
+        RouteSummary.objects.all().delete()
+        migration = import_module('routes.migrations.0008_routesummary')
+
+        migration.backfill_route_summaries(None, None)
+
+        self.assertEqual(self._summary().first_stop_name, "Rasulgarh")
+        self.assertEqual(self._summary(self.other).stop_count, 0)
+
+    def test_missing_summary_is_logged_and_not_written_on_read(self):
+        self._add_stop("Rasulgarh", 0)
+        RouteSummary.objects.filter(route=self.route).delete()
+
+        with self.assertLogs('routes.serializers', 'WARNING'):
+            response = self.client.get('/api/routes/')
+
+        by_id = {route['id']: route for route in response.json()}
+        self.assertEqual(by_id[self.route.id]['from'], "Rasulgarh")
+        self.assertFalse(RouteSummary.objects.filter(route=self.route).exists())
@@ -0,0 +1,336 @@
+"""
+Timetable-aware planning: Connection Scan Algorithm over buses.models.Schedule.
+
+Each active bus's Schedule rows, in time order, become elementary connections
+(stop -> next stop, departure -> arrival). All connections live in flat arrays
+sorted by departure, so a query is one linear scan from the requested time.
+Schedule/Bus writes only mark their bus dirty; the next query reloads just
+those buses' rows and publishes re-merged arrays, while running queries keep
+scanning the ones they started with.
+"""
+from bisect import bisect_left
+from datetime import datetime
+from threading import Lock
+
+import numpy as np
+
+from buses.models import Schedule
+from . import versions
+from .network import get_transit_network
+from .planner import walk_leg
+
+# Minutes to change buses between stops of one place (footpaths use walking time)
+TRANSFER_MINUTES = 2
+TIME_FORMAT = "%I:%M %p"
+INF = float('inf')
+
+
+def parse_clock(value):
+    """Seconds since midnight for '14:05', '14:05:30' or '02:05 PM'."""
+    for fmt in ("%H:%M", "%H:%M:%S", TIME_FORMAT):
+        try:
+            t = datetime.strptime(value.strip().upper(), fmt).time()
+            return t.hour * 3600 + t.minute * 60 + t.second
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid time '{value}'")
+
+
+def format_clock(seconds):
+    seconds = int(seconds) % 86400
+    return datetime(2000, 1, 1, seconds // 3600, seconds % 3600 // 60).strftime(TIME_FORMAT)
+
+
+def _bus_connections(rows):
+    """Connections of one bus from its (stop_id, seconds) rows in time order."""
+    stops = np.asarray([r[0] for r in rows], dtype=np.int64)
+    times = np.asarray([r[1] for r in rows], dtype=np.int64)
+    moving = stops[:-1] != stops[1:]  # staying at a stop is not a connection
+    return stops[:-1][moving], stops[1:][moving], times[:-1][moving], times[1:][moving]
+
+
+class Connections:
+    """
+    Flat connection arrays sorted by departure time, never changed once built:
+      dep_stop, arr_stop, dep, arr (seconds since midnight), bus
+    A query scans one Connections and its connection indexes refer to it.
+    """
+
+    def __init__(self, blocks):
+        bus_ids = list(blocks)
+        parts = [blocks[b] for b in bus_ids]
+        if parts:
+            dep_stop, arr_stop, dep, arr = (np.concatenate(cols) for cols in zip(*parts))
+            bus = np.repeat(np.asarray(bus_ids, dtype=np.int64), [len(p[0]) for p in parts])
+        else:
+            dep_stop = arr_stop = dep = arr = bus = np.empty(0, dtype=np.int64)
+        order = np.lexsort((arr, dep))
+        # Plain lists: scalar access in the scan loop is much faster than numpy's
+        self.dep_stop = dep_stop[order].tolist()
+        self.arr_stop = arr_stop[order].tolist()
+        self.dep = dep[order].tolist()
+        self.arr = arr[order].tolist()
+        self.bus = bus[order].tolist()
+        self._nodes_of = (None, None, None)
+
+    def __len__(self):
+        return len(self.dep)
+
+    def _nodes(self, net):
+        """Connection endpoints as network nodes (recomputed when the network is rebuilt)."""
+        built, dep_node, arr_node = self._nodes_of
+        if built is not net:
+            node = net.node_of_stop
+            dep_node = [node.get(s, -1) for s in self.dep_stop]
+            arr_node = [node.get(s, -1) for s in self.arr_stop]
+            self._nodes_of = (net, dep_node, arr_node)
+        return dep_node, arr_node
+
+    # -------------------------
+    # Connection Scan
+    # -------------------------
+    def earliest_arrival(self, net, sources, targets, depart):
+        """
+        Earliest-arrival journey leaving any of `sources` at or after `depart`
+        (seconds). Returns (arrival_seconds, legs) with legs as
+        ('bus', board_connection, alight_connection) or ('walk', from_node, to_node),
+        or None if no target is reachable.
+
+        Each node has two labels: when the rider can be there (arrival) and
+        when they can board another bus there (ready). Getting off a bus makes
+        a node ready TRANSFER_MINUTES later, the same change time itinerary()
+        reports; staying on a bus needs none.
+        """
+        dep_node, arr_node = self._nodes(net)
+        arrival = {s: depart for s in sources}
+        ready = dict(arrival)
+        parent = {}      # node -> ('ride', board_c, alight_c) | ('walk', from_node, on_foot)
+        ready_parent = {}  # the same, for the ready label
+        boarded = {}     # bus -> connection where the rider got on
+        targets = set(targets)
+        best = INF
+        transfer_seconds = TRANSFER_MINUTES * 60
+
+        def reach(w, t, step, t_ready):
+            if t < arrival.get(w, INF):
+                arrival[w] = t
+                parent[w] = step
+            if t_ready < ready.get(w, INF):
+                ready[w] = t_ready
+                ready_parent[w] = step
+
+        def relax_walks(v, t, skip=()):
+            for w in net.transfers[v]:
+                if w not in skip:
+                    reach(w, t + transfer_seconds, ('walk', v, False), t + transfer_seconds)
+            for w, minutes in net.footpaths(v):
+                if w not in skip:
+                    reach(w, t + minutes * 60, ('walk', v, True), t + minutes * 60)
+
+        # Walking straight to the destination is not a bus journey
+        for s in sources:
+            relax_walks(s, depart, skip=targets)
+
+        for c in range(bisect_left(self.dep, depart), len(self.dep)):
+            t_dep = self.dep[c]
+            if t_dep >= best:
+                break
+            bus = self.bus[c]
+            u = dep_node[c]
+            if bus not in boarded:
+                if ready.get(u, INF) > t_dep:
+                    continue
+                boarded[bus] = c
+            v, t_arr = arr_node[c], self.arr[c]
+            if t_arr < arrival.get(v, INF):
+                reach(v, t_arr, ('ride', boarded[bus], c), t_arr + transfer_seconds)
+                if v in targets:
+                    best = min(best, t_arr)
+                if v >= 0:
+                    relax_walks(v, t_arr)
+
+        reached = [t for t in targets if t in parent]
+        if not reached:
+            return None
+        node = min(reached, key=lambda t: (arrival[t], t))
+        return arrival[node], self._trace(parent, ready_parent, node, dep_node)
+
+    @staticmethod
+    def _trace(parent, ready_parent, node, dep_node):
+        legs = []
+        labels = parent  # how the rider got to `node`; ready_parent once boarding there
+        while node in labels:
+            step = labels[node]
+            if step[0] == 'walk':
+                _, prev, on_foot = step
+                if on_foot:
+                    legs.append(('walk', prev, node))
+                node, labels = prev, parent
+                continue
+            _, board, alight = step
+            legs.append(('bus', board, alight))
+            node, labels = dep_node[board], ready_parent
+        legs.reverse()
+        return legs
+
+    def itinerary(self, net, legs, depart):
+        """Planner-style result for a CSA journey, with wait and walk times."""
+        dep_node, arr_node = self._nodes(net)
+        leg_dicts = []
+        at = ready = depart
+        total_wait = 0
+        ride_km = []  # (route_id, km) per bus
+        rides = [leg for leg in legs if leg[0] == 'bus']
+        for mode, x, y in legs:
+            if mode == 'walk':
+                leg = walk_leg(net, x, y)
+                at = at + net.walk_minutes(x, y) * 60
+                ready = at
+                leg_dicts.append(leg)
+                continue
+            board, alight = x, y
+            a, b = dep_node[board], arr_node[alight]
+            wait = max(0, self.dep[board] - ready)
+            total_wait += wait
+            route_name = net.route_names[net.route_of[a]]
+            leg_dicts.append({
+                "route_name": route_name if net.orders[a] < net.orders[b] else f"{route_name} (Return)",
+                "bus_numbers": [net.bus_numbers.get(self.bus[board])],
+                "from": net.names[a],
+                "to": net.names[b],
+                "stops": abs(net.orders[b] - net.orders[a]),
+                "departure": format_clock(self.dep[board]),
+                "arrival": format_clock(self.arr[alight]),
+                "wait_minutes": round(wait / 60),
+            })
+            ride_km.append((net.route_of[a], net.distance_between(a, b)))
+            at = self.arr[alight]
+            ready = at + TRANSFER_MINUTES * 60
+
+        first, last = rides[0][1], rides[-1][2]
+        result = {
+            "type": "Direct" if len(rides) == 1 else "Transfer",
+            "start_stop": leg_dicts[0]["from"],
+            "end_stop": leg_dicts[-1]["to"],
+            "departure": format_clock(self.dep[first]),
+            "arrival": format_clock(at),
+            "duration_minutes": round((at - depart) / 60),
+            "wait_minutes": round(total_wait / 60),
+            "total_stops": sum(leg["stops"] for leg in leg_dicts),
+            "fare_estimate": (net.fare(dep_node[first], arr_node[last]) if len(rides) == 1
+                              else net.fares.transfer_fare(ride_km)),
+            "legs": leg_dicts,
+        }
+        bus_legs = [leg for leg in leg_dicts if leg.get("mode") != "walk"]
+        if len(rides) == 1:
+            result.update({
+                "route_name": bus_legs[0]["route_name"],
+                "bus_numbers": bus_legs[0]["bus_numbers"],
+                "stops_count": bus_legs[0]["stops"],
+            })
+        else:
+            result["transfer_at"] = bus_legs[0]["to"]
+        return result
+
+
+class Timetable:
+    """
+    Schedule rows of every active bus, kept per bus; `connections` is the
+    Connections snapshot of all of them, replaced whole after a reload.
+    """
+
+    def __init__(self):
+        self.blocks = {}  # bus_id -> connection arrays of that bus
+        self.dirty = None  # None = reload every bus
+        self.version = versions.current(versions.TIMETABLE)
+        self.connections = Connections(self.blocks)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.connections)
+
+    def mark_dirty(self, bus_ids=None, version=None):
+        """
+        Reload `bus_ids` (None: every bus) on the next refresh. `version` is
+        the shared timetable version the change moved it to: when other
+        versions were skipped, another worker changed buses we don't know.
+        """
+        with self._lock:
+            if version is not None:
+                if version not in (self.version, self.version + 1):
+                    bus_ids = None
+                self.version = version
+            if bus_ids is None or self.dirty is None:
+                self.dirty = None
+            else:
+                self.dirty.update(bus_ids)
+
+    def refresh(self):
+        """Reload dirty buses from Schedule and publish new connections."""
+        with self._lock:
+            dirty, self.dirty = self.dirty, set()
+            if dirty == set():
+                return
+            rows = Schedule.objects.filter(bus__is_active=True).order_by('bus_id', 'arrival_time', 'id')
+            blocks = dict(self.blocks) if dirty is not None else {}
+            if dirty is not None:
+                rows = rows.filter(bus_id__in=dirty)
+                for bus_id in dirty:
+                    blocks.pop(bus_id, None)
+
+            per_bus = {}
+            for bus_id, stop_id, t in rows.values_list('bus_id', 'stop_id', 'arrival_time'):
+                per_bus.setdefault(bus_id, []).append((stop_id, t.hour * 3600 + t.minute * 60 + t.second))
+            for bus_id, bus_rows in per_bus.items():
+                if len(bus_rows) > 1:
+                    blocks[bus_id] = _bus_connections(bus_rows)
+            self.blocks = blocks
+            self.connections = Connections(blocks)
+
+
+# =========================
+# PER-PROCESS TIMETABLE
+# =========================
+_timetable = None
+_timetable_lock = Lock()
+
+
+def get_timetable():
+    """The process-wide timetable with any dirty buses reloaded."""
+    global _timetable
+    with _timetable_lock:
+        if _timetable is None:
+            _timetable = Timetable()
+        timetable = _timetable
+    version = versions.current(versions.TIMETABLE)
+    if version != timetable.version:
+        timetable.mark_dirty(None, version)
+    timetable.refresh()
+    return timetable
+
+
+def invalidate_timetable(bus_ids=None):
+    """Reload `bus_ids` (or everything) on the next query, here and in other workers."""
+    version = versions.bump(versions.TIMETABLE)
+    if _timetable is not None:
+        _timetable.mark_dirty(bus_ids, version)
+
+
+def plan_timed_trip(from_name, to_name, depart, network=None):
+    """
+    Earliest-arrival itinerary leaving at or after `depart` (seconds since
+    midnight) as a one-item list, [] when nothing runs, or None when either
+    side matches no stop.
+    """
+    net = network or get_transit_network()
+    start_nodes = net.resolve_stops(from_name)
+    end_nodes = net.resolve_stops(to_name)
+    if not start_nodes or not end_nodes:
+        return None
+
+    connections = get_timetable().connections
+    found = connections.earliest_arrival(net, start_nodes, end_nodes, depart)
+    if found is None:
+        return []
+    _, legs = found
+    return [connections.itinerary(net, legs, depart)]
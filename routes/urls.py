@@ -1,10 +1,14 @@
 from django.urls import path, re_path
-from .views import RouteListCreateView, BusRouteView, update_route, TripPlannerView, SearchSuggestionsView
+from .views import RouteListCreateView, BusRouteView, update_route, TripPlannerView, BatchPlanView, PlanCacheStatsView, ReachabilityView, RouteFareView, SearchSuggestionsView
 
 urlpatterns = [
     path("", RouteListCreateView.as_view()),      # /api/routes/
-    path("plan/", TripPlannerView.as_view()),     # /api/routes/plan/?from=X&to=Y
+    path("plan/", TripPlannerView.as_view()),     # /api/routes/plan/?from=X&to=Y[&max_transfers=N|&depart=HH:MM]
+    path("plan/batch/", BatchPlanView.as_view()),  # POST pairs (JSON/NDJSON/CSV) -> NDJSON
+    path("plan/cache/", PlanCacheStatsView.as_view()),  # /api/routes/plan/cache/ (hit/miss counters)
+    path("reachable/", ReachabilityView.as_view()),  # /api/routes/reachable/?stop=ID&minutes=30[&output=geojson]
     path("search/", SearchSuggestionsView.as_view()), # /api/routes/search/?q=...
     re_path(r'^(?P<bus_no>\w+)/?$', BusRouteView.as_view()),  # Matches '100' or '100/'
     path("<int:route_id>/", update_route),       
+    path("<int:route_id>/fares/", RouteFareView.as_view()),  # ?from=<stop id>&to=<stop id> for one fare
 ]
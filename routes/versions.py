@@ -0,0 +1,54 @@
+"""
+Versions of the per-process planner data, shared by every worker.
+
+Route geometry, the transit network, fares, the timetable and the search
+index are cached in each process, but a write arrives through one worker
+and model signals only fire there. So every invalidation also bumps a
+CacheVersion row, and each cache remembers the version it was built at.
+Processes re-read the rows at most once per VERSION_CHECK_SECONDS (and right
+away on their own bump) and rebuild whatever was built at another version.
+"""
+import time
+from threading import Lock
+
+from django.db.models import F
+
+from .models import CacheVersion
+
+GEOMETRY = 'geometry'
+NETWORK = 'network'
+FARES = 'fares'
+TIMETABLE = 'timetable'
+SEARCH = 'search'
+
+# How stale another worker's write may look to this process
+VERSION_CHECK_SECONDS = 1.0
+
+_seen = {}
+_checked = None
+_lock = Lock()
+
+
+def _refresh():
+    global _seen, _checked
+    now = time.monotonic()
+    seen = dict(CacheVersion.objects.values_list('name', 'version'))
+    with _lock:
+        _seen, _checked = seen, now
+    return seen
+
+
+def current(name):
+    """Shared version of `name` (0 before its first bump)."""
+    if _checked is None or time.monotonic() - _checked >= VERSION_CHECK_SECONDS:
+        return _refresh().get(name, 0)
+    return _seen.get(name, 0)
+
+
+def bump(name):
+    """Move `name` to a new version and return it."""
+    if not CacheVersion.objects.filter(name=name).update(version=F('version') + 1):
+        CacheVersion.objects.get_or_create(name=name)
+        CacheVersion.objects.filter(name=name).update(version=F('version') + 1)
+    # Re-read the others too, so this worker sees every version up to its own
+    return _refresh()[name]
@@ -3,21 +3,41 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import api_view
+from rest_framework.parsers import JSONParser
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
+from .batch import plan_pairs, read_pairs, to_ndjson
 from .models import Route
+from .isochrone import reachable, reachable_stops, to_geojson
+from .conditional import (
+    bus_route_etag, bus_route_last_modified, route_list_etag, route_list_last_modified,
+)
+from .network import get_transit_network, network_version
+from .plan_cache import plan_cache, plan_key
+from .planner import MAX_TRANSFERS, plan_trip
+from .search import get_search_index, suggest_stops
+from .timetable import parse_clock, plan_timed_trip
 from .serializers import RouteSerializer
 
 from buses.models import Bus
 from stops.models import Stop
+from tracking.parsers import CSVParser, NDJSONParser
 
+@method_decorator(
+    condition(etag_func=route_list_etag, last_modified_func=route_list_last_modified),
+    name='get'
+)
 class RouteListCreateView(generics.ListCreateAPIView):
-    queryset = Route.objects.all()
+    queryset = Route.objects.select_related('summary')
     serializer_class = RouteSerializer
 
 @api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
 def update_route(request, route_id):
     try:
-        route = Route.objects.get(id=route_id)
+        route = Route.objects.select_related('summary').get(id=route_id)
     except Route.DoesNotExist:
         return Response(
            {"error": "Route not found"},
@@ -40,6 +60,7 @@ def update_route(request, route_id):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class BusRouteView(APIView):
+    @method_decorator(condition(etag_func=bus_route_etag, last_modified_func=bus_route_last_modified))
     def get(self, request, bus_no):
         bus = Bus.objects.filter(bus_number=str(bus_no)).first()
         if not bus:
@@ -63,151 +84,156 @@ class TripPlannerView(APIView):
         if not from_stop_name or not to_stop_name:
             return Response({"error": "Please provide 'from' and 'to' stop names"}, status=400)
 
-        # 1. Find all potential start and end stop records
-        start_stops = Stop.objects.filter(name__icontains=from_stop_name)
-        end_stops = Stop.objects.filter(name__icontains=to_stop_name)
+        max_transfers = request.query_params.get('max_transfers')
+        if max_transfers is not None:
+            if not max_transfers.isdigit() or int(max_transfers) > MAX_TRANSFERS:
+                return Response({"error": f"max_transfers must be 0-{MAX_TRANSFERS}"}, status=400)
+            max_transfers = int(max_transfers)
 
-        if not start_stops.exists() or not end_stops.exists():
-            return Response({"error": "Stops not found", "results": []})
+        depart = request.query_params.get('depart')
+        if depart is not None:
+            if max_transfers is not None:
+                return Response({"error": "Use either 'depart' or 'max_transfers'"}, status=400)
+            if depart == 'now':
+                # Whole minutes, so riders asking within the same minute share a cache entry
+                now = timezone.localtime()
+                depart = now.hour * 3600 + now.minute * 60
+            else:
+                try:
+                    depart = parse_clock(depart)
+                except ValueError as e:
+                    return Response({"error": str(e)}, status=400)
 
-        trip_results = []
-        direct_routes_found = False
+        key = plan_key(from_stop_name, to_stop_name, max_transfers, depart)
+        hit, results = plan_cache.get(key)
+        if not hit:
+            # Planned entirely in memory (see routes.network and routes.timetable)
+            version = network_version()
+            if depart is not None:
+                results = plan_timed_trip(from_stop_name, to_stop_name, depart)
+            else:
+                results = plan_trip(from_stop_name, to_stop_name, max_transfers)
+            plan_cache.put(key, results, version)
 
-        from tracking.utils import haversine
+        if results is None:
+            response = Response({"error": "Stops not found", "results": []})
+        else:
+            response = Response({"results": results})
+        response['X-Plan-Cache'] = 'hit' if hit else 'miss'
+        return response
+
+
+class BatchPlanView(APIView):
+    """
+    POST: many origin-destination pairs at once, as a JSON array, NDJSON or
+    CSV (from,to per row). Streams one NDJSON line per pair, in order, with
+    the best trip's fare and stop count (?full=1 adds every option).
+    Optional ?max_transfers=N as for TripPlannerView.
+    """
+    parser_classes = [JSONParser, NDJSONParser, CSVParser]
+    MAX_PAIRS = 5000
+
+    def post(self, request):
+        rows = request.data.get('pairs') if isinstance(request.data, dict) else request.data
+        if not isinstance(rows, list):
+            return Response({"error": "Expected a list of pairs"}, status=400)
+        try:
+            pairs = read_pairs(rows)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        if len(pairs) > self.MAX_PAIRS:
+            return Response({"error": f"At most {self.MAX_PAIRS} pairs per request"}, status=400)
+
+        max_transfers = request.query_params.get('max_transfers')
+        if max_transfers is not None:
+            if not max_transfers.isdigit() or int(max_transfers) > MAX_TRANSFERS:
+                return Response({"error": f"max_transfers must be 0-{MAX_TRANSFERS}"}, status=400)
+            max_transfers = int(max_transfers)
+        full = request.query_params.get('full') in ('1', 'true')
+
+        return StreamingHttpResponse(
+            to_ndjson(plan_pairs(pairs, max_transfers, full)),
+            content_type='application/x-ndjson',
+        )
 
-        # Helper to calculate route distance
-        def get_route_distance(route_id, start_order, end_order):
-            if start_order == end_order: return 0
-            
-            # Ensure order
-            s_ord = min(start_order, end_order)
-            e_ord = max(start_order, end_order)
-            
-            stops = list(Stop.objects.filter(route_id=route_id, order__gte=s_ord, order__lte=e_ord).order_by('order'))
-            total_dist = 0
-            for i in range(len(stops) - 1):
-                total_dist += haversine(
-                    stops[i].latitude, stops[i].longitude,
-                    stops[i+1].latitude, stops[i+1].longitude
-                )
-            return total_dist
-
-        # --- Strategy 1: Direct Routes ---
-        for start in start_stops:
-            for end in end_stops:
-                # Case 1: Forward Direction
-                if start.route == end.route and start.order < end.order:
-                    route = start.route
-                    buses = route.buses.filter(is_active=True)
-                    bus_numbers = [b.bus_number for b in buses]
-                    
-                    dist_km = get_route_distance(route.id, start.order, end.order)
-                    fare = max(5, round(dist_km * 5)) # Min fare 5 rs
-
-                    trip_results.append({
-                        "type": "Direct",
-                        "route_name": route.name,
-                        "bus_numbers": bus_numbers,
-                        "start_stop": start.name,
-                        "end_stop": end.name,
-                        "stops_count": end.order - start.order,
-                        "fare_estimate": fare
-                    })
-                    direct_routes_found = True
-
-                # Case 2: Reverse Direction (Heuristic Support)
-                elif start.route == end.route and start.order > end.order:
-                    route = start.route
-                    buses = route.buses.filter(is_active=True)
-                    bus_numbers = [b.bus_number for b in buses]
-                    
-                    dist_km = get_route_distance(route.id, start.order, end.order)
-                    fare = max(5, round(dist_km * 5))
-
-                    trip_results.append({
-                        "type": "Direct",
-                        "route_name": f"{route.name} (Return)",
-                        "bus_numbers": bus_numbers,
-                        "start_stop": start.name,
-                        "end_stop": end.name,
-                        "stops_count": start.order - end.order,
-                        "fare_estimate": fare
-                    })
-                    direct_routes_found = True
-
-        # --- Strategy 2: One-Hop Transfer ---
-        start_routes = {s.route.id: s for s in start_stops}
-        end_routes = {s.route.id: s for s in end_stops}
-
-        for r1_id, s1_obj in start_routes.items():
-            potential_transfer_stops = Stop.objects.filter(route_id=r1_id, order__gt=s1_obj.order)
-            
-            for t_stop in potential_transfer_stops:
-                for r2_id, s2_obj in end_routes.items():
-                    if r1_id == r2_id: continue 
-                    
-                    matching_transfer = Stop.objects.filter(
-                        route_id=r2_id, 
-                        name__iexact=t_stop.name, 
-                        order__lt=s2_obj.order
-                    ).first()
-                    
-                    if matching_transfer:
-                        route1 = s1_obj.route
-                        route2 = s2_obj.route
-                        
-                        dist1 = get_route_distance(route1.id, s1_obj.order, t_stop.order)
-                        dist2 = get_route_distance(route2.id, matching_transfer.order, s2_obj.order)
-                        
-                        total_fare = max(10, round((dist1 + dist2) * 5)) # Min 10 for transfer
-
-                        buses1 = [b.bus_number for b in route1.buses.filter(is_active=True)]
-                        buses2 = [b.bus_number for b in route2.buses.filter(is_active=True)]
-
-                        trip_results.append({
-                            "type": "Transfer",
-                            "start_stop": s1_obj.name,
-                            "end_stop": s2_obj.name,
-                            "total_stops": (t_stop.order - s1_obj.order) + (s2_obj.order - matching_transfer.order),
-                            "fare_estimate": total_fare,
-                            "legs": [
-                                {
-                                    "route_name": route1.name,
-                                    "bus_numbers": buses1,
-                                    "from": s1_obj.name,
-                                    "to": t_stop.name,
-                                    "stops": t_stop.order - s1_obj.order
-                                },
-                                {
-                                    "route_name": route2.name,
-                                    "bus_numbers": buses2,
-                                    "from": matching_transfer.name,
-                                    "to": s2_obj.name,
-                                    "stops": s2_obj.order - matching_transfer.order
-                                }
-                            ],
-                            "transfer_at": t_stop.name
-                        })
-
-
-        # Deduplicate results roughly (by route names)
-        # Using a dictionary key for uniqueness
-        unique_results = {}
-        for res in trip_results:
-            if res['type'] == 'Direct':
-                key = f"D-{res['route_name']}"
-            else:
-                key = f"T-{res['legs'][0]['route_name']}-{res['legs'][1]['route_name']}"
-            
-            if key not in unique_results:
-                unique_results[key] = res
-                
-        final_list = list(unique_results.values())
-        
-        # Sort: Direct first, then by total stops
-        final_list.sort(key=lambda x: (0 if x['type'] == 'Direct' else 1, x.get('stops_count', x.get('total_stops', 999))))
 
-        return Response({"results": final_list})
+class ReachabilityView(APIView):
+    """
+    GET ?stop=<id> (or ?from=<name>)&minutes=30&max_transfers=N[&output=geojson]
+    Every stop reachable within the time and transfer budgets, nearest first,
+    with travel minutes at average bus speed.
+    """
+    MAX_MINUTES = 180
+
+    def get(self, request):
+        net = get_transit_network()
+        stop_id = request.query_params.get('stop', '').strip()
+        from_stop_name = request.query_params.get('from', '').strip()
+        if stop_id:
+            if not stop_id.isdigit() or int(stop_id) not in net.node_of_stop:
+                return Response({"error": "Stop not found"}, status=404)
+            sources = [net.node_of_stop[int(stop_id)]]
+        elif from_stop_name:
+            sources = net.resolve_stops(from_stop_name)
+            if not sources:
+                return Response({"error": "Stop not found"}, status=404)
+        else:
+            return Response({"error": "Please provide 'stop' (id) or 'from' (name)"}, status=400)
+
+        minutes = request.query_params.get('minutes', '30')
+        if not minutes.isdigit() or not 0 < int(minutes) <= self.MAX_MINUTES:
+            return Response({"error": f"minutes must be 1-{self.MAX_MINUTES}"}, status=400)
+        max_transfers = request.query_params.get('max_transfers', str(MAX_TRANSFERS))
+        if not max_transfers.isdigit() or int(max_transfers) > MAX_TRANSFERS:
+            return Response({"error": f"max_transfers must be 0-{MAX_TRANSFERS}"}, status=400)
+
+        found = reachable(net, sources, int(minutes), int(max_transfers))
+        stops = reachable_stops(net, found)
+        if request.query_params.get('output') == 'geojson':
+            return Response(to_geojson(stops))
+        return Response({"count": len(stops), "stops": stops})
+
+
+class RouteFareView(APIView):
+    """
+    GET: the route's fare table (every stop pair), from the planner's
+    precomputed fares. ?from=<stop id>&to=<stop id> returns one fare.
+    """
+    def get(self, request, route_id):
+        net = get_transit_network()
+        if route_id not in net.route_nodes:
+            return Response({"error": "Route not found"}, status=status.HTTP_404_NOT_FOUND)
+        nodes = net.route_nodes[route_id]
+
+        from_stop, to_stop = request.query_params.get('from'), request.query_params.get('to')
+        if from_stop or to_stop:
+            ends = []
+            for stop_id in (from_stop, to_stop):
+                node = net.node_of_stop.get(int(stop_id)) if str(stop_id).isdigit() else None
+                if node is None or net.route_of[node] != route_id:
+                    return Response({"error": f"Stop '{stop_id}' is not on this route"}, status=400)
+                ends.append(node)
+            a, b = ends
+            return Response({
+                "route_id": route_id,
+                "from": net.names[a],
+                "to": net.names[b],
+                "distance_km": round(net.distance_between(a, b), 2),
+                "fare": net.fare(a, b),
+            })
+
+        return Response({
+            "route_id": route_id,
+            "route_name": net.route_names.get(route_id),
+            "rule": net.fares.rule(route_id),
+            "stops": [{"id": net.stop_ids[n], "name": net.names[n]} for n in nodes],
+            "fares": net.fares.matrices[route_id].tolist(),
+        })
+
+
+class PlanCacheStatsView(APIView):
+    def get(self, request):
+        return Response(plan_cache.stats())
 
 class SearchSuggestionsView(APIView):
     def get(self, request):
@@ -218,24 +244,22 @@ class SearchSuggestionsView(APIView):
             return Response([])
             
         results = []
+        # Prefix matches on any word, from the in-memory index (see routes.search)
+        index = get_search_index()
         
-        # Search Stops
+        # Search Stops (misspellings fall back to trigram matches)
         if search_type in ['all', 'stop']:
-            stops = Stop.objects.filter(name__icontains=query).values_list('name', flat=True).distinct()[:5]
-            for stop in stops:
+            for stop in suggest_stops(query, 5):
                 results.append({"type": "stop", "value": stop, "label": f"📍 {stop}"})
                 
         # Search Buses/Routes
         if search_type in ['all', 'bus']:
             # Search by bus number
-            buses = Bus.objects.filter(bus_number__icontains=query).values_list('bus_number', flat=True).distinct()[:5]
-            for bus in buses:
+            for bus in index.buses.search(query, 5):
                 results.append({"type": "bus", "value": bus, "label": f"🚌 Bus {bus}"})
                 
             # Search by route name
-            routes = Route.objects.filter(name__icontains=query).values_list('name', flat=True).distinct()[:3]
-            for route_name in routes:
-                 # Try to find a bus on this route to give a bus context, or just show route name
+            for route_name in index.routes.search(query, 3):
                  # Here we just show route name, client can interpret
                  results.append({"type": "route", "value": route_name, "label": f"🛣️ {route_name}"})
 
@@ -1,9 +1,9 @@
 from django.contrib import admin
-from .models import Stop
+from .models import Stop, StopPlace
 
 @admin.register(Stop)
 class StopAdmin(admin.ModelAdmin):
-    list_display = ('name', 'route', 'order', 'get_coordinates')
+    list_display = ('name', 'route', 'order', 'place', 'get_coordinates')
     list_filter = ('route',)
     search_fields = ('name', 'route__name')
     ordering = ('route', 'order')
@@ -22,3 +22,9 @@ class StopAdmin(admin.ModelAdmin):
     def get_coordinates(self, obj):
         return f"({obj.latitude:.4f}, {obj.longitude:.4f})"
     get_coordinates.short_description = 'Coordinates'
+
+
+@admin.register(StopPlace)
+class StopPlaceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'latitude', 'longitude')
+    search_fields = ('name',)
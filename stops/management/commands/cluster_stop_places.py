@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from stops.models import Stop, StopPlace
+from stops.places import rebuild_stop_places
+
+
+class Command(BaseCommand):
+    help = "Re-cluster every stop into stop places (used by the planner for transfers)"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_stop_places()
+        shared = StopPlace.objects.annotate(n=Count('stops')).filter(n__gt=1).count()
+        self.stdout.write(
+            f"Clustered {Stop.objects.count()} stops into {count} places "
+            f"({shared} shared by several stops) in {time.perf_counter() - started:.2f} s"
+        )
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.25 on 2026-10-18 14:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stops', '0004_alter_stop_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StopPlace',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+            ],
+            options={
+                'verbose_name': 'Stop Place',
+                'verbose_name_plural': 'Stop Places',
+            },
+        ),
+        migrations.AddField(
+            model_name='stop',
+            name='place',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stops', to='stops.stopplace'),
+        ),
+    ]
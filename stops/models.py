@@ -1,12 +1,30 @@
 from django.db import models
 from routes.models import Route
 
+class StopPlace(models.Model):
+    """
+    One physical place served by stops of several routes (e.g. both
+    directions of a square). Filled in by stops.places.
+    """
+    name = models.CharField(max_length=100)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+
+    class Meta:
+        verbose_name = "Stop Place"
+        verbose_name_plural = "Stop Places"
+
+    def __str__(self):
+        return self.name
+
+
 class Stop(models.Model):
     route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name="stops")
     name = models.CharField(max_length=100)
     latitude = models.FloatField()
     longitude = models.FloatField()
     order = models.PositiveIntegerField()
+    place = models.ForeignKey(StopPlace, on_delete=models.SET_NULL, null=True, blank=True, related_name="stops")
 
     class Meta:
         verbose_name = "Stop"
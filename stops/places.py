@@ -0,0 +1,143 @@
+"""
+Clustering of Stop rows into StopPlace (one physical place per cluster).
+
+Two stops are the same place when they are
+  - within COLOCATED_RADIUS_M, whatever their names,
+  - within SAME_NAME_RADIUS_M with the same (normalized) name, or
+  - within SIMILAR_NAME_RADIUS_M with names sharing NAME_SIMILARITY of
+    their trigrams ("Master Canteen Sq" / "Master canteen square").
+Candidate pairs come from a spatial grid, never all pairs. The planner reads
+Stop.place to find transfers (routes.network).
+"""
+import math
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from routes.network import invalidate_transit_network
+from routes.search import normalize, trigrams
+from tracking.utils import KM_PER_DEGREE_LAT, GridIndex, haversine
+from .models import Stop, StopPlace
+
+COLOCATED_RADIUS_M = 15
+SAME_NAME_RADIUS_M = 300
+SIMILAR_NAME_RADIUS_M = 75
+NAME_SIMILARITY = 0.5
+
+
+def name_similarity(a, b):
+    """Jaccard similarity of the two names' trigrams (0..1)."""
+    ga, gb = trigrams(normalize(a)), trigrams(normalize(b))
+    return len(ga & gb) / len(ga | gb) if ga and gb else 0.0
+
+
+def same_place(a, b, distance_km=None):
+    if distance_km is None:
+        distance_km = haversine(a.latitude, a.longitude, b.latitude, b.longitude)
+    meters = distance_km * 1000
+    if meters <= COLOCATED_RADIUS_M:
+        return True
+    if meters <= SAME_NAME_RADIUS_M and normalize(a.name) == normalize(b.name):
+        return True
+    return meters <= SIMILAR_NAME_RADIUS_M and name_similarity(a.name, b.name) >= NAME_SIMILARITY
+
+
+def cluster_stops(stops):
+    """Group stops into places (union-find over grid neighbours). Returns lists of stops."""
+    by_id = {s.id: s for s in stops}
+    grid = GridIndex(SAME_NAME_RADIUS_M / 1000)
+    for s in stops:
+        grid.insert(s.id, s.latitude, s.longitude)
+
+    parent = {s.id: s.id for s in stops}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for s in stops:
+        for other_id, dist in grid.nearby(s.latitude, s.longitude, SAME_NAME_RADIUS_M / 1000):
+            if other_id > s.id and same_place(s, by_id[other_id], dist):
+                parent[find(other_id)] = find(s.id)
+
+    clusters = defaultdict(list)
+    for s in stops:
+        clusters[find(s.id)].append(s)
+    return list(clusters.values())
+
+
+def _place_fields(stops):
+    """Most used name and mean position of the member stops."""
+    names = Counter(s.name for s in stops)
+    name = min(names, key=lambda n: (-names[n], n))
+    return {
+        "name": name,
+        "latitude": sum(s.latitude for s in stops) / len(stops),
+        "longitude": sum(s.longitude for s in stops) / len(stops),
+    }
+
+
+@transaction.atomic
+def rebuild_stop_places():
+    """Recluster every stop from scratch. Returns the number of places."""
+    stops = list(Stop.objects.all())
+    clusters = cluster_stops(stops)
+
+    Stop.objects.update(place=None)
+    StopPlace.objects.all().delete()
+    places = StopPlace.objects.bulk_create([StopPlace(**_place_fields(c)) for c in clusters])
+    for place, members in zip(places, clusters):
+        for s in members:
+            s.place_id = place.id
+    Stop.objects.bulk_update(stops, ['place'], batch_size=500)
+
+    invalidate_transit_network()
+    return len(places)
+
+
+@transaction.atomic
+def assign_place(stop):
+    """
+    Incremental update for one saved stop: join the place of a matching
+    neighbour (merging places the stop now bridges) or start a new one.
+    """
+    d_lat = SAME_NAME_RADIUS_M / 1000 / KM_PER_DEGREE_LAT
+    d_lng = d_lat / math.cos(math.radians(stop.latitude))
+    neighbours = [
+        other for other in Stop.objects.filter(
+            latitude__range=(stop.latitude - d_lat, stop.latitude + d_lat),
+            longitude__range=(stop.longitude - d_lng, stop.longitude + d_lng),
+        ).exclude(pk=stop.pk)
+        if same_place(stop, other)
+    ]
+    place_ids = Counter(o.place_id for o in neighbours if o.place_id)
+    previous_place_id = stop.place_id
+
+    if place_ids:
+        # Keep the biggest place, fold the others into it
+        place_id = min(place_ids, key=lambda p: (-place_ids[p], p))
+        others = set(place_ids) - {place_id}
+        if others:
+            Stop.objects.filter(place_id__in=others).update(place_id=place_id)
+            StopPlace.objects.filter(id__in=others).delete()
+    else:
+        place_id = StopPlace.objects.create(**_place_fields([stop])).id
+    # Neighbours that were never clustered join too
+    unplaced = [o.pk for o in neighbours if not o.place_id]
+    Stop.objects.filter(pk__in=[stop.pk] + unplaced).update(place_id=place_id)
+    stop.place_id = place_id
+
+    members = list(Stop.objects.filter(place_id=place_id))
+    StopPlace.objects.filter(id=place_id).update(**_place_fields(members))
+    if previous_place_id and previous_place_id != place_id:
+        drop_place_if_empty(previous_place_id)
+
+    invalidate_transit_network()
+    return place_id
+
+
+def drop_place_if_empty(place_id):
+    if place_id and not Stop.objects.filter(place_id=place_id).exists():
+        StopPlace.objects.filter(id=place_id).delete()
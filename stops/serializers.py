@@ -4,4 +4,5 @@ from .models import Stop
 class StopSerializer(serializers.ModelSerializer):
     class Meta:
         model = Stop
-        fields = ['id', 'name', 'latitude', 'longitude', 'order', 'route']
+        fields = ['id', 'name', 'latitude', 'longitude', 'order', 'route', 'place']
+        read_only_fields = ['place']
@@ -1,3 +1,33 @@
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 
-# Create your tests here.
+from routes.models import Route
+
+from .models import Stop
+from .places import cluster_stops
+
+
+class ClusterStopsTests(SimpleTestCase):
+    def _stop(self, id, name, lat, lng):
+        return Stop(id=id, name=name, latitude=lat, longitude=lng, order=0, route_id=id)
+
+    def test_places(self):
+        stops = [
+            self._stop(1, "Master canteen square", 20.2700, 85.8400),
+            self._stop(2, "Master Canteen Sq", 20.2703, 85.8401),     # ~35 m, similar name
+            self._stop(3, "Master canteen square", 20.2720, 85.8400),  # ~220 m, same name
+            self._stop(4, "Railway Colony", 20.2704, 85.8400),         # ~45 m, different name
+            self._stop(5, "Bus Depot", 20.27001, 85.84001),            # co-located with 1
+            self._stop(6, "Master canteen square", 20.3000, 85.8400),  # same name, 3 km away
+        ]
+        clusters = sorted(sorted(s.id for s in c) for c in cluster_stops(stops))
+        self.assertEqual(clusters, [[1, 2, 3, 5], [4], [6]])
+
+
+class NearbyStopsTests(TestCase):
+    def test_nearest_first_within_radius(self):
+        route = Route.objects.create(name="Cuttack Line")
+        for order, (name, lat) in enumerate([("Badambadi", 20.4600), ("Buxi Bazaar", 20.4630), ("Link Road", 20.4800)]):
+            Stop.objects.create(route=route, name=name, order=order, latitude=lat, longitude=85.8800)
+        response = self.client.get('/api/stops/nearby/', {'lat': 20.4625, 'lng': 85.8800, 'radius': 1000})
+        self.assertEqual([(s["name"], s["distance_m"]) for s in response.json()],
+                         [("Buxi Bazaar", 56), ("Badambadi", 278)])
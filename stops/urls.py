@@ -1,7 +1,8 @@
-from django.urls import path
-from .views import StopListCreateView, update_stop
+from django.urls import path, re_path
+from .views import StopListCreateView, nearby_stops, update_stop
 
 urlpatterns = [
     path('', StopListCreateView.as_view()),           # /api/stops/ (GET, POST)
     path('<int:stop_id>/', update_stop),              # /api/stops/{id}/ (PUT, PATCH)
+    re_path(r'^nearby/?$', nearby_stops),             # /api/stops/nearby?lat=&lng=&radius=
 ]
@@ -2,6 +2,8 @@ from rest_framework import generics
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
+from routes.network import get_transit_network
+from tracking.nearby import parse_nearby_query
 from .models import Stop
 from .serializers import StopSerializer
 
@@ -10,6 +12,36 @@ class StopListCreateView(generics.ListCreateAPIView):
     serializer_class = StopSerializer
 
 
+# =========================
+# NEARBY STOPS
+# =========================
+@api_view(['GET'])
+def nearby_stops(request):
+    """
+    GET ?lat=&lng=&radius=<meters, default 500>&limit=<default 20>
+    Stops within the radius, nearest first, from the planner's in-memory grid.
+    """
+    try:
+        lat, lng, radius_km, limit = parse_nearby_query(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    net = get_transit_network()
+    results = [
+        {
+            "id": net.stop_ids[node],
+            "name": net.names[node],
+            "route": net.route_of[node],
+            "route_name": net.route_names.get(net.route_of[node]),
+            "latitude": net.lats[node],
+            "longitude": net.lngs[node],
+            "distance_m": round(dist_km * 1000),
+        }
+        for node, dist_km in net.nearby_stops(lat, lng, radius_km)[:limit]
+    ]
+    return Response(results)
+
+
 # =========================
 # UPDATE / DELETE STOP BY ID
 # =========================
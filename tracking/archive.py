@@ -0,0 +1,211 @@
+"""
+Columnar archive of closed location history days.
+
+tracking.history.compact_closed_days moves each finished day table into a
+directory of flat .npy columns (LOCATION_ARCHIVE_DIR/YYYYMMDD.<version>/):
+
+    time.npy     float64  epoch seconds
+    bus_id.npy   int64
+    lat.npy      float64
+    lng.npy      float64
+    speed.npy    int16
+    route_id.npy int64    route the bus served when recorded (0: none)
+    buses.npy    int64    sorted distinct bus ids
+    offsets.npy  int64    rows of buses[i] are offsets[i]:offsets[i + 1]
+
+Rows are sorted by (bus_id, time), so one bus over a time range is two
+binary searches and a slice. Columns are opened with np.load(mmap_mode='r'):
+queries return numpy arrays backed by the page cache, and scanning millions
+of points never builds a model instance or a Python row.
+
+Rewriting a day (late rows merged in) creates the next version directory
+and only then removes the old one, so readers always find a complete day.
+"""
+import shutil
+import threading
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+DTYPES = {
+    "time": np.float64,
+    "bus_id": np.int64,
+    "lat": np.float64,
+    "lng": np.float64,
+    "speed": np.int16,
+    "route_id": np.int64,
+}
+DAY_FORMAT = "%Y%m%d"
+
+
+def archive_dir():
+    return Path(settings.LOCATION_ARCHIVE_DIR)
+
+
+def empty_columns():
+    return {name: np.empty(0, dtype=dtype) for name, dtype in DTYPES.items()}
+
+
+def _versions():
+    """{day: [(version, path)] oldest first} of the archive directories."""
+    root = archive_dir()
+    found = {}
+    if not root.is_dir():
+        return found
+    for entry in root.iterdir():
+        day, _, version = entry.name.partition(".")
+        if entry.is_dir() and len(day) == 8 and day.isdigit() and version.isdigit():
+            found.setdefault(datetime.strptime(day, DAY_FORMAT).date(), []).append((int(version), entry))
+    for paths in found.values():
+        paths.sort()
+    return found
+
+
+def _latest(day):
+    root = archive_dir()
+    paths = [
+        (int(entry.name.partition(".")[2]), entry)
+        for entry in root.glob(f"{day:{DAY_FORMAT}}.*")
+        if entry.is_dir() and entry.name.partition(".")[2].isdigit()
+    ] if root.is_dir() else []
+    return max(paths, default=(0, None))
+
+
+def archived_days():
+    """Sorted dates that have an archive directory."""
+    return sorted(_versions())
+
+
+# =========================
+# WRITES
+# =========================
+def write_day(day, columns):
+    """
+    Store `columns` ({name: array}, any order) as the archive of `day`,
+    merged with what is already archived for it (late rows of a compacted
+    day). Returns the number of rows archived for the day.
+    """
+    columns = {name: np.asarray(columns[name], dtype=dtype) for name, dtype in DTYPES.items()}
+    existing = load_day(day)
+    if existing is not None:
+        columns = {name: np.concatenate([existing.columns[name], columns[name]]) for name in DTYPES}
+
+    order = np.lexsort((columns["time"], columns["bus_id"]))
+    columns = {name: values[order] for name, values in columns.items()}
+    buses, starts = np.unique(columns["bus_id"], return_index=True)
+    offsets = np.append(starts, len(order)).astype(np.int64)
+
+    root = archive_dir()
+    version, _ = _latest(day)
+    final = root / f"{day:{DAY_FORMAT}}.{version + 1}"
+    tmp = root / f".{final.name}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name, values in columns.items():
+        np.save(tmp / f"{name}.npy", values)
+    np.save(tmp / "buses.npy", buses.astype(np.int64))
+    np.save(tmp / "offsets.npy", offsets)
+    tmp.rename(final)
+
+    # Open memmaps of the old files stay valid until closed
+    for _, path in _versions().get(day, []):
+        if path != final:
+            shutil.rmtree(path, ignore_errors=True)
+    return len(order)
+
+
+# =========================
+# READS
+# =========================
+class ArchiveDay:
+    """Memory-mapped columns of one archived day."""
+
+    def __init__(self, path):
+        self.path = path
+        self.columns = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in DTYPES}
+        self.buses = np.load(path / "buses.npy")
+        self.offsets = np.load(path / "offsets.npy")
+
+    def __len__(self):
+        return len(self.columns["time"])
+
+    def bus_rows(self, bus_id, start_ts, end_ts):
+        """Row slice of a bus with start_ts <= time < end_ts."""
+        i = np.searchsorted(self.buses, bus_id)
+        if i == len(self.buses) or self.buses[i] != bus_id:
+            return slice(0, 0)
+        lo, hi = int(self.offsets[i]), int(self.offsets[i + 1])
+        times = self.columns["time"][lo:hi]
+        return slice(lo + int(np.searchsorted(times, start_ts)), lo + int(np.searchsorted(times, end_ts)))
+
+    def select(self, start_ts, end_ts, bus_ids=None, route_id=None):
+        """
+        {name: array} of the rows in the range, of `bus_ids` (None: every bus)
+        and recorded on `route_id` (None: any route).
+        """
+        if bus_ids is None:
+            times = self.columns["time"]
+            mask = (times >= start_ts) & (times < end_ts)
+            if route_id is not None:
+                mask &= self.columns["route_id"] == route_id
+            return {name: values[mask] for name, values in self.columns.items()}
+        slices = [self.bus_rows(bus_id, start_ts, end_ts) for bus_id in sorted(bus_ids)]
+        selected = {
+            name: np.concatenate([values[s] for s in slices]) if slices else np.empty(0, dtype=DTYPES[name])
+            for name, values in self.columns.items()
+        }
+        if route_id is not None:
+            mask = selected["route_id"] == route_id
+            selected = {name: values[mask] for name, values in selected.items()}
+        return selected
+
+
+_days = {}  # day -> ArchiveDay of its newest version
+_days_lock = threading.Lock()
+
+
+def load_day(day):
+    """ArchiveDay of a date, or None when it is not archived."""
+    _, path = _latest(day)
+    if path is None:
+        return None
+    with _days_lock:
+        cached = _days.get(day)
+        if cached is None or cached.path != path:
+            cached = _days[day] = ArchiveDay(path)
+        return cached
+
+
+def positions(start, end, bus_ids=None, route_id=None):
+    """
+    {name: array} of archived positions with start <= time < end (aware
+    datetimes), sorted by bus then time within each day, days in order.
+    `bus_ids` limits the rows to those buses and `route_id` to the ones
+    recorded while serving that route; None scans every bus or route.
+    """
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    first = datetime.fromtimestamp(start_ts, tz=dt_timezone.utc).date()
+    last = datetime.fromtimestamp(end_ts, tz=dt_timezone.utc).date()
+    parts = []
+    for day in archived_days():
+        if first <= day <= last:
+            archived = load_day(day)
+            if archived is not None:
+                parts.append(archived.select(start_ts, end_ts, bus_ids, route_id))
+    if not parts:
+        return empty_columns()
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([part[name] for part in parts]) for name in DTYPES}
+
+
+def bus_positions(bus_id, start, end):
+    """Archived positions of one bus in the range, oldest first."""
+    return positions(start, end, [bus_id])
+
+
+def route_positions(route_id, start, end):
+    """Archived positions recorded on a route, whichever buses served it then."""
+    return positions(start, end, route_id=route_id)
@@ -0,0 +1,224 @@
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+
+from buses.models import Bus
+from routes.geometry import get_route_geometries
+from .fleet_state import get_fleet_state, load_live_locations, update_sql
+from .history import flush_location_history, record_rows
+from .models import LiveLocation
+from .utils import haversine_pairwise
+
+# Same rules as MoveBusView
+SIMULATION_SPEED_KMPH = 800
+TERMINAL_WAIT_SECONDS = 5.0
+ARRIVAL_PROGRESS = 0.99
+SPEED_CHANGE_PROBABILITY = 0.2
+MIN_SPEED, MAX_SPEED = 40, 100
+
+UPDATED_FIELDS = [
+    'latitude', 'longitude', 'current_stop_index', 'is_moving_forward',
+    'stop_arrival_time', 'last_moved_at', 'speed', 'timestamp',
+]
+
+
+class FleetTickEngine:
+    """
+    Steps every active bus at once.
+
+    All route geometries are packed into flat stop arrays (lat, lng, cumulative km)
+    and every bus holds an offset into them, so a tick is a handful of NumPy
+    operations over the whole fleet followed by one batched UPDATE.
+    """
+
+    def __init__(self, interval=2.0, seed=None):
+        self.interval = interval
+        self.rng = np.random.default_rng(seed)
+        self.lives = []
+
+    # -------------------------
+    # Loading
+    # -------------------------
+    def load(self):
+        """(Re)load active buses, their routes and live locations."""
+        buses = list(
+            Bus.objects.filter(is_active=True, route__isnull=False).order_by('id')
+        )
+        geometries = get_route_geometries(b.route_id for b in buses)
+        buses = [b for b in buses if len(geometries[b.route_id])]
+
+        lives = load_live_locations([b.id for b in buses])
+        # Buses that never moved start at their first stop
+        missing = [
+            LiveLocation(
+                bus=b,
+                latitude=float(geometries[b.route_id].lats[0]),
+                longitude=float(geometries[b.route_id].lngs[0]),
+                current_stop_index=0,
+                is_moving_forward=True
+            )
+            for b in buses if b.id not in lives
+        ]
+        if missing:
+            LiveLocation.objects.bulk_create(missing)
+            lives.update(load_live_locations([l.bus_id for l in missing]))
+
+        # Pack route geometries into flat arrays
+        offsets = {}
+        lats, lngs, cums = [], [], []
+        size = 0
+        for route_id, geometry in geometries.items():
+            if not len(geometry):
+                continue
+            offsets[route_id] = size
+            lats.append(geometry.lats)
+            lngs.append(geometry.lngs)
+            cums.append(geometry.cum_km[:len(geometry)])
+            size += len(geometry)
+
+        self.stop_lat = np.concatenate(lats) if lats else np.zeros(0)
+        self.stop_lng = np.concatenate(lngs) if lngs else np.zeros(0)
+        self.stop_cum = np.concatenate(cums) if cums else np.zeros(0)
+
+        self.lives = [lives[b.id] for b in buses]
+        self.offset = np.array([offsets[b.route_id] for b in buses], dtype=np.int64)
+        self.n_stops = np.array([len(geometries[b.route_id]) for b in buses], dtype=np.int64)
+
+        self.lat = np.array([l.latitude for l in self.lives], dtype=np.float64)
+        self.lng = np.array([l.longitude for l in self.lives], dtype=np.float64)
+        self.idx = np.array([l.current_stop_index for l in self.lives], dtype=np.int64)
+        self.forward = np.array([l.is_moving_forward for l in self.lives], dtype=bool)
+        self.speed = np.array([l.speed for l in self.lives], dtype=np.int64)
+        self.arrival = np.array([
+            l.stop_arrival_time.timestamp() if l.stop_arrival_time else np.nan
+            for l in self.lives
+        ], dtype=np.float64)
+        return len(self.lives)
+
+    # -------------------------
+    # Stepping
+    # -------------------------
+    def step(self, now=None):
+        """Advance every bus by one interval. Returns the number of buses moved."""
+        if not self.lives:
+            return 0
+        now = now or timezone.now()
+        now_ts = now.timestamp()
+        last = self.n_stops - 1
+
+        # --- Logic 0: Dynamic Data Simulation ---
+        change = self.rng.random(len(self.lives)) < SPEED_CHANGE_PROBABILITY
+        delta = self.rng.integers(-5, 6, len(self.lives))
+        self.speed = np.where(change, np.clip(self.speed + delta, MIN_SPEED, MAX_SPEED), self.speed)
+
+        # --- Logic 1: Stop Waiting (Start & End Only) ---
+        has_arrival = ~np.isnan(self.arrival)
+        at_terminal = (self.idx == 0) | (self.idx == last)
+        required_delay = np.where(at_terminal, TERMINAL_WAIT_SECONDS, 0.0)
+        waiting = has_arrival & ((now_ts - self.arrival) < required_delay)
+        self.arrival[has_arrival & ~waiting] = np.nan
+
+        # SAFETY CHECK: invalid index -> back to the first stop
+        invalid = (self.idx > last) | (self.idx < 0)
+        self.idx[invalid] = 0
+        self.lat[invalid] = self.stop_lat[self.offset[invalid]]
+        self.lng[invalid] = self.stop_lng[self.offset[invalid]]
+
+        # --- Logic 2: Movement ---
+        moving = ~waiting
+        fwd = self.forward
+        next_idx = np.where(
+            fwd,
+            np.where(self.idx < last, self.idx + 1, self.idx - 1),
+            np.where(self.idx > 0, self.idx - 1, self.idx + 1),
+        )
+        new_forward = np.where(fwd, self.idx < last, self.idx <= 0)
+        next_idx = np.clip(next_idx, 0, last)
+
+        cur = self.offset + self.idx
+        nxt = self.offset + next_idx
+        cur_lat, cur_lng = self.stop_lat[cur], self.stop_lng[cur]
+        next_lat, next_lng = self.stop_lat[nxt], self.stop_lng[nxt]
+
+        seg_dist_km = np.abs(self.stop_cum[nxt] - self.stop_cum[cur])
+        has_length = seg_dist_km > 0
+        seg_time_sec = np.where(has_length, (seg_dist_km / SIMULATION_SPEED_KMPH) * 3600, 1.0)
+        progress_step = self.interval / seg_time_sec
+
+        dist_from_start = haversine_pairwise(cur_lat, cur_lng, self.lat, self.lng)
+        safe_len = np.where(has_length, seg_dist_km, 1.0)
+        current_progress = np.where(has_length, dist_from_start / safe_len, 1.0)
+        new_progress = current_progress + progress_step
+
+        arrived = moving & (new_progress >= ARRIVAL_PROGRESS)
+        en_route = moving & ~arrived
+
+        self.lat = np.where(arrived, next_lat, self.lat)
+        self.lng = np.where(arrived, next_lng, self.lng)
+        self.idx = np.where(arrived, next_idx, self.idx)
+        self.forward = np.where(arrived, new_forward, self.forward)
+        self.arrival[arrived] = now_ts
+
+        self.lat = np.where(en_route, cur_lat + (next_lat - cur_lat) * new_progress, self.lat)
+        self.lng = np.where(en_route, cur_lng + (next_lng - cur_lng) * new_progress, self.lng)
+
+        self._persist(now, en_route)
+        return int(moving.sum())
+
+    def _persist(self, now, en_route):
+        """
+        Write every bus back in one transaction.
+
+        Uses a single executemany UPDATE rather than QuerySet.bulk_update: for
+        thousands of rows bulk_update spends seconds compiling its CASE/WHEN
+        expressions, longer than the tick interval itself.
+        """
+        to_db = connection.ops.adapt_datetimefield_value
+        now_db = to_db(now)
+        arrival = self.arrival.tolist()
+        moved = en_route.tolist()
+        rows = []
+        for i, (live, lat, lng, idx, forward, speed) in enumerate(zip(
+            self.lives, self.lat.tolist(), self.lng.tolist(), self.idx.tolist(),
+            self.forward.tolist(), self.speed.tolist()
+        )):
+            if arrival[i] != arrival[i]:  # NaN
+                live.stop_arrival_time = None
+            elif live.stop_arrival_time is None or live.stop_arrival_time.timestamp() != arrival[i]:
+                live.stop_arrival_time = now
+            if moved[i]:
+                live.last_moved_at = now
+
+            rows.append((
+                lat, lng, idx, forward, to_db(live.stop_arrival_time),
+                to_db(live.last_moved_at), speed, now_db, live.pk
+            ))
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.executemany(update_sql(UPDATED_FIELDS), rows)
+
+        # Keep the shared fleet table in step so reads don't see stale positions
+        state = get_fleet_state()
+        if state:
+            now_ts = now.timestamp()
+            state.write_columns(
+                [live.bus_id for live in self.lives],
+                live_id=[live.pk for live in self.lives],
+                lat=self.lat, lng=self.lng, stop_index=self.idx,
+                forward=self.forward, speed=self.speed,
+                timestamp=np.full(len(self.lives), now_ts),
+                last_moved_at=[
+                    live.last_moved_at.timestamp() if live.last_moved_at else np.nan
+                    for live in self.lives
+                ],
+                stop_arrival_time=self.arrival,
+            )
+
+        # One history batch per tick
+        now_ts = now.timestamp()
+        record_rows(
+            (live.bus_id, now_ts, lat, lng, speed)
+            for live, lat, lng, speed in zip(self.lives, self.lat.tolist(), self.lng.tolist(), self.speed.tolist())
+        )
+        flush_location_history()
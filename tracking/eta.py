@@ -0,0 +1,127 @@
+import numpy as np
+
+from routes.geometry import get_route_geometries
+from .fleet_state import load_live_locations, save_live_location
+from .utils import haversine
+
+# Dwell time added before every stop after the first one (3 seconds)
+STOP_DELAY_MINUTES = 3 / 60
+
+
+def eta_minutes_along(geometry, current_idx, forward, lat, lng, bus_speed):
+    """
+    Stop indexes left in the current direction of travel and the raw
+    (unrounded) minutes to reach each of them.
+
+    Only the first leg (bus position -> next stop) needs a haversine call;
+    the rest of the path is read from the route's cumulative distance array.
+    """
+    if forward:
+        indexes = np.arange(current_idx + 1, len(geometry))
+    else:
+        indexes = np.arange(current_idx - 1, -1, -1)
+    if not indexes.size:
+        return indexes, np.zeros(0)
+
+    first = indexes[0]
+    first_leg_km = haversine(lat, lng, geometry.lats[first], geometry.lngs[first])
+    km = first_leg_km + np.abs(geometry.cum_km[indexes] - geometry.cum_km[first])
+    travel_min = (km / bus_speed) * 60
+
+    # Stop delay is added before a stop once the bus has accumulated any travel time
+    delayed = np.concatenate(([False], travel_min[:-1] > 0))
+    return indexes, travel_min + np.cumsum(delayed) * STOP_DELAY_MINUTES
+
+
+def compute_stops_eta(geometry, current_idx, forward, lat, lng, bus_speed):
+    """ETAs for every stop left in the current direction of travel."""
+    indexes, minutes = eta_minutes_along(geometry, current_idx, forward, lat, lng, bus_speed)
+    return [
+        {
+            "stop_name": geometry.names[idx],
+            "eta_minutes": max(1, round(m)),
+            "order": geometry.orders[idx]
+        }
+        for idx, m in zip(indexes.tolist(), minutes.tolist())
+    ]
+
+
+def build_bus_eta(bus, live, geometry, bus_speed):
+    """
+    ETA payload for one bus (the BusETAView response item).
+    An out-of-range `current_stop_index` is reset to 0 on `live`; the caller
+    is responsible for saving it.
+    """
+    current_idx = live.current_stop_index
+
+    # SAFETY CHECK: Valid index?
+    if current_idx >= len(geometry) or current_idx < 0:
+        current_idx = 0
+        live.current_stop_index = 0
+    forward = live.is_moving_forward
+
+    # SAFETY CHECK: Fix direction if stuck at terminal
+    if current_idx == 0 and not forward:
+        forward = True
+    elif current_idx == len(geometry) - 1 and forward:
+        forward = False
+
+    # Calculate ETAs for all stops from the current position
+    stops_eta = compute_stops_eta(
+        geometry, current_idx, forward,
+        live.latitude, live.longitude, bus_speed
+    )
+
+    # Handle case where no stops provided
+    if stops_eta:
+        next_stop_name = stops_eta[0]["stop_name"]
+        first_eta = stops_eta[0]["eta_minutes"]
+    else:
+        # Fallback: If no stops in ETA list, we are at terminal.
+        # Display current stop as "Arrived at X" or just X.
+        next_stop_name = geometry.names[current_idx]
+        first_eta = 0
+
+    return {
+        "bus_id": bus.id,
+        "bus_no": bus.bus_number,
+        "current_stop": geometry.names[current_idx],
+        "is_moving_forward": forward,
+        "stops_eta": stops_eta,
+        # For backward compatibility
+        "next_stop": next_stop_name,
+        "eta_minutes": first_eta,
+        "next_stop_name": next_stop_name,
+        "next_stop_eta_minutes": first_eta,
+        "speed": live.speed,
+        "crowding": live.crowding
+    }
+
+
+def collect_bus_etas(buses, bus_speed):
+    """
+    ETA payloads for many buses with a fixed number of queries:
+    live locations and stops are loaded in bulk, not per bus.
+    Buses without a route, live location or stops are skipped.
+    """
+    buses = list(buses)
+    lives = load_live_locations([b.id for b in buses])
+    geometries = get_route_geometries(b.route_id for b in buses if b.route_id)
+
+    results = []
+    for bus in buses:
+        live = lives.get(bus.id)
+        if not live or not bus.route_id:
+            continue
+
+        geometry = geometries[bus.route_id]
+        if not len(geometry):
+            continue
+
+        old_idx = live.current_stop_index
+        results.append(build_bus_eta(bus, live, geometry, bus_speed))
+        if live.current_stop_index != old_idx:
+            # Auto-correct invalid index
+            save_live_location(live)
+
+    return results
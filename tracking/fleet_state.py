@@ -0,0 +1,485 @@
+"""
+Hot fleet state shared by every worker on the host.
+
+Live positions live in a fixed-layout table in shared memory, one slot per bus
+(slot number == bus id). Views read and write slots; a single background
+flusher per host writes changed ("dirty") slots back to LiveLocation in
+batches. The DB is only read to warm a slot the first time a bus is seen.
+
+Each slot is guarded by a sequence counter (seqlock): writers make it odd while
+they update the row and even again when done, readers retry if it changed.
+Writers are serialised per slot by a byte-range lock on a lock file (plus a
+thread lock within the process), so two writers never interleave on a row.
+
+The segment outlives the processes using it, and so may outlive the data it
+was filled from (a restored, flushed or recreated DB). Slot 0 is never a bus
+and holds the segment's generation; every slot is stamped with the
+generation it was written in and only slots of the current one are trusted.
+The first process to attach checks the slots against LiveLocation and moves
+to a new generation when they disagree, which makes every slot cold.
+"""
+import atexit
+import contextlib
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locks, fine for runserver
+    fcntl = None
+
+from .history import record_positions
+from .models import LiveLocation
+
+logger = logging.getLogger(__name__)
+
+CROWDING_LEVELS = ['Low', 'Medium', 'High']
+
+# Bump LAYOUT_VERSION when SLOT_DTYPE changes: it is part of the segment name
+LAYOUT_VERSION = 2
+SLOT_DTYPE = np.dtype([
+    ('seq', np.uint32),
+    ('generation', np.uint32),
+    ('dirty', np.uint8),
+    ('forward', np.uint8),
+    ('crowding', np.uint8),
+    ('stop_index', np.int32),
+    ('speed', np.int32),
+    ('bus_id', np.int64),
+    ('live_id', np.int64),
+    ('lat', np.float64),
+    ('lng', np.float64),
+    ('timestamp', np.float64),
+    ('last_moved_at', np.float64),
+    ('stop_arrival_time', np.float64),
+], align=True)
+
+FLUSH_FIELDS = [
+    'latitude', 'longitude', 'current_stop_index', 'is_moving_forward',
+    'speed', 'crowding', 'timestamp', 'last_moved_at', 'stop_arrival_time',
+]
+
+READ_RETRIES = 100
+
+
+def _to_ts(value):
+    return value.timestamp() if value else np.nan
+
+
+def _from_ts(value):
+    if value != value:  # NaN
+        return None
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+
+
+class FleetState:
+    """Shared-memory table of live bus positions (see module docstring)."""
+
+    def __init__(self, name, slots):
+        self.name = name
+        size = slots * SLOT_DTYPE.itemsize
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self.shm = shared_memory.SharedMemory(name=name)
+        # Workers come and go; the segment must outlive whichever one created it
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+        slots = min(slots, self.shm.size // SLOT_DTYPE.itemsize)
+        self.table = np.ndarray((slots,), dtype=SLOT_DTYPE, buffer=self.shm.buf)
+        self._write_lock = threading.Lock()
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), 'a') if fcntl else None
+
+    def close(self, unlink=False):
+        """Detach from the segment; `unlink` also removes it from the host."""
+        del self.table
+        self.shm.close()
+        if unlink:
+            resource_tracker.register(self.shm._name, 'shared_memory')  # unlink() unregisters it
+            self.shm.unlink()
+        if self._lock_file:
+            self._lock_file.close()
+
+    def has_slot(self, bus_id):
+        return 0 < bus_id < len(self.table)
+
+    @property
+    def generation(self):
+        return int(self.table['generation'][0])
+
+    def trusted(self, slots):
+        """Mask of the slots holding their own bus in the current generation."""
+        slots = np.asarray(slots, dtype=np.int64)
+        return ((slots > 0) & (self.table['bus_id'][slots] == slots) &
+                (self.table['generation'][slots] == self.generation))
+
+    @contextlib.contextmanager
+    def _locked(self, slot=None):
+        """Exclusive write access to one slot, or to the whole table when `slot` is None."""
+        with self._write_lock:
+            if self._lock_file is None:
+                yield
+                return
+            start, length = (0, 0) if slot is None else (slot, 1)
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_UN, length, start)
+
+    # -------------------------
+    # Generations
+    # -------------------------
+    def validate(self):
+        """
+        Check the trusted slots against LiveLocation. A slot whose row is gone,
+        belongs to another bus or is older than a flushed slot means the DB is
+        not the one the segment was filled from: start a new generation.
+        Slots behind a newer direct save are just made cold. Returns False
+        when a new generation was started.
+        """
+        with self._locked():
+            if self.generation == 0:
+                self.table['generation'][0] = 1  # new segment
+                return True
+            slots = np.flatnonzero(self.trusted(np.arange(len(self.table))))
+            if not slots.size:
+                return True
+            rows = {
+                live_id: (bus_id, _to_ts(ts))
+                for live_id, bus_id, ts in LiveLocation.objects.values_list('id', 'bus_id', 'timestamp')
+            }
+            stale = []
+            for slot in slots.tolist():
+                record = self.table[slot]
+                row = rows.get(int(record['live_id']))
+                if row is None or row[0] != slot or (not record['dirty'] and record['timestamp'] > row[1]):
+                    self._new_generation()
+                    return False
+                if record['timestamp'] < row[1]:
+                    stale.append(slot)
+            self.table['generation'][stale] = 0
+            return True
+
+    def reset(self):
+        """Make every slot cold (e.g. after restoring the DB)."""
+        with self._locked():
+            self._new_generation()
+
+    def _new_generation(self):
+        self.table['dirty'] = 0
+        self.table['generation'][0] = self.generation % np.iinfo(np.uint32).max + 1
+
+    # -------------------------
+    # Reads
+    # -------------------------
+    def _read_slot(self, slot):
+        row = self.table[slot]
+        for _ in range(READ_RETRIES):
+            before = int(row['seq'])
+            if before % 2 == 0:
+                record = row.copy()
+                if int(row['seq']) == before:
+                    return record
+        return None
+
+    def read(self, bus_id):
+        """LiveLocation for a bus built from its slot, or None if the slot is empty."""
+        if not self.has_slot(bus_id):
+            return None
+        record = self._read_slot(bus_id)
+        if record is None or int(record['bus_id']) != bus_id or int(record['generation']) != self.generation:
+            return None
+        return self._to_model(record)
+
+    def _to_model(self, record):
+        live = LiveLocation(
+            id=int(record['live_id']),
+            bus_id=int(record['bus_id']),
+            latitude=float(record['lat']),
+            longitude=float(record['lng']),
+            current_stop_index=int(record['stop_index']),
+            is_moving_forward=bool(record['forward']),
+            speed=int(record['speed']),
+            crowding=CROWDING_LEVELS[int(record['crowding'])],
+            timestamp=_from_ts(float(record['timestamp'])),
+            last_moved_at=_from_ts(float(record['last_moved_at'])),
+            stop_arrival_time=_from_ts(float(record['stop_arrival_time'])),
+        )
+        # Behaves like a row loaded from the DB (save() updates, not inserts)
+        live._state.adding = False
+        live._state.db = 'default'
+        return live
+
+    # -------------------------
+    # Writes
+    # -------------------------
+    def write(self, live, dirty=True):
+        """Copy a LiveLocation into its slot. Returns False if the bus has no slot."""
+        if not self.has_slot(live.bus_id):
+            return False
+        row = self.table[live.bus_id]
+        with self._locked(live.bus_id):
+            row['seq'] += 1
+            row['generation'] = self.generation
+            row['bus_id'] = live.bus_id
+            row['live_id'] = live.pk or 0
+            row['lat'] = live.latitude
+            row['lng'] = live.longitude
+            row['stop_index'] = live.current_stop_index
+            row['forward'] = live.is_moving_forward
+            row['speed'] = live.speed
+            row['crowding'] = CROWDING_LEVELS.index(live.crowding) if live.crowding in CROWDING_LEVELS else 1
+            row['timestamp'] = _to_ts(live.timestamp)
+            row['last_moved_at'] = _to_ts(live.last_moved_at)
+            row['stop_arrival_time'] = _to_ts(live.stop_arrival_time)
+            row['seq'] += 1
+            if dirty:
+                row['dirty'] = 1
+        return True
+
+    def write_columns(self, bus_ids, **columns):
+        """
+        Vectorized write of whole columns for many buses (already persisted,
+        so the rows are not marked dirty). Keys are SLOT_DTYPE field names.
+        """
+        bus_ids = np.asarray(bus_ids, dtype=np.int64)
+        keep = (bus_ids > 0) & (bus_ids < len(self.table))
+        slots = bus_ids[keep]
+        with self._locked():
+            self.table['seq'][slots] += 1
+            self.table['generation'][slots] = self.generation
+            self.table['bus_id'][slots] = slots
+            for field, values in columns.items():
+                self.table[field][slots] = np.asarray(values)[keep]
+            self.table['seq'][slots] += 1
+
+    def clear(self, bus_id):
+        if self.has_slot(bus_id):
+            row = self.table[bus_id]
+            with self._locked(bus_id):
+                row['seq'] += 1
+                # Keeps the generation and stamps the time, so readers scanning
+                # for changed slots see that the bus was removed
+                row['generation'] = self.generation
+                row['bus_id'] = 0
+                row['dirty'] = 0
+                row['timestamp'] = time.time()
+                row['seq'] += 1
+
+    # -------------------------
+    # Write-behind
+    # -------------------------
+    def flush(self):
+        """
+        Write every dirty slot to LiveLocation in one batch. Returns rows written.
+        A row saved directly since the slot was written (admin, UpdateLocationView)
+        is newer and left alone. When the write fails the slots are marked
+        dirty again for the next flush and the DatabaseError is raised.
+        """
+        slots = np.flatnonzero(self.table['dirty'] & (self.table['generation'] == self.generation))
+        if not slots.size:
+            return 0
+        # Clear first: a write landing after this point re-marks the slot
+        self.table['dirty'][slots] = 0
+
+        to_db = connection.ops.adapt_datetimefield_value
+        rows, written = [], []
+        for slot in slots.tolist():
+            record = self._read_slot(slot)
+            if record is None:
+                self.table['dirty'][slot] = 1
+                continue
+            if not record['live_id']:
+                continue
+            timestamp = to_db(_from_ts(float(record['timestamp'])))
+            rows.append((
+                float(record['lat']), float(record['lng']), int(record['stop_index']),
+                bool(record['forward']), int(record['speed']),
+                CROWDING_LEVELS[int(record['crowding'])],
+                timestamp,
+                to_db(_from_ts(float(record['last_moved_at']))),
+                to_db(_from_ts(float(record['stop_arrival_time']))),
+                int(record['live_id']),
+                timestamp,
+            ))
+            written.append(slot)
+
+        if rows:
+            try:
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        cursor.executemany(update_sql(FLUSH_FIELDS, unless_newer=True), rows)
+            except DatabaseError:
+                self.table['dirty'][written] = 1
+                raise
+        return len(rows)
+
+
+def update_sql(fields, unless_newer=False):
+    """
+    Parameterised `UPDATE LiveLocation SET <fields> WHERE id = %s` for executemany.
+    With `unless_newer` a trailing timestamp parameter skips rows saved after it.
+    """
+    opts = LiveLocation._meta
+    qn = connection.ops.quote_name
+    columns = ", ".join(f"{qn(opts.get_field(f).column)} = %s" for f in fields)
+    sql = f"UPDATE {qn(opts.db_table)} SET {columns} WHERE {qn(opts.pk.column)} = %s"
+    if unless_newer:
+        timestamp = qn(opts.get_field('timestamp').column)
+        sql += f" AND ({timestamp} IS NULL OR {timestamp} <= %s)"
+    return sql
+
+
+# =========================
+# PROCESS-WIDE ACCESS
+# =========================
+_state = None
+_state_lock = threading.Lock()
+_flusher = None
+
+
+def get_fleet_state():
+    """The shared fleet table for this DB, or None when FLEET_STATE_ENABLED is off."""
+    global _state
+    if not getattr(settings, 'FLEET_STATE_ENABLED', False):
+        return None
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                # One segment per database; validate() catches one that outlived its data
+                db_key = hashlib.sha1(str(connection.settings_dict['NAME']).encode()).hexdigest()[:12]
+                state = FleetState(f"citybus_fleet_v{LAYOUT_VERSION}_{db_key}", settings.FLEET_STATE_SLOTS)
+                state.validate()
+                _state = state
+    return _state
+
+
+def load_live_location(bus_id):
+    """Current LiveLocation for a bus: shared memory first, DB on a cold slot."""
+    state = get_fleet_state()
+    if state:
+        live = state.read(bus_id)
+        if live is not None:
+            return live
+
+    live = LiveLocation.objects.filter(bus_id=bus_id).first()
+    if live and state:
+        state.write(live, dirty=False)
+    return live
+
+
+def load_live_locations(bus_ids):
+    """{bus_id: LiveLocation} for many buses; cold slots are warmed with one query."""
+    state = get_fleet_state()
+    found = {}
+    missing = []
+    for bus_id in bus_ids:
+        live = state.read(bus_id) if state else None
+        if live is None:
+            missing.append(bus_id)
+        else:
+            found[bus_id] = live
+
+    if missing:
+        for live in LiveLocation.objects.filter(bus_id__in=missing):
+            found[live.bus_id] = live
+            if state:
+                state.write(live, dirty=False)
+    return found
+
+
+def save_live_location(live):
+    """
+    Persist a changed LiveLocation. With the fleet state on this only touches
+    shared memory; the flusher writes it to the DB shortly after.
+    """
+    live.timestamp = timezone.now()
+    state = get_fleet_state()
+    if state and live.pk and state.write(live, dirty=True):
+        _ensure_flusher()
+        record_positions([live])
+        return
+    live.save()  # recorded by the post_save signal
+
+
+# =========================
+# FLUSHER
+# =========================
+class _Flusher(threading.Thread):
+    """
+    Background thread started in every process that writes to the table.
+    Only the process holding the host-wide flock actually flushes; the others
+    keep retrying so a new owner takes over if that process exits.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='fleet-state-flusher', daemon=True)
+        self.interval = interval
+        self.owner = False
+        self._lock_file = None
+
+    def acquire(self):
+        if self.owner:
+            return True
+        if fcntl is None:
+            self.owner = True
+            return True
+        path = os.path.join(tempfile.gettempdir(), f"{get_fleet_state().name}.flush.lock")
+        lock_file = open(path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.owner = True
+        return True
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self.acquire():
+                    flush_fleet_state()
+            except Exception:
+                # Keep the flock and retry: the slots are still dirty
+                logger.exception("Fleet state flush failed; retrying in %.1f s", self.interval)
+
+
+def flush_fleet_state():
+    """Write dirty slots to the DB now. Safe to call from any thread."""
+    state = get_fleet_state()
+    if not state:
+        return 0
+    close_old_connections()
+    try:
+        return state.flush()
+    finally:
+        close_old_connections()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _state_lock:
+            if _flusher is None:
+                _flusher = _Flusher(getattr(settings, 'FLEET_STATE_FLUSH_INTERVAL', 2.0))
+                _flusher.start()
+                atexit.register(_flush_on_exit)
+
+
+def _flush_on_exit():
+    if _flusher is not None and _flusher.owner:
+        flush_fleet_state()
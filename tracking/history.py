@@ -0,0 +1,324 @@
+"""
+Append-only history of bus positions, one table per UTC day.
+
+LiveLocation keeps only the latest position per bus; every accepted update
+is also appended here for analytics and replay. Rows are buffered per
+process and written with one executemany per day table once
+LOCATION_HISTORY_BATCH_SIZE rows are waiting or LOCATION_HISTORY_FLUSH_INTERVAL
+seconds have passed. Day tables (tracking_locationhistory_YYYYMMDD) are
+created on first write and dropped whole once older than
+LOCATION_HISTORY_RETENTION_DAYS, so retention never deletes rows one by one.
+Closed days can be compacted into the columnar archive (tracking.archive)
+first; position_history reads both.
+"""
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+
+from buses.models import Bus
+from . import archive
+
+logger = logging.getLogger(__name__)
+
+TABLE_PREFIX = "tracking_locationhistory_"
+# A day table is renamed to this while it is archived, so late rows start a fresh one
+STAGING_PREFIX = "tracking_locationhistory_staging_"
+COLUMNS = ("bus_id", "recorded_at", "latitude", "longitude", "speed", "route_id")
+# Rows kept for a retry while the DB refuses writes, in batches; the oldest go first
+MAX_PENDING_BATCHES = 20
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def table_for_day(day):
+    return f"{TABLE_PREFIX}{day:%Y%m%d}"
+
+
+def _day(ts):
+    return datetime.fromtimestamp(ts, tz=dt_timezone.utc).date()
+
+
+# =========================
+# PARTITIONS
+# =========================
+_retention_checked = set()  # days this process already ran retention for
+
+
+def history_tables(prefix=TABLE_PREFIX):
+    """{day: table name} of the existing day tables (or staging tables)."""
+    return {
+        datetime.strptime(name[len(prefix):], "%Y%m%d").date(): name
+        for name in connection.introspection.table_names()
+        if name.startswith(prefix) and name[len(prefix):].isdigit()
+    }
+
+
+def _ensure_table(day):
+    # IF NOT EXISTS is cheap and once per batch; other processes may create the table too
+    name = table_for_day(day)
+    qn = connection.ops.quote_name
+    types = connection.data_types
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {qn(name)} ("
+            f"{qn('bus_id')} {types['BigIntegerField']} NOT NULL, "
+            f"{qn('recorded_at')} {types['FloatField']} NOT NULL, "
+            f"{qn('latitude')} {types['FloatField']} NOT NULL, "
+            f"{qn('longitude')} {types['FloatField']} NOT NULL, "
+            f"{qn('speed')} {types['IntegerField']} NOT NULL, "
+            f"{qn('route_id')} {types['BigIntegerField']} NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {qn(name + '_bus_time')} "
+            f"ON {qn(name)} ({qn('bus_id')}, {qn('recorded_at')})"
+        )
+    if day not in _retention_checked:
+        # A new day is the natural moment to retire old ones
+        _retention_checked.add(day)
+        with connection.cursor() as cursor:
+            columns = {c.name for c in connection.introspection.get_table_description(cursor, name)}
+            if 'route_id' not in columns:  # created before routes were recorded
+                cursor.execute(f"ALTER TABLE {qn(name)} ADD COLUMN {qn('route_id')} {types['BigIntegerField']} NULL")
+        drop_expired_partitions(today=day)
+    return name
+
+
+def drop_expired_partitions(today=None, retention_days=None):
+    """DROP every day table older than the retention window. Returns the days dropped."""
+    if retention_days is None:
+        retention_days = _setting('LOCATION_HISTORY_RETENTION_DAYS', 30)
+    cutoff = (today or datetime.now(dt_timezone.utc).date()) - timedelta(days=retention_days)
+    dropped = []
+    with connection.cursor() as cursor:
+        for day, name in sorted(history_tables().items()):
+            if day < cutoff:
+                cursor.execute(f"DROP TABLE IF EXISTS {connection.ops.quote_name(name)}")
+                dropped.append(day)
+    return dropped
+
+
+def compact_closed_days(today=None):
+    """
+    Move every day table before `today` (UTC) into the columnar archive and
+    drop it. Returns {day: rows archived for the day}.
+
+    Each table is first renamed to a staging name: rows other workers insert
+    afterwards go to a fresh day table (archived on the next run) instead of
+    being dropped with the staging table.
+    """
+    today = today or datetime.now(dt_timezone.utc).date()
+    qn = connection.ops.quote_name
+    compacted = {}
+    # Left behind by an interrupted run
+    for day, staging in sorted(history_tables(STAGING_PREFIX).items()):
+        compacted[day] = _archive_table(day, staging)
+    for day, name in sorted(history_tables().items()):
+        if day >= today:
+            continue
+        staging = f"{STAGING_PREFIX}{day:%Y%m%d}"
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {qn(name)} RENAME TO {qn(staging)}")
+            # Index names are global: free it for the fresh day table
+            cursor.execute(f"DROP INDEX IF EXISTS {qn(name + '_bus_time')}")
+        compacted[day] = _archive_table(day, staging)
+    return compacted
+
+
+def _archive_table(day, name):
+    qn = connection.ops.quote_name
+    parts = []
+    with connection.cursor() as cursor:
+        columns = ", ".join(f"COALESCE({qn(c)}, 0)" for c in COLUMNS)
+        cursor.execute(f"SELECT {columns} FROM {qn(name)}")
+        while rows := cursor.fetchmany(100_000):
+            parts.append(np.array(rows, dtype=np.float64).reshape(-1, len(COLUMNS)))
+    table = np.concatenate(parts) if parts else np.empty((0, len(COLUMNS)))
+    archived = archive.write_day(day, {
+        "bus_id": table[:, 0], "time": table[:, 1], "lat": table[:, 2],
+        "lng": table[:, 3], "speed": table[:, 4], "route_id": table[:, 5],
+    })
+    # Only dropped once the archive is in place
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {qn(name)}")
+    return archived
+
+
+# =========================
+# WRITES
+# =========================
+class HistoryBuffer:
+    """
+    Rows waiting to be appended, flushed in batches by append() or, for a
+    quiet process, by a background thread once the flush interval passed.
+    A failed flush keeps its rows for the next one and never raises.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def append(self, rows):
+        with self._lock:
+            self.rows.extend(rows)
+            due = (len(self.rows) >= _setting('LOCATION_HISTORY_BATCH_SIZE', 500) or
+                   time.monotonic() - self.last_flush >= _setting('LOCATION_HISTORY_FLUSH_INTERVAL', 5.0))
+        _ensure_flusher()
+        if due:
+            self.flush()
+
+    def due(self):
+        with self._lock:
+            return bool(self.rows) and (
+                time.monotonic() - self.last_flush >= _setting('LOCATION_HISTORY_FLUSH_INTERVAL', 5.0)
+            )
+
+    def flush(self):
+        """Write the waiting rows. Returns the number written (0 on a DB error)."""
+        with self._lock:
+            rows, self.rows = self.rows, []
+            self.last_flush = time.monotonic()
+        if not rows:
+            return 0
+        try:
+            self._insert(rows)
+        except DatabaseError:
+            with self._lock:
+                pending = rows + self.rows
+                limit = MAX_PENDING_BATCHES * _setting('LOCATION_HISTORY_BATCH_SIZE', 500)
+                self.rows = pending[-limit:]
+            logger.exception("Location history flush failed; %d rows kept for a retry, %d dropped",
+                             len(self.rows), len(pending) - len(self.rows))
+            return 0
+        return len(rows)
+
+    def _insert(self, rows):
+        # Routes are resolved when the batch is written, seconds after recording,
+        # so history keeps the route a bus served even after it is reassigned
+        bus_ids = list({row[0] for row in rows})
+        routes = {}
+        for i in range(0, len(bus_ids), 500):
+            routes.update(Bus.objects.filter(id__in=bus_ids[i:i + 500]).values_list('id', 'route_id'))
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(_day(row[1]), []).append((*row, routes.get(row[0])))
+
+        qn = connection.ops.quote_name
+        columns = ", ".join(qn(c) for c in COLUMNS)
+        placeholders = ", ".join(["%s"] * len(COLUMNS))
+        with transaction.atomic():
+            for day, day_rows in sorted(by_day.items()):
+                table = _ensure_table(day)
+                with connection.cursor() as cursor:
+                    cursor.executemany(
+                        f"INSERT INTO {qn(table)} ({columns}) VALUES ({placeholders})", day_rows
+                    )
+
+
+_buffer = HistoryBuffer()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+class _Flusher(threading.Thread):
+    """Flushes the buffer of a process that stopped recording before a batch filled up."""
+
+    def __init__(self, interval):
+        super().__init__(name='location-history-flusher', daemon=True)
+        self.interval = interval
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            if _buffer.due():
+                close_old_connections()
+                try:
+                    _buffer.flush()
+                finally:
+                    close_old_connections()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is None:
+        with _flusher_lock:
+            if _flusher is None:
+                _flusher = _Flusher(_setting('LOCATION_HISTORY_FLUSH_INTERVAL', 5.0))
+                _flusher.start()
+
+
+@atexit.register
+def _flush_on_exit():
+    _buffer.flush()
+
+
+def record_rows(rows):
+    """Append (bus_id, epoch seconds, latitude, longitude, speed) rows."""
+    if _setting('LOCATION_HISTORY_ENABLED', True):
+        _buffer.append(list(rows))
+
+
+def record_positions(lives):
+    """Append the current position of each LiveLocation to the history."""
+    now = time.time()
+    record_rows(
+        (live.bus_id, live.timestamp.timestamp() if live.timestamp else now,
+         live.latitude, live.longitude, live.speed or 0)
+        for live in lives
+    )
+
+
+def flush_location_history():
+    """Write buffered rows now. Returns the number written."""
+    return _buffer.flush()
+
+
+# =========================
+# READS
+# =========================
+def position_history(bus_id, start, end):
+    """
+    [(recorded_at, latitude, longitude, speed)] of a bus with start <= time < end
+    (aware datetimes), oldest first. Only the day tables and archived days
+    overlapping the range are read.
+    """
+    tables = history_tables()
+    qn = connection.ops.quote_name
+    start_ts, end_ts = start.timestamp(), end.timestamp()
+    rows = []
+    day = _day(start_ts)
+    with connection.cursor() as cursor:
+        while day <= _day(end_ts):
+            archived = archive.load_day(day)
+            if archived is not None:
+                part = archived.select(start_ts, end_ts, [bus_id])
+                rows.extend(
+                    (datetime.fromtimestamp(ts, tz=dt_timezone.utc), lat, lng, speed)
+                    for ts, lat, lng, speed in zip(
+                        part["time"].tolist(), part["lat"].tolist(), part["lng"].tolist(), part["speed"].tolist()
+                    )
+                )
+            if day in tables:
+                cursor.execute(
+                    f"SELECT {qn('recorded_at')}, {qn('latitude')}, {qn('longitude')}, {qn('speed')} "
+                    f"FROM {qn(tables[day])} WHERE {qn('bus_id')} = %s "
+                    f"AND {qn('recorded_at')} >= %s AND {qn('recorded_at')} < %s "
+                    f"ORDER BY {qn('recorded_at')}",
+                    [bus_id, start_ts, end_ts],
+                )
+                rows.extend(
+                    (datetime.fromtimestamp(ts, tz=dt_timezone.utc), lat, lng, speed)
+                    for ts, lat, lng, speed in cursor.fetchall()
+                )
+            day += timedelta(days=1)
+    # Late rows of an archived day sit in a new day table until compacted again
+    rows.sort(key=lambda row: row[0])
+    return rows
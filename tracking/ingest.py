@@ -0,0 +1,79 @@
+from django.db import transaction
+from django.utils import timezone
+
+from buses.models import Bus
+from .fleet_state import FLUSH_FIELDS, get_fleet_state, load_live_locations
+from .history import record_positions
+from .models import LiveLocation
+from .serializers import LocationPingSerializer
+
+OPTIONAL_FIELDS = ['current_stop_index', 'is_moving_forward', 'speed', 'crowding']
+
+
+def ingest_positions(items):
+    """
+    Validate and upsert a batch of device pings.
+
+    One query resolves every bus, one loads the existing LiveLocation rows,
+    and all writes happen in a single transaction. When a bus appears more
+    than once the last ping wins.
+
+    Returns {"accepted", "created", "updated", "errors"} where errors is a
+    list of {"index", "errors"} for the rejected items.
+    """
+    errors = []
+    pings = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors.append({"index": index, "errors": {"non_field_errors": ["Expected a JSON object."]}})
+            continue
+        serializer = LocationPingSerializer(data=item)
+        if serializer.is_valid():
+            pings[serializer.validated_data['bus']] = (index, serializer.validated_data)
+        else:
+            errors.append({"index": index, "errors": serializer.errors})
+
+    known = set(Bus.objects.filter(id__in=pings.keys()).values_list('id', flat=True))
+    for bus_id in [b for b in pings if b not in known]:
+        index, _ = pings.pop(bus_id)
+        errors.append({"index": index, "errors": {"bus": [f"Bus {bus_id} does not exist."]}})
+
+    now = timezone.now()
+    to_create, to_update = [], []
+    with transaction.atomic():
+        # Shared fleet state first, so a ping never rolls back newer simulator fields
+        existing = load_live_locations(list(pings.keys()))
+        for bus_id, (_, data) in pings.items():
+            live = existing.get(bus_id)
+            if live is None:
+                live = LiveLocation(bus_id=bus_id)
+                to_create.append(live)
+            else:
+                to_update.append(live)
+
+            live.latitude = data['latitude']
+            live.longitude = data['longitude']
+            for field in OPTIONAL_FIELDS:
+                if field in data:
+                    setattr(live, field, data[field])
+            live.timestamp = now
+
+        if to_create:
+            LiveLocation.objects.bulk_create(to_create)
+        if to_update:
+            LiveLocation.objects.bulk_update(to_update, FLUSH_FIELDS)
+
+    state = get_fleet_state()
+    if state:
+        for live in to_create + to_update:
+            state.write(live, dirty=False)
+    # Bulk writes send no post_save
+    record_positions(to_create + to_update)
+
+    errors.sort(key=lambda e: e["index"])
+    return {
+        "accepted": len(pings),
+        "created": len(to_create),
+        "updated": len(to_update),
+        "errors": errors,
+    }
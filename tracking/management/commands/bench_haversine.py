@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from tracking.utils import haversine, haversine_pairwise, segment_distances
+
+
+class Command(BaseCommand):
+    help = "Benchmark scalar haversine against the NumPy batch versions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", nargs="+", type=int, default=[10, 1000, 100000],
+            help="Number of points per run"
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(42)
+        repeat = options["repeat"]
+
+        self.stdout.write(f"{'points':>8} {'scalar ms':>12} {'pairwise ms':>12} {'segments ms':>12} {'speedup':>9}")
+        for n in options["sizes"]:
+            # Points scattered around Odisha
+            lats = rng.uniform(19.0, 21.5, n)
+            lngs = rng.uniform(84.5, 86.5, n)
+            lat_list, lng_list = lats.tolist(), lngs.tolist()
+
+            scalar = self._best(repeat, lambda: [
+                haversine(lat_list[i], lng_list[i], lat_list[i + 1], lng_list[i + 1])
+                for i in range(n - 1)
+            ])
+            pairwise = self._best(repeat, lambda: haversine_pairwise(lats[:-1], lngs[:-1], lats[1:], lngs[1:]))
+            segments = self._best(repeat, lambda: segment_distances(lats, lngs))
+
+            self.stdout.write(
+                f"{n:>8} {scalar * 1000:>12.3f} {pairwise * 1000:>12.3f} "
+                f"{segments * 1000:>12.3f} {scalar / pairwise:>8.1f}x"
+            )
+
+    @staticmethod
+    def _best(repeat, fn):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best
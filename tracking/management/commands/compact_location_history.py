@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tracking.history import compact_closed_days, flush_location_history
+
+
+class Command(BaseCommand):
+    help = f"Move closed location history days into the columnar archive ({settings.LOCATION_ARCHIVE_DIR})"
+
+    def handle(self, *args, **options):
+        flush_location_history()
+        compacted = compact_closed_days()
+        for day, rows in compacted.items():
+            self.stdout.write(f"Archived {day}: {rows} rows")
+        self.stdout.write(f"{len(compacted)} day(s) compacted")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from tracking.fleet_state import flush_fleet_state, get_fleet_state
+
+
+class Command(BaseCommand):
+    help = "Write pending shared-memory fleet positions to LiveLocation now"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true",
+            help="Empty the shared table after flushing (e.g. after restoring the DB)"
+        )
+
+    def handle(self, *args, **options):
+        if not get_fleet_state():
+            self.stdout.write("Fleet state is disabled (FLEET_STATE_ENABLED=False)")
+            return
+        self.stdout.write(f"Flushed {flush_fleet_state()} live locations")
+        if options["reset"]:
+            get_fleet_state().reset()
+            self.stdout.write("Shared fleet table cleared")
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tracking.history import drop_expired_partitions, history_tables
+
+
+class Command(BaseCommand):
+    help = "Drop location history day tables older than the retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=None,
+            help=f"Days to keep (default LOCATION_HISTORY_RETENTION_DAYS={settings.LOCATION_HISTORY_RETENTION_DAYS})"
+        )
+
+    def handle(self, *args, **options):
+        dropped = drop_expired_partitions(retention_days=options["days"])
+        for day in dropped:
+            self.stdout.write(f"Dropped {day}")
+        self.stdout.write(f"{len(dropped)} day(s) dropped, {len(history_tables())} kept")
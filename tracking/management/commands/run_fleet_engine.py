@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tracking.engine import FleetTickEngine
+
+
+class Command(BaseCommand):
+    help = "Advance every active bus in-process on a fixed interval (replaces per-bus move-bus calls)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=2.0, help="Seconds between ticks")
+        parser.add_argument("--ticks", type=int, default=0, help="Stop after N ticks (0 = run forever)")
+        parser.add_argument(
+            "--reload-every", type=int, default=30,
+            help="Reload buses and routes every N ticks to pick up admin changes"
+        )
+
+    def handle(self, *args, **options):
+        interval = options["interval"]
+        engine = FleetTickEngine(interval=interval)
+        count = engine.load()
+        self.stdout.write(f"Loaded {count} active buses")
+
+        tick = 0
+        try:
+            while not options["ticks"] or tick < options["ticks"]:
+                started = time.monotonic()
+                if tick and options["reload_every"] and tick % options["reload_every"] == 0:
+                    engine.load()
+
+                moved = engine.step()
+                tick += 1
+                elapsed = time.monotonic() - started
+                self.stdout.write(f"Tick {tick}: {moved} buses moved in {elapsed * 1000:.1f} ms")
+
+                time.sleep(max(0.0, interval - elapsed))
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
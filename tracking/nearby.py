@@ -0,0 +1,236 @@
+"""
+"Near me" and map viewport queries: stops from the planner network's spatial
+grid, live buses from a per-process grid of LiveLocation positions.
+
+The bus grid is kept current incrementally: each query first moves only the
+buses whose shared fleet slot (or LiveLocation row, with the fleet state
+off) changed since the previous sync, so a query never rescans every bus.
+Every move or removal is stamped with a version (epoch milliseconds) and
+logged in version order, so a map asking for what changed since its last
+refresh only visits the buses that changed after it.
+"""
+import math
+import threading
+from bisect import bisect_right, insort
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+
+from .fleet_state import get_fleet_state
+from .models import LiveLocation
+from .utils import KM_PER_DEGREE_LAT, GridIndex, bearing
+
+DEFAULT_RADIUS_M = 500
+MAX_RADIUS_M = 5000
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Bus grid cells: about one query radius
+BUS_CELL_KM = 0.5
+# How far outside a viewport a changed bus is still reported as having left it
+# (a bus covers ~0.5 km in a minute between map refreshes)
+LEFT_MARGIN_KM = 0.5
+
+
+def parse_nearby_query(params):
+    """(lat, lng, radius_km, limit) from ?lat=&lng=&radius=<m>&limit=; raises ValueError."""
+    try:
+        lat = float(params['lat'])
+        lng = float(params['lng'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Please provide numeric 'lat' and 'lng'")
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("'lat'/'lng' out of range")
+    try:
+        radius = float(params.get('radius', DEFAULT_RADIUS_M))
+        limit = int(params.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ValueError("'radius' (meters) and 'limit' must be numbers")
+    if not (0 < radius <= MAX_RADIUS_M) or math.isnan(radius):
+        raise ValueError(f"radius must be 1-{MAX_RADIUS_M} meters")
+    if not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be 1-{MAX_LIMIT}")
+    return lat, lng, radius / 1000, limit
+
+
+def parse_bbox(value):
+    """(min_lat, min_lng, max_lat, max_lng) from 'minLng,minLat,maxLng,maxLat'; raises ValueError."""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in value.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError("bbox must be 'minLng,minLat,maxLng,maxLat'")
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= max_lng <= 180):
+        raise ValueError("bbox corners out of range or out of order")
+    return min_lat, min_lng, max_lat, max_lng
+
+
+class LivePositionIndex:
+    """
+    GridIndex of bus_id -> last known position, synced incrementally, plus
+      heading[bus_id]  -> bearing of the last move (None until it moved)
+      version[bus_id]  -> epoch ms of the last move or removal
+      log              -> sorted (version, bus_id); entries a bus has since
+                          outgrown are skipped and compacted away
+    """
+
+    def __init__(self, cell_km=BUS_CELL_KM):
+        self.cell_km = cell_km
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.grid = GridIndex(self.cell_km)
+        self.heading = {}
+        self.version = {}
+        self.log = []
+        self.synced = None  # newest position timestamp applied (epoch seconds)
+        self.generation = None  # fleet state generation the grid was synced from
+
+    def __len__(self):
+        return len(self.grid)
+
+    def _move(self, bus_id, lat, lng, ts):
+        old = self.grid.position(bus_id)
+        if old is not None and old != (lat, lng):
+            self.heading[bus_id] = round(bearing(old[0], old[1], lat, lng))
+        self.grid.insert(bus_id, lat, lng)
+        self._stamp(bus_id, int(ts * 1000))
+
+    def _drop(self, bus_id):
+        if self.grid.position(bus_id) is not None:
+            self.grid.remove(bus_id)
+            self.heading.pop(bus_id, None)
+            self._stamp(bus_id, int(time.time() * 1000))
+
+    def _stamp(self, bus_id, version):
+        if self.version.get(bus_id) == version:
+            return  # already logged at this version
+        self.version[bus_id] = version
+        insort(self.log, (version, bus_id))
+        if len(self.log) > 2 * len(self.version) + 1024:
+            self.log = sorted((v, b) for b, v in self.version.items())
+
+    def _sync(self):
+        state = get_fleet_state()
+        if state and self.synced is not None and state.generation != self.generation:
+            # Every slot went cold (another DB attached): start over from the rows
+            self._reset()
+        if self.synced is None:
+            self._load_all(state)
+        elif state:
+            self._sync_fleet_state(state)
+        else:
+            self._sync_db()
+
+    def _load_all(self, state):
+        self.synced = 0.0
+        self.generation = state.generation if state else None
+        for bus_id, lat, lng, ts in LiveLocation.objects.values_list('bus_id', 'latitude', 'longitude', 'timestamp'):
+            ts = ts.timestamp() if ts else 0.0
+            self._move(bus_id, lat, lng, ts)
+            self.synced = max(self.synced, ts)
+        if state:
+            # Newer positions may only be in shared memory so far
+            self._sync_fleet_state(state)
+
+    def _sync_fleet_state(self, state):
+        table = state.table
+        # Writers store lat/lng before the timestamp and clear() stamps it too,
+        # so only slots with a newer timestamp can hold a change
+        changed = np.flatnonzero(table['timestamp'] > self.synced)
+        changed = changed[changed > 0]
+        if not changed.size:
+            return
+        stamps = table['timestamp'][changed]
+        self.synced = max(self.synced, float(stamps.max()))
+        # Only slots of the current generation: older ones may hold another DB's buses
+        current = table['generation'][changed] == state.generation
+        live = state.trusted(changed)
+        moved = changed[live]
+        for bus_id, lat, lng, ts in zip(moved.tolist(), table['lat'][moved].tolist(),
+                                        table['lng'][moved].tolist(), stamps[live].tolist()):
+            self._move(bus_id, lat, lng, ts)
+        # Cleared slots (LiveLocation deleted) keep the generation, while a cold
+        # slot (never written, or from an older generation) says nothing
+        for bus_id in changed[current & ~live].tolist():
+            self._drop(bus_id)
+
+    def _sync_db(self):
+        since = datetime.fromtimestamp(self.synced, tz=dt_timezone.utc)
+        rows = LiveLocation.objects.filter(timestamp__gt=since).values_list(
+            'bus_id', 'latitude', 'longitude', 'timestamp'
+        )
+        for bus_id, lat, lng, ts in rows:
+            self._move(bus_id, lat, lng, ts.timestamp())
+            self.synced = max(self.synced, ts.timestamp())
+
+    def nearby(self, lat, lng, radius_km):
+        """[(bus_id, distance_km)] nearest first."""
+        with self._lock:
+            self._sync()
+            return self.grid.nearby(lat, lng, radius_km)
+
+    def position(self, bus_id):
+        with self._lock:
+            return self.grid.position(bus_id)
+
+    def in_box(self, min_lat, min_lng, max_lat, max_lng, since=None):
+        """
+        (moved, left, version): moved is [(bus_id, lat, lng, heading)] inside
+        the box. With `since` (a version) only buses changed after it are
+        listed, and left has the ones that moved just outside the box
+        (within LEFT_MARGIN_KM) or disappeared, for the client to drop.
+        """
+        with self._lock:
+            self._sync()
+            version = self.log[-1][0] if self.log else 0
+            if since is None:
+                moved = [
+                    (bus_id, lat, lng, self.heading.get(bus_id))
+                    for bus_id, lat, lng in self.grid.in_box(min_lat, min_lng, max_lat, max_lng)
+                ]
+                return moved, [], version
+
+            d_lat = LEFT_MARGIN_KM / KM_PER_DEGREE_LAT
+            d_lng = d_lat / max(math.cos(math.radians(min(max(abs(min_lat), abs(max_lat)) + d_lat, 89.9))), 1e-6)
+            moved, left = [], []
+            for v, bus_id in self.log[bisect_right(self.log, (since, math.inf)):]:
+                if self.version[bus_id] != v:
+                    continue  # moved again since; listed at its newer entry
+                position = self.grid.position(bus_id)
+                if position is None:
+                    left.append(bus_id)
+                    continue
+                lat, lng = position
+                if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+                    moved.append((bus_id, lat, lng, self.heading.get(bus_id)))
+                elif min_lat - d_lat <= lat <= max_lat + d_lat and min_lng - d_lng <= lng <= max_lng + d_lng:
+                    left.append(bus_id)
+            return moved, left, version
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_live_position_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = LivePositionIndex()
+    return _index
+
+
+def invalidate_live_position_index():
+    """Reload every position from LiveLocation on the next query."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def forget_bus_position(bus_id):
+    """Drop a bus whose LiveLocation row was deleted in this process."""
+    if _index is not None:
+        with _index._lock:
+            _index._drop(bus_id)
@@ -0,0 +1,37 @@
+import csv
+import json
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline-delimited JSON: one object per line, blank lines ignored.
+    Parsed into a list, the same shape as a JSON array body.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        items = []
+        for line_no, line in enumerate(stream.read().decode('utf-8').splitlines(), start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as exc:
+                raise ParseError(f"NDJSON parse error on line {line_no}: {exc}")
+        return items
+
+
+class CSVParser(BaseParser):
+    """CSV rows (lists of strings), blank lines ignored."""
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            text = stream.read().decode('utf-8-sig')
+        except UnicodeDecodeError as exc:
+            raise ParseError(f"CSV parse error: {exc}")
+        return [row for row in csv.reader(text.splitlines()) if row]
@@ -16,3 +16,21 @@ class LiveLocationSerializer(serializers.ModelSerializer):
              # A better check might be needed, but for now:
              return "WAITING"
         return "MOVING"
+
+
+class LocationPingSerializer(serializers.Serializer):
+    """
+    One device ping in a bulk ingest batch.
+    `bus` is a plain id so validating a batch never queries per item;
+    buses are resolved together afterwards.
+    """
+    bus = serializers.IntegerField(min_value=1)
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    current_stop_index = serializers.IntegerField(min_value=0, required=False)
+    is_moving_forward = serializers.BooleanField(required=False)
+    speed = serializers.IntegerField(min_value=0, required=False)
+    crowding = serializers.ChoiceField(
+        choices=[c[0] for c in LiveLocation._meta.get_field('crowding').choices],
+        required=False
+    )
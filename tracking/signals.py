@@ -0,0 +1,29 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .fleet_state import get_fleet_state
+from .history import record_positions
+from .models import LiveLocation
+from .nearby import forget_bus_position
+
+
+# =========================
+# KEEP SHARED FLEET STATE IN SYNC
+# =========================
+# Direct saves (admin, UpdateLocationView, get_or_create) bypass the shared table,
+# so mirror them into it. They are already in the DB, so the slot stays clean.
+@receiver(post_save, sender=LiveLocation)
+def store_live_location(sender, instance, raw=False, **kwargs):
+    state = get_fleet_state()
+    if state:
+        state.write(instance, dirty=False)
+    if not raw:
+        record_positions([instance])
+
+
+@receiver(post_delete, sender=LiveLocation)
+def clear_live_location(sender, instance, **kwargs):
+    state = get_fleet_state()
+    if state:
+        state.clear(instance.bus_id)
+    forget_bus_position(instance.bus_id)
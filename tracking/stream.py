@@ -0,0 +1,147 @@
+"""
+Server-Sent Events feed of live bus positions (served by transport_backend.asgi).
+
+Each connection polls the shared fleet state (or LiveLocation when it is
+disabled) once a second and only sends buses whose timestamp moved. The SSE
+event id is the newest update time in the batch (epoch microseconds, the
+precision of the timestamps, so it round-trips exactly), and a client
+reconnecting with Last-Event-ID gets exactly what changed since then.
+The bus filter is re-applied every RESOLVE_SECONDS, so buses that join or
+leave the route (or go in or out of service) are picked up by open streams.
+"""
+import asyncio
+import json
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from asgiref.sync import sync_to_async
+
+from buses.models import Bus, CITY_PREFIXES
+from routes.geometry import get_route_geometries
+from .eta import build_bus_eta
+from .fleet_state import get_fleet_state, load_live_locations
+from .models import LiveLocation
+
+POLL_SECONDS = 1.0
+HEARTBEAT_SECONDS = 15.0
+RESOLVE_SECONDS = 30.0
+RETRY_MS = 3000
+# Same speed as BusETAView so streamed ETAs match the REST ones
+ETA_BUS_SPEED = 60
+
+
+class StreamFilterError(ValueError):
+    pass
+
+
+def resolve_stream_buses(params):
+    """Buses selected by ?bus=<bus_no>, ?route=<route_id> or ?city=<name> (default: all active)."""
+    buses = Bus.objects.filter(is_active=True, route__isnull=False)
+    if params.get('bus'):
+        buses = buses.filter(bus_number=params['bus'])
+    elif params.get('route'):
+        if not params['route'].isdigit():
+            raise StreamFilterError("route must be a route id")
+        buses = buses.filter(route_id=int(params['route']))
+    elif params.get('city'):
+        prefixes = [p for p, city in CITY_PREFIXES.items() if city.lower() == params['city'].lower()]
+        if not prefixes:
+            raise StreamFilterError(f"Unknown city '{params['city']}'")
+        buses = buses.filter(bus_number__startswith=prefixes[0])
+    return list(buses.order_by('id'))
+
+
+def _changed_since(bus_ids, since, warm=False):
+    """
+    {bus_id: LiveLocation} for buses updated after `since` (epoch seconds).
+    With `warm`, buses that have no shared-memory slot yet are loaded from the DB.
+    """
+    state = get_fleet_state()
+    if state:
+        ids = np.asarray([b for b in bus_ids if state.has_slot(b)], dtype=np.int64)
+        present = ids[state.trusted(ids)]
+        changed = present[state.table['timestamp'][present] > since].tolist()
+        if warm:
+            present_ids = set(present.tolist())
+            changed += [b for b in bus_ids if b not in present_ids]
+        lives = load_live_locations(changed)
+        return {b: l for b, l in lives.items() if l.timestamp and l.timestamp.timestamp() > since}
+
+    return {
+        live.bus_id: live
+        for live in LiveLocation.objects.filter(
+            bus_id__in=bus_ids,
+            timestamp__gt=datetime.fromtimestamp(since, tz=dt_timezone.utc)
+        )
+    }
+
+
+def poll_positions(buses, since, warm=False):
+    """
+    One poll: payloads for every bus that moved after `since`.
+    Returns (payloads, newest_timestamp).
+    """
+    lives = _changed_since([b.id for b in buses], since, warm)
+    if not lives:
+        return [], since
+
+    geometries = get_route_geometries(b.route_id for b in buses if b.id in lives)
+    payloads = []
+    newest = since
+    for bus in buses:
+        live = lives.get(bus.id)
+        if live is None or not len(geometries[bus.route_id]):
+            continue
+        ts = live.timestamp.timestamp()
+        newest = max(newest, ts)
+
+        payload = build_bus_eta(bus, live, geometries[bus.route_id], ETA_BUS_SPEED)
+        payload.update({
+            "route_id": bus.route_id,
+            "latitude": live.latitude,
+            "longitude": live.longitude,
+            "current_stop_index": live.current_stop_index,
+            "timestamp": live.timestamp.isoformat(),
+        })
+        payloads.append(payload)
+    return payloads, newest
+
+
+def _event(payloads, newest):
+    body = json.dumps({"buses": payloads}, separators=(',', ':'))
+    return f"id: {round(newest * 1_000_000)}\nevent: positions\ndata: {body}\n\n"
+
+
+async def position_events(buses, last_event_id=None, params=None):
+    """
+    Async generator of SSE frames for StreamingHttpResponse. `params` are the
+    filters `buses` was resolved from; None keeps `buses` fixed.
+    """
+    # Resume: only what changed after the last event the client saw
+    since = int(last_event_id) / 1_000_000 if last_event_id and last_event_id.isdigit() else 0.0
+    poll = sync_to_async(poll_positions)
+    resolve = sync_to_async(resolve_stream_buses)
+
+    yield f"retry: {RETRY_MS}\n\n"
+    idle = resolved = 0.0
+    warm = True
+    while True:
+        if params is not None and resolved >= RESOLVE_SECONDS:
+            known = {b.id for b in buses}
+            buses = await resolve(params)
+            # Newcomers may not have a shared-memory slot yet
+            warm = any(b.id not in known for b in buses)
+            resolved = 0.0
+        payloads, since_next = await poll(buses, since, warm)
+        warm = False
+        if payloads:
+            yield _event(payloads, since_next)
+            since = since_next
+            idle = 0.0
+        else:
+            idle += POLL_SECONDS
+            if idle >= HEARTBEAT_SECONDS:
+                yield ": heartbeat\n\n"
+                idle = 0.0
+        resolved += POLL_SECONDS
+        await asyncio.sleep(POLL_SECONDS)
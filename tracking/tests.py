@@ -1,3 +1,522 @@
-from django.test import TestCase
+import json
+import tempfile
+import uuid
+from unittest import mock
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from buses.models import Bus
+from routes.geometry import invalidate_route_geometry
+from routes.models import Route
+from stops.models import Stop
+from .archive import route_positions
+from . import stream
+from .engine import FleetTickEngine
+from .fleet_state import FleetState
+from .ingest import ingest_positions
+from .history import HistoryBuffer, compact_closed_days, drop_expired_partitions, history_tables, flush_location_history, position_history, record_rows
+from .models import LiveLocation
+from .nearby import LivePositionIndex, invalidate_live_position_index
+
+
+class NearbyBusesTests(TestCase):
+    def setUp(self):
+        invalidate_live_position_index()
+        route = Route.objects.create(name="Puri Line")
+        self.near = Bus.objects.create(bus_number="201", route=route)
+        self.far = Bus.objects.create(bus_number="202", route=route)
+        self.retired = Bus.objects.create(bus_number="203", route=route, is_active=False)
+        LiveLocation.objects.create(bus=self.near, latitude=19.8100, longitude=85.8300)
+        LiveLocation.objects.create(bus=self.far, latitude=19.8300, longitude=85.8300)
+        LiveLocation.objects.create(bus=self.retired, latitude=19.8101, longitude=85.8300)
+
+    def _nearby(self, **params):
+        response = self.client.get('/api/tracking/nearby/', {'lat': 19.8098, 'lng': 85.8300, **params})
+        return [(bus["bus_number"], bus["distance_m"]) for bus in response.json()]
+
+    def test_active_buses_ranked_by_distance(self):
+        self.assertEqual(self._nearby(radius=500), [("201", 22)])
+        self.assertEqual(self._nearby(radius=3000), [("201", 22), ("202", 2246)])
+
+    def test_moves_are_picked_up_incrementally(self):
+        self._nearby()
+        live = self.far.live_location
+        live.latitude = 19.8099
+        live.save()
+        self.assertEqual([number for number, _ in self._nearby(radius=100)], ["202", "201"])
+
+    def test_bad_query(self):
+        response = self.client.get('/api/tracking/nearby/', {'lat': 19.8, 'lng': 85.8, 'radius': 99999})
+        self.assertEqual(response.status_code, 400)
+
+    def test_viewport_returns_only_moved_buses_since_version(self):
+        bbox = "85.8290,19.8050,85.8310,19.8150"
+        first = self.client.get('/api/tracking/buses/', {'bbox': bbox}).json()
+        self.assertEqual([row[0] for row in first["buses"]], [self.near.id])
+        self.assertEqual(first["fields"], ["id", "lat", "lng", "heading", "route_id"])
+
+        unchanged = self.client.get('/api/tracking/buses/', {'bbox': bbox, 'since': first["version"]}).json()
+        self.assertEqual((unchanged["buses"], unchanged["left"]), ([], []))
+
+        live = self.near.live_location
+        live.latitude = 19.8120  # heading north, still in view
+        live.save()
+        moved = self.client.get('/api/tracking/buses/', {'bbox': bbox, 'since': first["version"]}).json()
+        self.assertEqual(moved["buses"], [[self.near.id, 19.812, 85.83, 0, self.near.route_id]])
+
+        live.latitude = 19.8160  # just past the top edge
+        live.save()
+        gone = self.client.get('/api/tracking/buses/', {'bbox': bbox, 'since': moved["version"]}).json()
+        self.assertEqual((gone["buses"], gone["left"]), ([], [self.near.id]))
+
+
+class FleetStateTests(TestCase):
+    def setUp(self):
+        self.bus = Bus.objects.create(bus_number="401")
+        self.live = LiveLocation.objects.create(bus=self.bus, latitude=19.31, longitude=84.79, crowding="High")
+        self.name = f"citybus_fleet_test_{uuid.uuid4().hex[:12]}"
+        self.state = self._attach()
+        self.addCleanup(self.state.close, unlink=True)
+
+    def _attach(self):
+        state = FleetState(self.name, 64)
+        state.validate()
+        return state
+
+    def test_write_read_round_trip(self):
+        self.live.latitude = 19.5
+        self.state.write(self.live)
+        live = self.state.read(self.bus.id)
+        self.assertEqual((live.pk, live.latitude, live.longitude, live.crowding, live.timestamp),
+                         (self.live.pk, 19.5, 84.79, "High", self.live.timestamp))
+        self.assertIsNone(self.state.read(self.bus.id + 1))
+
+    def test_flush_writes_dirty_slots_unless_the_row_is_newer(self):
+        self.live.latitude = 19.6
+        self.live.timestamp = timezone.now()
+        self.state.write(self.live, dirty=True)
+        self.assertEqual(self.state.flush(), 1)
+        self.assertEqual(self.state.flush(), 0)
+        self.assertEqual(LiveLocation.objects.get(pk=self.live.pk).latitude, 19.6)
+
+        self.live.latitude = 19.7
+        self.state.write(self.live, dirty=True)
+        self.live.latitude = 20.0
+        self.live.save()  # direct save after the slot was written
+        self.state.flush()
+        self.assertEqual(LiveLocation.objects.get(pk=self.live.pk).latitude, 20.0)
+
+    def test_failed_flush_keeps_slots_dirty_for_the_next_one(self):
+        self.live.latitude = 19.6
+        self.live.timestamp = timezone.now()
+        self.state.write(self.live, dirty=True)
+        # e.g. "database is locked": the batch fails as a whole
+        with mock.patch('tracking.fleet_state.update_sql', return_value="UPDATE no_such_table SET x = 1"):
+            with self.assertRaises(DatabaseError):
+                self.state.flush()
+        self.assertEqual(LiveLocation.objects.get(pk=self.live.pk).latitude, 19.31)
+        self.assertEqual(self.state.flush(), 1)
+        self.assertEqual(LiveLocation.objects.get(pk=self.live.pk).latitude, 19.6)
+
+    def test_segment_from_another_database_is_not_trusted(self):
+        self.state.write(self.live, dirty=False)
+        LiveLocation.objects.all().delete()  # e.g. a fresh or restored DB
+        other = self._attach()  # the next process to attach
+        self.addCleanup(other.close)
+        self.assertIsNone(other.read(self.bus.id))
+        self.assertIsNone(self.state.read(self.bus.id))
+
+    def test_flushed_slot_newer_than_its_row_is_not_trusted(self):
+        self.state.write(self.live, dirty=False)
+        LiveLocation.objects.filter(pk=self.live.pk).update(timestamp=self.live.timestamp - timedelta(hours=1))
+        other = self._attach()
+        self.addCleanup(other.close)
+        self.assertIsNone(other.read(self.bus.id))
+
+    def test_nearby_index_skips_slots_of_an_older_generation(self):
+        phantom = LiveLocation(pk=999, bus_id=self.bus.id + 1, latitude=19.31, longitude=84.79,
+                               timestamp=timezone.now())
+        self.state.write(phantom, dirty=False)
+        self.state.reset()  # e.g. another DB was attached
+        self.state.write(self.live, dirty=False)
+
+        index = LivePositionIndex()
+        index.synced = 0.0
+        index._sync_fleet_state(self.state)
+        self.assertEqual([bus_id for bus_id, _ in index.grid.nearby(19.31, 84.79, 1)], [self.bus.id])
+
+        self.state.clear(self.bus.id)
+        index._sync_fleet_state(self.state)
+        self.assertEqual(len(index), 0)
+
+    def test_nearby_index_sync_only_checks_changed_slots(self):
+        self.state.write(self.live, dirty=False)
+        index = LivePositionIndex()
+        index.synced = 0.0
+        index._sync_fleet_state(self.state)
+
+        other = LiveLocation(pk=998, bus_id=self.bus.id + 2, latitude=19.32, longitude=84.79,
+                             timestamp=timezone.now() + timedelta(seconds=1))
+        self.state.write(other, dirty=False)
+        with mock.patch.object(self.state, 'trusted', wraps=self.state.trusted) as trusted:
+            index._sync_fleet_state(self.state)
+            index._sync_fleet_state(self.state)  # nothing new: no slot is checked
+        self.assertEqual(trusted.call_count, 1)
+        self.assertEqual(trusted.call_args[0][0].tolist(), [other.bus_id])
+        self.assertEqual(len(index), 2)
+
+
+class LivePositionIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = LivePositionIndex()
+        self.index.synced = 0.0
+        for bus_id in range(1, 1001):
+            self.index._move(bus_id, 19.0 + bus_id * 0.001, 84.0, 1000.0)
+
+    def test_since_query_visits_only_buses_changed_after_it(self):
+        box = (19.0, 83.99, 19.05, 84.01)
+        self.index._move(10, 19.011, 84.0, 1001.0)    # inside the box
+        self.index._move(60, 19.0505, 84.0, 1002.0)   # just outside it
+        self.index._move(10, 19.012, 84.0, 1003.0)    # moved again: listed once
+        self.index._move(900, 19.9, 84.0, 1004.0)     # far away
+        self.index._drop(20)
+        with mock.patch.object(LivePositionIndex, '_sync'), \
+                mock.patch.object(self.index.grid, 'position', wraps=self.index.grid.position) as position:
+            moved, left, version = self.index.in_box(*box, since=1000 * 1000)
+        self.assertEqual(moved, [(10, 19.012, 84.0, 0)])
+        self.assertEqual(sorted(left), [20, 60])
+        self.assertEqual(version, self.index.version[20])
+        self.assertEqual(position.call_count, 4)
+
+
+class BatchETATests(TestCase):
+    """GET /api/tracking/eta/ costs the same queries however many buses it covers."""
+
+    # buses + live locations + stops of every route on the page
+    EXPECTED_QUERIES = 3
+
+    def setUp(self):
+        self.routes = [Route.objects.create(name=f"Line {r}") for r in range(2)]
+        for route in self.routes:
+            for order in range(4):
+                Stop.objects.create(route=route, name=f"{route.name} Stop {order}", order=order,
+                                    latitude=19.80 + order * 0.01, longitude=85.82 + route.id * 0.01)
+        self.count = 0
+
+    def _add_buses(self, count, active=True):
+        buses = []
+        for _ in range(count):
+            route = self.routes[self.count % 2]
+            bus = Bus.objects.create(bus_number=f"9{self.count:03d}", route=route, is_active=active)
+            LiveLocation.objects.create(bus=bus, latitude=19.805, longitude=85.82 + route.id * 0.01,
+                                        current_stop_index=self.count % 3, is_moving_forward=self.count % 4 != 0)
+            buses.append(bus)
+            self.count += 1
+        return buses
+
+    def _get(self, params):
+        invalidate_route_geometry()
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get('/api/tracking/eta/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_constant_queries_for_every_selector(self):
+        for size in (2, 20, 60):
+            self._add_buses(size - Bus.objects.count())
+            numbers = ",".join(Bus.objects.values_list('bus_number', flat=True))
+            self.assertEqual(len(self._get({'buses': numbers})), size)
+            self.assertEqual(len(self._get({'route': self.routes[0].id})), size // 2)
+            self.assertEqual(len(self._get({'active': 'true'})), size)
+
+    def test_items_match_the_single_bus_endpoint(self):
+        buses = self._add_buses(6)
+        self._add_buses(1, active=False)
+        batch = self.client.get('/api/tracking/eta/', {'active': 'true'}).json()
+        self.assertEqual([item["bus_id"] for item in batch], [bus.id for bus in buses])
+        for item, bus in zip(batch, buses):
+            self.assertEqual([item], self.client.get(f'/api/tracking/eta/{bus.bus_number}/').json())
+
+    def test_error_paths(self):
+        tracked = self._add_buses(1)[0]
+        # No live location yet, no route, an out-of-range stop index
+        Bus.objects.create(bus_number="8001", route=self.routes[0])
+        Bus.objects.create(bus_number="8002")
+        LiveLocation.objects.filter(bus=tracked).update(current_stop_index=99)
+
+        response = self.client.get('/api/tracking/eta/', {'buses': f"{tracked.bus_number},8001,8002,nope"})
+        self.assertEqual([item["bus_id"] for item in response.json()], [tracked.id])
+        self.assertEqual(response.json()[0]["current_stop"], "Line 0 Stop 0")
+        self.assertEqual(LiveLocation.objects.get(bus=tracked).current_stop_index, 0)
+
+        self.assertEqual(self.client.get('/api/tracking/eta/', {'buses': "nope"}).json(), [])
+        self.assertEqual(self.client.get('/api/tracking/eta/', {'route': "abc"}).status_code, 400)
+        self.assertEqual(self.client.get('/api/tracking/eta/').status_code, 400)
+        self.assertEqual(self.client.get('/api/tracking/eta/8001/').json(), [])
+        self.assertEqual(self.client.get('/api/tracking/eta/nope/').status_code, 404)
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        self.reporting = Bus.objects.create(bus_number="501")
+        self.new = Bus.objects.create(bus_number="502")
+        self.live = LiveLocation.objects.create(bus=self.reporting, latitude=19.31, longitude=84.79)
+        self.client.force_login(get_user_model().objects.create_user("driver", password="x"))
+
+    def _ping(self, bus, lat, **fields):
+        return {"bus": bus.id, "latitude": lat, "longitude": 84.8, **fields}
+
+    def test_bulk_upsert_last_ping_wins_and_errors_keep_their_index(self):
+        items = [
+            self._ping(self.reporting, 19.40, speed=30),
+            self._ping(self.new, 19.50),
+            "not an object",
+            {"bus": self.new.id, "latitude": 91, "longitude": 84.8},
+            {"bus": 9999, "latitude": 19.5, "longitude": 84.8},
+            self._ping(self.reporting, 19.45, crowding="High"),
+        ]
+        with self.assertNumQueries(6):  # buses, rows, insert, update + the savepoint pair
+            result = ingest_positions(items)
+        self.assertEqual((result["accepted"], result["created"], result["updated"]), (2, 1, 1))
+        self.assertEqual([e["index"] for e in result["errors"]], [2, 3, 4])
+        self.assertIn("latitude", result["errors"][1]["errors"])
+        self.assertIn("bus", result["errors"][2]["errors"])
+
+        live = LiveLocation.objects.get(pk=self.live.pk)
+        # The last ping of a bus is applied alone; fields it leaves out keep their value
+        self.assertEqual((live.latitude, live.crowding, live.speed), (19.45, "High", self.live.speed))
+        self.assertEqual(LiveLocation.objects.get(bus=self.new).latitude, 19.50)
+
+    def test_bulk_endpoint_takes_ndjson(self):
+        body = "\n".join(json.dumps(self._ping(bus, 19.6)) for bus in (self.reporting, self.new))
+        response = self.client.post('/api/tracking/update/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["created"], response.json()["updated"]), (1, 1))
+        self.assertEqual(LiveLocation.objects.filter(latitude=19.6).count(), 2)
+
+    def test_single_update_creates_then_updates_one_row(self):
+        response = self.client.post('/api/tracking/update/', self._ping(self.new, 19.7), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post('/api/tracking/update/', self._ping(self.new, 19.8, speed=20),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(LiveLocation.objects.filter(bus=self.new).values_list('latitude', 'speed')),
+                         [(19.8, 20)])
+
+    def test_single_update_keeps_newer_fleet_state_fields(self):
+        state = FleetState(f"citybus_fleet_test_{uuid.uuid4().hex[:12]}", 64)
+        self.addCleanup(state.close, unlink=True)
+        state.validate()
+        # The simulator moved the bus on; the write-behind flush has not run yet
+        self.live.current_stop_index, self.live.speed = 3, 40
+        state.write(self.live, dirty=True)
+
+        with mock.patch('tracking.fleet_state.get_fleet_state', return_value=state), \
+                mock.patch('tracking.signals.get_fleet_state', return_value=state):
+            response = self.client.post('/api/tracking/update/', self._ping(self.reporting, 19.9),
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()["current_stop_index"], response.json()["speed"]), (3, 40))
+        live = LiveLocation.objects.get(pk=self.live.pk)
+        self.assertEqual((live.latitude, live.current_stop_index, live.speed), (19.9, 3, 40))
+        self.assertEqual(state.read(self.reporting.id).latitude, 19.9)
+
+
+class FleetTickEngineTests(TestCase):
+    """One engine step must leave every bus where MoveBusView's per-bus loop would."""
+
+    def setUp(self):
+        route = Route.objects.create(name="Shuttle")
+        # ~1.1 km apart: a 2 s step at 800 km/h covers ~40% of the segment
+        Stop.objects.create(route=route, name="Depot", order=0, latitude=19.80, longitude=85.82)
+        Stop.objects.create(route=route, name="Beach", order=1, latitude=19.81, longitude=85.82)
+        # (latitude, current_stop_index, is_moving_forward, seconds since arrival)
+        self.starts = {
+            "601": (19.800, 0, True, None),    # leaving the first stop
+            "602": (19.809, 0, True, None),    # about to reach the last stop
+            "603": (19.810, 1, True, 10.0),    # done waiting at the last stop: turns back
+            "604": (19.801, 1, True, None),    # on the way back, about to reach the first stop
+            "605": (19.810, 1, False, 1.0),    # still waiting at the last stop
+        }
+        self.buses = {number: Bus.objects.create(bus_number=number, route=route) for number in self.starts}
+        LiveLocation.objects.bulk_create([LiveLocation(bus=bus, latitude=0, longitude=0) for bus in self.buses.values()])
+        self._place_buses()
+
+    def _place_buses(self):
+        now = timezone.now()
+        for number, (lat, idx, forward, waited) in self.starts.items():
+            LiveLocation.objects.filter(bus=self.buses[number]).update(
+                latitude=lat, longitude=85.82, current_stop_index=idx, is_moving_forward=forward,
+                stop_arrival_time=now - timedelta(seconds=waited) if waited is not None else None,
+            )
+
+    def _positions(self):
+        return {
+            live.bus.bus_number: (round(live.latitude, 9), round(live.longitude, 9),
+                                  live.current_stop_index, live.is_moving_forward)
+            for live in LiveLocation.objects.select_related('bus')
+        }
+
+    def test_step_matches_the_per_bus_simulator(self):
+        engine = FleetTickEngine(interval=2.0, seed=1)
+        self.assertEqual(engine.load(), len(self.starts))
+        self.assertEqual(engine.step(), len(self.starts) - 1)
+        stepped = self._positions()
+
+        # Same starting rows, then the legacy endpoint moves each bus in turn
+        self._place_buses()
+        for number in self.starts:
+            self.assertEqual(self.client.post(f'/api/tracking/move-bus/{number}/').status_code, 200)
+        self.assertEqual(stepped, self._positions())
+
+        self.assertEqual(stepped["602"][2:], (1, True))
+        self.assertLess(stepped["603"][0], 19.810)  # heading back towards the first stop
+        self.assertEqual(stepped["604"][2:], (0, False))
+        self.assertEqual(stepped["605"][:3], (19.81, 85.82, 1))
+
+
+@mock.patch.multiple(stream, POLL_SECONDS=0, HEARTBEAT_SECONDS=0, RESOLVE_SECONDS=0)
+class PositionStreamTests(TestCase):
+    def setUp(self):
+        self.route = Route.objects.create(name="Shuttle")
+        Stop.objects.create(route=self.route, name="Depot", order=0, latitude=19.80, longitude=85.82)
+        Stop.objects.create(route=self.route, name="Beach", order=1, latitude=19.81, longitude=85.82)
+        self.bus = Bus.objects.create(bus_number="701", route=self.route)
+        self.live = LiveLocation.objects.create(bus=self.bus, latitude=19.805, longitude=85.82)
+
+    async def _open(self, **headers):
+        response = await self.async_client.get('/api/tracking/stream/', {'route': self.route.id}, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = response.streaming_content
+        self.assertEqual(await anext(frames), b"retry: 3000\n\n")
+        return frames
+
+    @staticmethod
+    def _parse(frame):
+        lines = dict(line.split(": ", 1) for line in frame.decode().strip().split("\n"))
+        return int(lines["id"]), lines["event"], json.loads(lines["data"])
+
+    async def test_event_carries_the_newest_update_as_its_id(self):
+        frames = await self._open()
+        event_id, event, data = self._parse(await anext(frames))
+        self.assertEqual(event, "positions")
+        self.assertEqual(event_id, round(self.live.timestamp.timestamp() * 1_000_000))
+        bus = data["buses"][0]
+        self.assertEqual((len(data["buses"]), bus["route_id"], bus["latitude"]), (1, self.route.id, 19.805))
+
+    async def test_resume_from_last_event_id_sends_only_later_moves(self):
+        frames = await self._open(**{"Last-Event-ID": str(round(self.live.timestamp.timestamp() * 1_000_000))})
+        # Nothing moved since: the connection is kept alive with comments
+        self.assertEqual(await anext(frames), b": heartbeat\n\n")
+
+        await sync_to_async(LiveLocation.objects.filter(pk=self.live.pk).update)(
+            latitude=19.806, timestamp=self.live.timestamp + timedelta(seconds=2))
+        frame = await anext(frames)
+        while frame == b": heartbeat\n\n":
+            frame = await anext(frames)
+        event_id, _, data = self._parse(frame)
+        self.assertEqual(event_id, round(self.live.timestamp.timestamp() * 1_000_000) + 2_000_000)
+        self.assertEqual([bus["latitude"] for bus in data["buses"]], [19.806])
+
+    async def test_buses_joining_the_route_are_streamed(self):
+        frames = await self._open()
+        await anext(frames)
+        newcomer = await sync_to_async(Bus.objects.create)(bus_number="702", route=self.route)
+        await sync_to_async(LiveLocation.objects.create)(bus=newcomer, latitude=19.801, longitude=85.82)
+        frame = await anext(frames)
+        while frame == b": heartbeat\n\n":
+            frame = await anext(frames)
+        self.assertEqual([bus["bus_id"] for bus in self._parse(frame)[2]["buses"]], [newcomer.id])
+
+    def test_only_get_is_allowed(self):
+        self.assertEqual(self.client.post('/api/tracking/stream/').status_code, 405)
+
+
+# Fixed March dates must not fall to retention when a test first writes today's table
+@override_settings(LOCATION_HISTORY_ENABLED=True, LOCATION_HISTORY_RETENTION_DAYS=36500)
+class LocationHistoryTests(TestCase):
+    def setUp(self):
+        # A fresh buffer per test: rows left over are dropped with it, never flushed elsewhere
+        buffer = mock.patch('tracking.history._buffer', HistoryBuffer())
+        buffer.start()
+        self.addCleanup(buffer.stop)
+        self.bus = Bus.objects.create(bus_number="301")
+        archive = tempfile.TemporaryDirectory()
+        self.addCleanup(archive.cleanup)
+        settings = override_settings(LOCATION_ARCHIVE_DIR=archive.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def _at(self, day, hour):
+        return datetime(2026, 3, day, hour, tzinfo=dt_timezone.utc).timestamp()
+
+    def test_updates_are_appended_and_queried_by_range(self):
+        live = LiveLocation.objects.create(bus=self.bus, latitude=19.31, longitude=84.79)
+        live.latitude = 19.32
+        live.save()
+        flush_location_history()
+        response = self.client.get(f'/api/tracking/history/{self.bus.id}/').json()
+        self.assertEqual([row[1] for row in response["positions"]], [19.31, 19.32])
+
+    def test_bad_time_is_rejected(self):
+        response = self.client.get(f'/api/tracking/history/{self.bus.id}/', {'start': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_flush_keeps_rows_for_a_retry(self):
+        record_rows([(self.bus.id, self._at(1, 1), 19.0, 84.0, 30)])
+        with mock.patch.object(HistoryBuffer, '_insert', side_effect=DatabaseError("disk full")):
+            with self.assertLogs('tracking.history', 'ERROR'):
+                self.assertEqual(flush_location_history(), 0)
+        self.assertEqual(flush_location_history(), 1)
+
+    def test_range_spans_day_tables_and_retention_drops_whole_days(self):
+        record_rows([
+            (self.bus.id, self._at(1, 23), 19.0, 84.0, 30),
+            (self.bus.id, self._at(2, 1), 19.1, 84.0, 30),
+            (self.bus.id, self._at(3, 1), 19.2, 84.0, 30),
+        ])
+        flush_location_history()
+        start = datetime(2026, 3, 1, 12, tzinfo=dt_timezone.utc)
+        rows = position_history(self.bus.id, start, start + timedelta(days=2))
+        self.assertEqual([lat for _, lat, _, _ in rows], [19.0, 19.1, 19.2])
+
+        dropped = drop_expired_partitions(today=date(2026, 3, 4), retention_days=2)
+        self.assertEqual(dropped, [date(2026, 3, 1)])
+        self.assertEqual([lat for _, lat, _, _ in position_history(self.bus.id, start, start + timedelta(days=2))],
+                         [19.1, 19.2])
+
+    def test_closed_days_move_to_the_archive(self):
+        route = Route.objects.create(name="Berhampur Line")
+        other = Bus.objects.create(bus_number="302", route=route)
+        record_rows([
+            (self.bus.id, self._at(1, 2), 19.0, 84.0, 30),
+            (other.id, self._at(1, 1), 18.0, 83.0, 20),
+            (self.bus.id, self._at(1, 1), 19.1, 84.0, 30),
+            (self.bus.id, self._at(2, 1), 19.2, 84.0, 30),
+        ])
+        flush_location_history()
+        other.route = Route.objects.create(name="Gopalpur Line")  # reassigned after the day
+        other.save()
+        start = datetime(2026, 3, 1, tzinfo=dt_timezone.utc)
+        self.assertEqual(compact_closed_days(today=date(2026, 3, 2)), {date(2026, 3, 1): 3})
+        self.assertNotIn(date(2026, 3, 1), history_tables())
+        self.assertIn(date(2026, 3, 2), history_tables())
+
+        # A late row of the archived day is merged on the next compaction
+        record_rows([(self.bus.id, self._at(1, 3), 19.3, 84.0, 30)])
+        flush_location_history()
+        rows = position_history(self.bus.id, start, start + timedelta(days=2))
+        self.assertEqual([lat for _, lat, _, _ in rows], [19.1, 19.0, 19.3, 19.2])
+        self.assertEqual(compact_closed_days(today=date(2026, 3, 2)), {date(2026, 3, 1): 4})
+
+        columns = route_positions(route.id, start, start + timedelta(days=1))
+        self.assertEqual((columns["lat"].tolist(), columns["speed"].tolist()), ([18.0], [20]))
+        self.assertEqual(len(route_positions(other.route_id, start, start + timedelta(days=1))["lat"]), 0)
+        rows = position_history(self.bus.id, start, start + timedelta(days=2))
+        self.assertEqual([lat for _, lat, _, _ in rows], [19.1, 19.0, 19.3, 19.2])
@@ -1,26 +1,50 @@
-from django.urls import path
+from django.urls import path, re_path
 from .views import (
     UpdateLocationView,
+    BulkUpdateLocationView,
     CurrentLocationView,
     BusETAView,
+    BatchBusETAView,
     BusRouteView,
     MoveBusView,
+    NearbyBusesView,
+    PositionHistoryView,
+    ViewportBusesView,
+    stream_positions,
 )
 
 urlpatterns = [
     # 🛰 live location update
     path("update/", UpdateLocationView.as_view()),
 
+    # 🛰 bulk live location ingest (JSON array or NDJSON)
+    path("update/bulk/", BulkUpdateLocationView.as_view()),
+
     # 📍 current bus location
     path("location/<int:bus_id>/", CurrentLocationView.as_view()),
 
+    # ⏱ ETA for many buses (?buses=100,200 | ?route=1 | ?active=true)
+    path("eta/", BatchBusETAView.as_view()),
+
     # ⏱ ETA 
     path("eta/<str:bus_no>/", BusETAView.as_view()),
 
+    # 📍 active buses near a point (?lat=&lng=&radius=)
+    re_path(r"^nearby/?$", NearbyBusesView.as_view()),
+
+    # 🗺 active buses inside the map viewport (?bbox=minLng,minLat,maxLng,maxLat[&since=])
+    re_path(r"^buses/?$", ViewportBusesView.as_view()),
+
+    # 🕓 recorded positions of a bus (?start=&end=)
+    path("history/<int:bus_id>/", PositionHistoryView.as_view()),
+
     # 🛣 route + stops
     path("route/<str:bus_no>/", BusRouteView.as_view()),
 
     # 🚌 move bus simulation
     path("move-bus/<str:bus_no>/", MoveBusView.as_view()),
+
+    # 📡 live positions stream (SSE)
+    path("stream/", stream_positions),
 ]
 
@@ -1,4 +1,10 @@
 import math
+from collections import defaultdict
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
 
 def haversine(lat1, lon1, lat2, lon2):
     R = 6371  # Earth radius in KM
@@ -12,3 +18,120 @@ def haversine(lat1, lon1, lat2, lon2):
 
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return R * c  # distance in KM
+
+
+def bearing(lat1, lon1, lat2, lon2):
+    """Initial compass bearing (degrees, 0 = north, clockwise) from point 1 to point 2."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_lon = math.radians(lon2 - lon1)
+    x = math.sin(d_lon) * math.cos(phi2)
+    y = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(d_lon)
+    return (math.degrees(math.atan2(x, y)) + 360) % 360
+
+
+# =========================
+# BATCH (NUMPY) VERSIONS
+# =========================
+def haversine_pairwise(lat1, lon1, lat2, lon2):
+    """
+    Element-wise haversine over arrays (or scalars, broadcast: one point
+    against many is haversine_pairwise(lat, lon, lats, lons)).
+    Returns a float64 array of distances in KM.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    lon2 = np.radians(np.asarray(lon2, dtype=np.float64))
+
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_KM * c
+
+
+def segment_distances(lats, lons):
+    """Distances (KM) between consecutive points of a polyline, length n - 1."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    if lats.size < 2:
+        return np.zeros(0)
+    return haversine_pairwise(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+# =========================
+# SPATIAL GRID
+# =========================
+KM_PER_DEGREE_LAT = 111.32
+
+
+class GridIndex:
+    """
+    Points bucketed into a uniform lat/lng grid (cells `cell_km` tall), so a
+    radius query only looks at the few cells its bounding box overlaps
+    instead of every point. Points are keyed by id and can be moved.
+    """
+
+    def __init__(self, cell_km):
+        self.cell_deg = cell_km / KM_PER_DEGREE_LAT
+        self.cells = defaultdict(dict)  # (row, col) -> {key: (lat, lng)}
+        self.where = {}                 # key -> (row, col)
+
+    def __len__(self):
+        return len(self.where)
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def insert(self, key, lat, lng):
+        self.remove(key)
+        cell = self._cell(lat, lng)
+        self.cells[cell][key] = (lat, lng)
+        self.where[key] = cell
+
+    def remove(self, key):
+        cell = self.where.pop(key, None)
+        if cell is not None:
+            bucket = self.cells[cell]
+            bucket.pop(key, None)
+            if not bucket:
+                del self.cells[cell]
+
+    def position(self, key):
+        cell = self.where.get(key)
+        return self.cells[cell][key] if cell is not None else None
+
+    def cells_in_box(self, min_lat, min_lng, max_lat, max_lng):
+        """Non-empty cells overlapping the box."""
+        row0, col0 = self._cell(min_lat, min_lng)
+        row1, col1 = self._cell(max_lat, max_lng)
+        if (row1 - row0 + 1) * (col1 - col0 + 1) > len(self.cells):
+            # Box wider than the data: walk the occupied cells instead
+            return [bucket for (row, col), bucket in self.cells.items()
+                    if row0 <= row <= row1 and col0 <= col <= col1]
+        return [self.cells[(row, col)]
+                for row in range(row0, row1 + 1)
+                for col in range(col0, col1 + 1)
+                if (row, col) in self.cells]
+
+    def in_box(self, min_lat, min_lng, max_lat, max_lng):
+        """[(key, lat, lng)] inside the box."""
+        return [
+            (key, lat, lng)
+            for bucket in self.cells_in_box(min_lat, min_lng, max_lat, max_lng)
+            for key, (lat, lng) in bucket.items()
+            if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+        ]
+
+    def nearby(self, lat, lng, radius_km):
+        """[(key, distance_km)] within `radius_km`, nearest first (exact haversine)."""
+        d_lat = radius_km / KM_PER_DEGREE_LAT
+        d_lng = d_lat / max(math.cos(math.radians(min(abs(lat) + d_lat, 89.9))), 1e-6)
+        found = self.in_box(lat - d_lat, lng - d_lng, lat + d_lat, lng + d_lng)
+        if not found:
+            return []
+        keys, lats, lngs = zip(*found)
+        dists = haversine_pairwise(lat, lng, lats, lngs)
+        hits = [(keys[i], float(dists[i])) for i in np.flatnonzero(dists <= radius_km)]
+        hits.sort(key=lambda hit: hit[1])
+        return hits
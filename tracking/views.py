@@ -1,17 +1,31 @@
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework.parsers import JSONParser
 import random
 from rest_framework.authentication import TokenAuthentication, SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
 
 from buses.models import Bus
 from routes.models import Route
+from routes.geometry import get_route_geometry
+from routes.conditional import bus_route_etag, bus_route_last_modified
 from stops.models import Stop
 from .models import LiveLocation
 from .serializers import LiveLocationSerializer
+from .parsers import NDJSONParser
+from .history import position_history
+from .ingest import ingest_positions
+from .nearby import get_live_position_index, parse_bbox, parse_nearby_query
+from .fleet_state import load_live_location, save_live_location
+from .stream import StreamFilterError, position_events, resolve_stream_buses
 from .utils import haversine
+from .eta import compute_stops_eta, collect_bus_etas
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_GET
 from datetime import timedelta
 
 
@@ -25,30 +39,86 @@ class UpdateLocationView(APIView):
     authentication_classes = [TokenAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
     def post(self, request):
-        serializer = LiveLocationSerializer(data=request.data)
+        # One row per bus: update it if the bus already reported a position.
+        # Fields the ping leaves out keep their shared fleet state values,
+        # which may be newer than the row
+        bus_id = request.data.get('bus') if isinstance(request.data, dict) else None
+        existing = None
+        if str(bus_id).isdigit():
+            existing = load_live_location(int(bus_id))
+        serializer = LiveLocationSerializer(existing, data=request.data)
         if serializer.is_valid():
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(
+                serializer.data,
+                status=status.HTTP_200_OK if existing else status.HTTP_201_CREATED
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+# =========================
+# BULK LIVE LOCATION INGEST
+# =========================
+class BulkUpdateLocationView(APIView):
+    """
+    POST: many device pings at once, as a JSON array or NDJSON
+    (Content-Type: application/x-ndjson).
+    Valid pings are upserted in one transaction; invalid ones are reported
+    per item by their index in the request body.
+    """
+    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {"detail": "Expected a JSON array or NDJSON body"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        result = ingest_positions(items)
+        code = status.HTTP_200_OK if result["accepted"] or not items else status.HTTP_400_BAD_REQUEST
+        return Response(result, status=code)
+
+
 # =========================
 # CURRENT BUS LOCATION
 # =========================
+def _validator_location(request, bus_id):
+    if not hasattr(request, '_validator_location'):
+        request._validator_location = load_live_location(bus_id)
+    return request._validator_location
+
+
+def location_etag(request, bus_id):
+    # Served from the shared fleet table: a 304 costs no DB access at all
+    location = _validator_location(request, bus_id)
+    if not location or not location.timestamp:
+        return None
+    return f"loc-{bus_id}-{location.timestamp.timestamp()}"
+
+
+def location_last_modified(request, bus_id):
+    location = _validator_location(request, bus_id)
+    return location.timestamp if location else None
+
+
 class CurrentLocationView(APIView):
     """
     GET: frontend fetches current bus location
     """
+    @method_decorator(condition(etag_func=location_etag, last_modified_func=location_last_modified))
     def get(self, request, bus_id):
-        try:
-            bus = Bus.objects.get(id=bus_id)
-        except Bus.DoesNotExist:
+        # Shared fleet state first: no DB access once the bus has a slot
+        location = load_live_location(bus_id)
+        if not location and not Bus.objects.filter(id=bus_id).exists():
             return Response(
                 {"detail": "Bus not found"},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        location = LiveLocation.objects.filter(bus=bus).first()
         if not location:
             return Response(
                 {"detail": "No live location yet"},
@@ -74,101 +144,170 @@ class BusETAView(APIView):
         if not buses.exists():
             return Response({"detail": "Bus not found"}, status=404)
 
-        results = []
+        return Response(collect_bus_etas(buses, bus_speed))
 
-        for bus in buses:
-            live = LiveLocation.objects.filter(bus=bus).first()
-            if not live or not bus.route:
-                continue
 
-            stops = list(Stop.objects.filter(route=bus.route).order_by("order"))
-            if not stops:
-                continue
+# =========================
+# BATCH ETA (MANY BUSES)
+# =========================
+class BatchBusETAView(APIView):
+    """
+    GET: Same per-bus payload as BusETAView for many buses in one call.
+      ?buses=100,200,301   -> these bus numbers
+      ?route=<route_id>    -> every bus on a route
+      ?active=true         -> every active bus
+    Query count stays constant however many buses are requested.
+    """
+    def get(self, request):
+        # Same speed as BusETAView so both endpoints agree
+        bus_speed = 60
 
-            current_idx = live.current_stop_index
+        bus_numbers = [b.strip() for b in request.query_params.get('buses', '').split(',') if b.strip()]
+        route_id = request.query_params.get('route')
+        active = request.query_params.get('active', '').lower() in ('1', 'true', 'yes')
+
+        if bus_numbers:
+            buses = Bus.objects.filter(bus_number__in=bus_numbers)
+        elif route_id:
+            if not route_id.isdigit():
+                return Response({"detail": "route must be a route id"}, status=400)
+            buses = Bus.objects.filter(route_id=int(route_id))
+        elif active:
+            buses = Bus.objects.filter(is_active=True)
+        else:
+            return Response(
+                {"detail": "Provide 'buses', 'route' or 'active=true'"},
+                status=400
+            )
 
-            # SAFETY CHECK: Valid index?
-            if current_idx >= len(stops) or current_idx < 0:
-                current_idx = 0
-                # Optionally auto-correct DB
-                live.current_stop_index = 0
-                live.save()
-            forward = live.is_moving_forward
-            total_stops = len(stops)
-            
-            # Calculate ETAs for all stops from the current position
-            stops_eta = []
-            
-            # Simple simulation of path
-            temp_idx = current_idx
-            temp_forward = forward
-            temp_lat = live.latitude
-            temp_lon = live.longitude
-            accumulated_time = 0
-            
-            # SAFETY CHECK: Fix direction if stuck at terminal
-            if current_idx == 0 and not forward:
-                forward = True
-            elif current_idx == len(stops) - 1 and forward:
-                forward = False
-
-            # We calculate ETA for the next 10 stop-steps or until end of route
-            stops_to_visit = stops[current_idx+1:] if forward else stops[:current_idx][::-1]
-            
-            # If at the very end, we might be waiting or about to turn
-            if not stops_to_visit:
-                pass
+        return Response(collect_bus_etas(buses.order_by('id'), bus_speed))
 
-            for next_stop in stops_to_visit:
-                dist = haversine(temp_lat, temp_lon, next_stop.latitude, next_stop.longitude)
-                travel_time_min = (dist / bus_speed) * 60
-                
-                # Add stop delay if it's not the first segment
-                if accumulated_time > 0:
-                    accumulated_time += (3 / 60) # 3 seconds wait
-                
-                accumulated_time += travel_time_min
-                
-                
-                stops_eta.append({
-                    "stop_name": next_stop.name,
-                    "eta_minutes": max(1, round(accumulated_time)),
-                    "order": next_stop.order
-                })
-                
-                # Update temp pos for next segment
-                temp_lat = next_stop.latitude
-                temp_lon = next_stop.longitude
 
-            # Handle case where no stops provided
-            if stops_eta:
-                next_stop_name = stops_eta[0]["stop_name"]
-                first_eta = stops_eta[0]["eta_minutes"]
-            else:
-                # Fallback: If no stops in ETA list, we are at terminal.
-                # If forward=True at the end, we are at Last Stop. Target is turn around? 
-                # Display current stop as "Arrived at X" or just X.
-                next_stop_name = stops[current_idx].name
-                first_eta = 0
+# =========================
+# NEARBY BUSES
+# =========================
+class NearbyBusesView(APIView):
+    """
+    GET ?lat=&lng=&radius=<meters, default 500>&limit=<default 20>
+    Active buses whose live position is within the radius, nearest first.
+    Positions come from an in-memory grid synced incrementally (tracking.nearby);
+    only the matching buses are read from the DB.
+    """
+    def get(self, request):
+        try:
+            lat, lng, radius_km, limit = parse_nearby_query(request.query_params)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
 
+        index = get_live_position_index()
+        hits = index.nearby(lat, lng, radius_km)
+        buses = Bus.objects.filter(
+            id__in=[bus_id for bus_id, _ in hits], is_active=True
+        ).select_related('route').in_bulk()
+
+        results = []
+        for bus_id, dist_km in hits:
+            bus = buses.get(bus_id)
+            position = index.position(bus_id)
+            if bus is None or position is None:
+                continue
             results.append({
                 "bus_id": bus.id,
-                "bus_no": bus.bus_number,
-                "current_stop": stops[current_idx].name,
-                "is_moving_forward": forward,
-                "stops_eta": stops_eta,
-                # For backward compatibility
-                "next_stop": next_stop_name,
-                "eta_minutes": first_eta,
-                "next_stop_name": next_stop_name,
-                "next_stop_eta_minutes": first_eta,
-                "speed": live.speed,
-                "crowding": live.crowding
+                "bus_number": bus.bus_number,
+                "route_id": bus.route_id,
+                "route_name": bus.route.name if bus.route else None,
+                "latitude": position[0],
+                "longitude": position[1],
+                "distance_m": round(dist_km * 1000),
             })
-
+            if len(results) == limit:
+                break
         return Response(results)
 
 
+# =========================
+# BUSES IN MAP VIEWPORT
+# =========================
+class ViewportBusesView(APIView):
+    """
+    GET ?bbox=minLng,minLat,maxLng,maxLat[&since=<version>]
+    Active buses inside the box as compact rows (see "fields"). Pass the
+    returned "version" as `since` on the next refresh to get only buses that
+    moved since, plus the ids that "left" the box.
+    """
+    FIELDS = ["id", "lat", "lng", "heading", "route_id"]
+
+    def get(self, request):
+        try:
+            box = parse_bbox(request.query_params.get('bbox'))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=400)
+        since = request.query_params.get('since')
+        if since is not None:
+            if not since.isdigit():
+                return Response({"detail": "since must be a version from a previous response"}, status=400)
+            since = int(since)
+
+        moved, left, version = get_live_position_index().in_box(*box, since=since)
+        routes = dict(
+            Bus.objects.filter(id__in=[row[0] for row in moved], is_active=True).values_list('id', 'route_id')
+        )
+        buses = [
+            [bus_id, round(lat, 6), round(lng, 6), heading, routes[bus_id]]
+            for bus_id, lat, lng, heading in moved
+            if bus_id in routes
+        ]
+        return Response({
+            "version": version,
+            "fields": self.FIELDS,
+            "buses": buses,
+            "left": left,
+        })
+
+
+# =========================
+# POSITION HISTORY
+# =========================
+class PositionHistoryView(APIView):
+    """
+    GET ?start=<ISO time>&end=<ISO time> (default: the last hour)
+    Every recorded position of a bus in the range, oldest first.
+    """
+    MAX_RANGE = timedelta(days=7)
+
+    def get(self, request, bus_id):
+        start = _parse_time(request.query_params.get('start'))
+        end = _parse_time(request.query_params.get('end'))
+        if start is False or end is False:
+            return Response({"detail": "start/end must be ISO 8601 times"}, status=400)
+        end = end or timezone.now()
+        start = start or end - timedelta(hours=1)
+        if not start < end <= start + self.MAX_RANGE:
+            return Response({"detail": "start must be before end, at most 7 days apart"}, status=400)
+
+        rows = position_history(bus_id, start, end)
+        return Response({
+            "bus_id": bus_id,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "fields": ["time", "lat", "lng", "speed"],
+            "positions": [[t.isoformat(), lat, lng, speed] for t, lat, lng, speed in rows],
+        })
+
+
+def _parse_time(value):
+    """Aware datetime, None when missing, False when invalid."""
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        return False
+    if parsed is None:
+        return False
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
 # =========================
 # BUS ROUTE (POLYLINE)
 # =========================
@@ -176,6 +315,7 @@ class BusRouteView(APIView):
     """
     GET: Returns ordered stops for a bus route
     """
+    @method_decorator(condition(etag_func=bus_route_etag, last_modified_func=bus_route_last_modified))
     def get(self, request, bus_no):
         # We assume all buses with the same number share the same route
         bus = Bus.objects.filter(bus_number=str(bus_no)).select_related('route').first()
@@ -232,19 +372,21 @@ class MoveBusView(APIView):
             if not route:
                 continue
 
-            stops = list(Stop.objects.filter(route=route).order_by("order"))
-            if not stops:
+            geometry = get_route_geometry(route.id)
+            if not len(geometry):
                 continue
 
-            live, _ = LiveLocation.objects.get_or_create(
-                bus=bus,
-                defaults={
-                    "latitude": stops[0].latitude,
-                    "longitude": stops[0].longitude,
-                    "current_stop_index": 0,
-                    "is_moving_forward": True
-                }
-            )
+            live = load_live_location(bus.id)
+            if live is None:
+                live, _ = LiveLocation.objects.get_or_create(
+                    bus=bus,
+                    defaults={
+                        "latitude": geometry.lats[0],
+                        "longitude": geometry.lngs[0],
+                        "current_stop_index": 0,
+                        "is_moving_forward": True
+                    }
+                )
 
             # --- Logic 0: Dynamic Data Simulation ---
             if random.random() < 0.2: 
@@ -258,28 +400,28 @@ class MoveBusView(APIView):
                 
                 # 5 seconds delay ONLY at Start (0) and End (total_stops - 1)
                 required_delay = 0
-                if live.current_stop_index == 0 or live.current_stop_index == len(stops) - 1:
+                if live.current_stop_index == 0 or live.current_stop_index == len(geometry) - 1:
                     required_delay = 5.0
                 
                 if time_at_stop < required_delay:
                     current_status = "WAITING"
                 else:
                     live.stop_arrival_time = None
-                    live.save()
+                    save_live_location(live)
             
             # Use current state
             current_idx = live.current_stop_index
             
             # SAFETY CHECK
-            if current_idx >= len(stops) or current_idx < 0:
+            if current_idx >= len(geometry) or current_idx < 0:
                 current_idx = 0
                 live.current_stop_index = 0
-                live.latitude = stops[0].latitude
-                live.longitude = stops[0].longitude
-                live.save()
+                live.latitude = geometry.lats[0]
+                live.longitude = geometry.lngs[0]
+                save_live_location(live)
             
             forward = live.is_moving_forward
-            stop_name = stops[current_idx].name
+            stop_name = geometry.names[current_idx]
             
             new_latitude = live.latitude
             new_longitude = live.longitude
@@ -288,26 +430,23 @@ class MoveBusView(APIView):
             # --- Logic 2: Movement ---
             if current_status != "WAITING":
                 if forward:
-                    next_idx = current_idx + 1 if current_idx < len(stops) - 1 else current_idx - 1
-                    if current_idx >= len(stops) - 1: forward = False
+                    next_idx = current_idx + 1 if current_idx < len(geometry) - 1 else current_idx - 1
+                    if current_idx >= len(geometry) - 1: forward = False
                 else:
                     next_idx = current_idx - 1 if current_idx > 0 else current_idx + 1
                     if current_idx <= 0: forward = True
                 
                 if next_idx < 0: next_idx = 0
-                if next_idx >= len(stops): next_idx = len(stops) - 1
+                if next_idx >= len(geometry): next_idx = len(geometry) - 1
 
-                current_stop = stops[current_idx]
-                next_stop = stops[next_idx]
+                cur_lat, cur_lng = geometry.lats[current_idx], geometry.lngs[current_idx]
+                next_lat, next_lng = geometry.lats[next_idx], geometry.lngs[next_idx]
 
                 # Speed Calculation (High speed requested)
                 # 800 km/h simulation speed for fast visibility
                 simulation_speed = 800 
                 
-                seg_dist_km = haversine(
-                    current_stop.latitude, current_stop.longitude,
-                    next_stop.latitude, next_stop.longitude
-                )
+                seg_dist_km = geometry.distance_between_indexes(current_idx, next_idx)
                 
                 # Avoid division by zero
                 seg_time_sec = (seg_dist_km / simulation_speed) * 3600 if seg_dist_km > 0 else 1.0
@@ -320,7 +459,7 @@ class MoveBusView(APIView):
                 
                 # Calculate current progress on this segment
                 dist_from_start = haversine(
-                    current_stop.latitude, current_stop.longitude,
+                    cur_lat, cur_lng,
                     live.latitude, live.longitude
                 )
                 
@@ -329,16 +468,16 @@ class MoveBusView(APIView):
                 
                 if new_progress >= 0.99:
                     # Arrived at stop
-                    live.latitude = next_stop.latitude
-                    live.longitude = next_stop.longitude
+                    live.latitude = next_lat
+                    live.longitude = next_lng
                     live.current_stop_index = next_idx
                     live.is_moving_forward = forward
                     live.stop_arrival_time = now # Start waiting timer
-                    live.save()
+                    save_live_location(live)
                     
-                    new_latitude = next_stop.latitude
-                    new_longitude = next_stop.longitude
-                    stop_name = next_stop.name
+                    new_latitude = next_lat
+                    new_longitude = next_lng
+                    stop_name = geometry.names[next_idx]
                     current_status = "ARRIVED"
                     progress_pct = 100
                     
@@ -346,60 +485,39 @@ class MoveBusView(APIView):
 
                 else:
                     # Interpolation
-                    total_lat_diff = next_stop.latitude - current_stop.latitude
-                    total_lng_diff = next_stop.longitude - current_stop.longitude
+                    total_lat_diff = next_lat - cur_lat
+                    total_lng_diff = next_lng - cur_lng
                     
-                    new_latitude = current_stop.latitude + (total_lat_diff * new_progress)
-                    new_longitude = current_stop.longitude + (total_lng_diff * new_progress)
+                    new_latitude = cur_lat + (total_lat_diff * new_progress)
+                    new_longitude = cur_lng + (total_lng_diff * new_progress)
                     
                     live.latitude = new_latitude
                     live.longitude = new_longitude
                     live.last_moved_at = now
-                    live.save()
+                    save_live_location(live)
                     
-                    stop_name = f"En route to {next_stop.name}"
+                    stop_name = f"En route to {geometry.names[next_idx]}"
                     progress_pct = round(new_progress * 100, 1)
 
             # --- Logic 3: Calculate ETA (Embedded) ---
-            stops_eta = []
-            accumulated_time = 0
-            temp_lat = new_latitude
-            temp_lon = new_longitude
-            
-            # Determine path
             # SAFETY CHECK: Fix direction if stuck at terminal (same as ETAView)
             temp_forward = live.is_moving_forward
             if current_idx == 0 and not temp_forward:
                 temp_forward = True
-            elif current_idx == len(stops) - 1 and temp_forward:
+            elif current_idx == len(geometry) - 1 and temp_forward:
                 temp_forward = False
 
-            stops_to_visit = stops[current_idx+1:] if temp_forward else stops[:current_idx][::-1]
+            stops_eta = compute_stops_eta(
+                geometry, current_idx, temp_forward,
+                new_latitude, new_longitude, bus_speed
+            )
 
-            for next_s in stops_to_visit:
-                dist = haversine(temp_lat, temp_lon, next_s.latitude, next_s.longitude)
-                travel_time_min = (dist / bus_speed) * 60
-                
-                if accumulated_time > 0:
-                    accumulated_time += (3 / 60) # 3s delay
-                
-                accumulated_time += travel_time_min
-                
-                stops_eta.append({
-                    "stop_name": next_s.name,
-                    "eta_minutes": max(1, round(accumulated_time)),
-                    "order": next_s.order
-                })
-                
-                temp_lat = next_s.latitude
-                temp_lon = next_s.longitude
-            
             # Robust Next Stop Name
             if stops_eta:
                 next_stop_display = stops_eta[0]["stop_name"]
                 first_eta = stops_eta[0]["eta_minutes"]
             else:
-                next_stop_display = stops[current_idx].name
+                next_stop_display = geometry.names[current_idx]
                 first_eta = 0
 
             results.append({
@@ -423,3 +541,30 @@ class MoveBusView(APIView):
             })
 
         return Response(results)
+
+
+# =========================
+# LIVE POSITION STREAM (SSE)
+# =========================
+@require_GET
+def stream_positions(request):
+    """
+    GET: text/event-stream of position + ETA updates.
+      ?bus=<bus_no> | ?route=<route_id> | ?city=<name>   (default: all active buses)
+    Reconnecting clients send Last-Event-ID (or ?last_event_id=) to resume.
+    Needs an ASGI server (transport_backend.asgi) to hold connections cheaply:
+    only this lookup runs in a thread, the stream itself is async.
+    """
+    try:
+        buses = resolve_stream_buses(request.GET)
+    except StreamFilterError as exc:
+        return JsonResponse({"detail": str(exc)}, status=400)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    response = StreamingHttpResponse(
+        position_events(buses, last_event_id, params=request.GET.copy()),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
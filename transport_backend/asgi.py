@@ -3,6 +3,10 @@ ASGI config for transport_backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn transport_backend.asgi:application``)
+so the live position stream (/api/tracking/stream/) holds one coroutine per
+client instead of a whole worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
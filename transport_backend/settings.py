@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 import dj_database_url
 
@@ -180,3 +181,32 @@ CORS_ALLOWED_ORIGINS = [o for o in os.environ.get('CORS_ALLOWED_ORIGINS', '').sp
 AVG_BUS_SPEED_KMPH = 30
 
 
+# Hot fleet state in shared memory (tracking.fleet_state). One slot per bus id,
+# so FLEET_STATE_SLOTS must be larger than the highest Bus id. Off by default
+# under `manage.py test`: test databases are rolled back under a live segment.
+TESTING = sys.argv[1:2] == ['test']
+FLEET_STATE_ENABLED = os.environ.get('FLEET_STATE_ENABLED', str(not TESTING)) == 'True'
+FLEET_STATE_SLOTS = int(os.environ.get('FLEET_STATE_SLOTS', 65536))
+FLEET_STATE_FLUSH_INTERVAL = 2.0  # seconds between write-behind flushes
+
+
+# Trip planner walking transfers (routes.network): stops of other routes within
+# this radius are linked by a footpath, timed at walking speed.
+PLANNER_WALK_RADIUS_M = int(os.environ.get('PLANNER_WALK_RADIUS_M', 400))
+PLANNER_WALK_SPEED_KMPH = 4.5
+
+# Planned trips are cached per (from, to, mode) until the network changes
+# (routes.plan_cache), or for at most PLANNER_CACHE_TTL seconds.
+PLANNER_CACHE_SIZE = int(os.environ.get('PLANNER_CACHE_SIZE', 4096))
+PLANNER_CACHE_TTL = int(os.environ.get('PLANNER_CACHE_TTL', 300))
+
+# Append-only position history (tracking.history): one table per UTC day,
+# written in batches, whole days dropped after the retention period.
+# Off under tests: rows still buffered at exit would land in the real database.
+LOCATION_HISTORY_ENABLED = os.environ.get('LOCATION_HISTORY_ENABLED', str(not TESTING)) == 'True'
+LOCATION_HISTORY_RETENTION_DAYS = int(os.environ.get('LOCATION_HISTORY_RETENTION_DAYS', 30))
+LOCATION_HISTORY_BATCH_SIZE = 500
+LOCATION_HISTORY_FLUSH_INTERVAL = 5.0  # seconds a row may wait for its batch
+# Closed days moved out of the database by `manage.py compact_location_history`
+# (tracking.archive); run it daily, before days pass the retention period.
+LOCATION_ARCHIVE_DIR = os.environ.get('LOCATION_ARCHIVE_DIR', str(BASE_DIR / 'location_archive'))
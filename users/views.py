@@ -23,7 +23,7 @@ class FavoriteRouteListCreateView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return FavoriteRoute.objects.filter(user=self.request.user)
+        return FavoriteRoute.objects.filter(user=self.request.user).select_related('route__summary')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)